@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+"""Compares the observers of the test runner (watchdog and native inotify)
+   on a large project tree
+
+   A tree of (by default) 100000 files is created, a test runner watching
+   it is started, and files are modified: mostly irrelevant ones (compiled
+   files, editor swap files, VCS objects), and some Python files. Reported
+   are the time until the test runner has been told about all modified
+   Python files, and the CPU time used meanwhile.
+
+   Usage: python benchmarks/watch_benchmark.py [--files N] [--changes N]
+"""
+
+from __future__ import print_function
+import argparse
+import os
+import os.path as op
+import shutil
+import tempfile
+import threading
+import time
+
+from pytest_purkinje import inotify, testrunner
+
+# Files per directory
+DIR_SIZE = 100
+
+# Names (in each directory) and their share of all files
+FILE_KINDS = [('mod{0}.py', 0.2), ('mod{0}.pyc', 0.2), ('.mod{0}.py.swp', 0.1),
+              ('data{0}.txt', 0.5)]
+
+# Irrelevant changes per relevant change
+NOISE = 20
+
+
+def create_tree(root, file_count):
+    """:return: list of (relevant, path) of all created files
+    """
+    result = []
+    for index in range(0, file_count, DIR_SIZE):
+        dir_ = op.join(root, 'pkg{0}'.format(index // DIR_SIZE))
+        os.makedirs(dir_)
+        count = min(DIR_SIZE, file_count - index)
+        for pattern, share in FILE_KINDS:
+            for i in range(int(round(share * count))):
+                path = op.join(dir_, pattern.format(i))
+                with open(path, 'w') as f:
+                    f.write('x = 1\n')
+                result.append((path.endswith('.py'), path))
+    os.makedirs(op.join(root, '.git', 'objects'))
+    return result
+
+
+def touch_files(root, files, changes):
+    """Modifies `changes` relevant files, and NOISE times as many
+       irrelevant ones
+
+       :return: paths of the modified relevant files
+    """
+    relevant = [x for is_relevant, x in files if is_relevant][:changes]
+    irrelevant = [x for is_relevant, x in files if not is_relevant]
+    git_dir = op.join(root, '.git', 'objects')
+    for i, path in enumerate(relevant):
+        for j in range(NOISE):
+            noise = irrelevant[(i * NOISE + j) % len(irrelevant)]
+            with open(noise, 'w') as f:
+                f.write('y = 2\n')
+            with open(op.join(git_dir, '{0}-{1}'.format(i, j)), 'w') as f:
+                f.write('blob')
+        with open(path, 'w') as f:
+            f.write('x = 2\n')
+    return relevant
+
+
+class Recorder(object):
+
+    """Replaces Handler.run_tests; records the changed paths"""
+
+    def __init__(self, expected):
+        self._expected = set(expected)
+        self.seen = set()
+        self.done = threading.Event()
+
+    def __call__(self, changed_paths=None):
+        if changed_paths is None:  # events lost
+            self.seen |= self._expected
+        else:
+            self.seen.update(changed_paths)
+        if self._expected <= self.seen:
+            self.done.set()
+
+
+def run(observer, root, files, changes, timeout):
+    runner = testrunner.TestRunner(root, debounce=0.05, observer=observer)
+    start = time.time()
+    try:
+        runner.start(single_run=True)
+    except OSError as e:
+        # watchdog uses an inotify instance per directory, of which there
+        # are only few (/proc/sys/fs/inotify/max_user_instances)
+        print('{0:>8}: cannot watch the tree: {1}'.format(observer, e))
+        runner.observer.stop()
+        return
+    setup_time = time.time() - start
+
+    expected = [x for is_relevant, x in files if is_relevant][:changes]
+    recorder = Recorder(expected)
+    runner.event_handler.run_tests = recorder
+    start = time.time()
+    cpu_start = time.process_time()
+    touch_files(root, files, changes)
+    complete = recorder.done.wait(timeout)
+    latency = time.time() - start
+    cpu_time = time.process_time() - cpu_start
+
+    runner.observer.stop()
+    runner.event_handler.stop()
+    runner.observer.join()
+    print('{0:>8}: setup {1:6.2f} s, changes reported after {2:6.2f} s'
+          ' ({3}), CPU {4:6.2f} s'.format(
+              observer, setup_time, latency,
+              'complete' if complete else '{0} of {1}'.format(
+                  len(recorder.seen), changes),
+              cpu_time))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=100000)
+    parser.add_argument('--changes', type=int, default=200)
+    parser.add_argument('--timeout', type=float, default=60)
+    args = parser.parse_args()
+
+    observers = [testrunner.WATCHDOG]
+    if inotify.is_available():
+        observers.append(testrunner.INOTIFY)
+    for observer in observers:
+        root = tempfile.mkdtemp(prefix='purkinje-bench-')
+        try:
+            files = create_tree(root, args.files)
+            run(observer, root, files, args.changes, args.timeout)
+        finally:
+            shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+
+"""Cache of the test cases collected from each test module, keyed by the
+   contents of the module and of the files configuring its collection
+   (conftest.py files, py.test configuration files)
+"""
+
+import collections
+import fnmatch
+import json
+import os
+import os.path as op
+import zlib
+
+import pytest
+
+from .contentindex import file_hash
+from .defs import IGNORED_DIRS
+
+CACHE_FILE = 'collection.json'
+
+# Increased whenever the format of the cache file changes
+CACHE_VERSION = 1
+
+# Configuration files in the root directory which affect collection
+CONFIG_FILES = ('pytest.ini', 'pyproject.toml', 'tox.ini', 'setup.cfg')
+
+_PYTEST_VERSION = tuple(int(x) for x in pytest.__version__.split('.')[:2])
+
+# py.test options selecting a subset of the collected tests
+_SELECTION_OPTIONS = ('keyword', 'markexpr', 'deselect', 'lf')
+
+
+class CollectionCache(object):
+
+    """Node IDs of the test cases of each test module, stored in a JSON
+       file. Paths are relative to the root directory, as in node IDs.
+    """
+
+    def __init__(self, path, root_dir):
+        self._path = path
+        self._root_dir = root_dir
+        # module -> {'hash': int, 'context': int, 'nodeids': [str]}
+        self._modules = {}
+        # absolute path -> hash (or None if missing), for this session
+        self._hashes = {}
+        self._modified = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self._path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if data.get('version') != CACHE_VERSION:
+            return
+        self._modules = data['modules']
+
+    def save(self):
+        if not self._modified:
+            return
+        dir_ = op.dirname(self._path)
+        if dir_ and not op.isdir(dir_):
+            os.makedirs(dir_)
+        tmp_path = '{0}.{1}.tmp'.format(self._path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'modules': self._modules},
+                      f)
+        os.rename(tmp_path, self._path)
+        self._modified = False
+
+    def _hash(self, rel_path):
+        """:return: hash of a file's contents, or None if it does not
+                    exist (files are read once per session)
+        """
+        path = op.join(self._root_dir, rel_path)
+        if path not in self._hashes:
+            try:
+                self._hashes[path] = file_hash(path)
+            except (IOError, OSError):
+                self._hashes[path] = None
+        return self._hashes[path]
+
+    def _context_hash(self, module):
+        """:return: combined hash of the configuration files and of the
+                    conftest.py files in the directories of a module
+        """
+        paths = list(CONFIG_FILES)
+        dir_ = ''
+        for part in [''] + module.split('/')[:-1]:
+            dir_ = '/'.join(x for x in (dir_, part) if x)
+            paths.append('/'.join(x for x in (dir_, 'conftest.py') if x))
+        return zlib.crc32(json.dumps(
+            [self._hash(x) for x in paths]).encode('utf-8'))
+
+    def record(self, module, nodeids):
+        """Records the test cases collected from a module
+        """
+        self._modules[module] = {'hash': self._hash(module),
+                                 'context': self._context_hash(module),
+                                 'nodeids': list(nodeids)}
+        self._modified = True
+
+    def forget(self, module):
+        if self._modules.pop(module, None) is not None:
+            self._modified = True
+
+    def nodeids(self, module):
+        """:return: node IDs of the test cases of a module, or None if the
+                    module or its configuration has changed since they
+                    were recorded
+        """
+        entry = self._modules.get(module)
+        if (entry is None or entry['hash'] != self._hash(module) or
+                entry['context'] != self._context_hash(module)):
+            return None
+        return entry['nodeids']
+
+    def count(self, modules, selected=None):
+        """:param selected: {module: [node ID prefixes]} of modules of
+                            which only some test cases are selected
+           :return: number of test cases of the given modules, or None if
+                    it is unknown for any of them
+        """
+        result = 0
+        for module in modules:
+            nodeids = self.nodeids(module)
+            if nodeids is None:
+                return None
+            prefixes = (selected or {}).get(module)
+            if prefixes:
+                nodeids = [x for x in nodeids
+                           if any(x == p or x.startswith((p + '::', p + '['))
+                                  for p in prefixes)]
+            result += len(nodeids)
+        return result
+
+
+def find_modules(args, root_dir, python_files, norecursedirs):
+    """Determines the test modules py.test collects for the given command
+       line arguments (files, directories and node IDs)
+
+       :return: (modules, {module: [node IDs]} of node ID arguments), or
+                None if the modules cannot be determined without py.test
+    """
+    if not args:
+        return None
+    modules = set()
+    # modules of which only some test cases are selected
+    selected = collections.defaultdict(list)
+    whole = set()
+    for arg in args:
+        path, _, rest = arg.partition('::')
+        path = op.abspath(path)
+        if path != root_dir and not path.startswith(op.join(root_dir, '')):
+            return None
+        rel_path = op.relpath(path, root_dir).replace(op.sep, '/')
+        if op.isfile(path):
+            modules.add(rel_path)
+            if rest:
+                selected[rel_path].append(
+                    '{0}::{1}'.format(rel_path, rest))
+            else:
+                whole.add(rel_path)
+        elif op.isdir(path) and not rest:
+            found = set(_walk(path, root_dir, python_files, norecursedirs))
+            modules.update(found)
+            whole.update(found)
+        else:
+            return None
+    return modules, dict((k, v) for k, v in selected.items()
+                         if k not in whole)
+
+
+def _walk(dir_, root_dir, python_files, norecursedirs):
+    for root, dirs, files in os.walk(dir_):
+        dirs[:] = sorted(
+            x for x in dirs
+            if x not in IGNORED_DIRS and not x.startswith('.') and
+            not any(fnmatch.fnmatch(x, p) for p in norecursedirs))
+        rel_root = op.relpath(root, root_dir).replace(op.sep, '/')
+        for name in files:
+            if name.endswith('.py') and any(
+                    fnmatch.fnmatch(name, p) for p in python_files):
+                yield name if rel_root == '.' else rel_root + '/' + name
+
+
+class CollectionCachePlugin(object):
+
+    """py.test plugin maintaining a CollectionCache: test modules are
+       recorded after collection, unchanged modules which contained no
+       test cases are not collected (imported) again, and if all modules
+       to collect are unchanged, the number of test cases is reported
+       before collection starts
+    """
+
+    def __init__(self, cache, root_dir, announce=None):
+        """:param announce: function called with the number of test cases
+                            if it is known before collection
+        """
+        self._cache = cache
+        self._root_dir = root_dir
+        self._announce = announce
+        # modules collected in this session (without errors)
+        self._collected = set()
+
+    def _rel_path(self, path):
+        return op.relpath(str(path), self._root_dir).replace(op.sep, '/')
+
+    def _expected_count(self, config):
+        if any(config.getoption(x, None) for x in _SELECTION_OPTIONS):
+            return None
+        found = find_modules(config.args, self._root_dir,
+                             config.getini('python_files'),
+                             config.getini('norecursedirs'))
+        if found is None:
+            return None
+        return self._cache.count(*found)
+
+    def pytest_collection(self, session):
+        if self._announce is None:
+            return
+        count = self._expected_count(session.config)
+        if count is not None:
+            self._announce(count)
+
+    def _ignore(self, path):
+        if (op.isfile(str(path)) and
+                self._cache.nodeids(self._rel_path(path)) == []):
+            return True
+        return None
+
+    if _PYTEST_VERSION >= (7, 0):
+        def pytest_ignore_collect(self, collection_path, config):
+            return self._ignore(collection_path)
+    else:
+        # the path argument (py.path.local) is deprecated since pytest 7
+        def pytest_ignore_collect(self, path, config):
+            return self._ignore(path)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_make_collect_report(self, collector):
+        outcome = yield
+        if not isinstance(collector, pytest.Module):
+            return
+        if outcome.get_result().passed:
+            self._collected.add(collector.nodeid)
+        else:
+            self._cache.forget(collector.nodeid)
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_collection_modifyitems(self, items):
+        """Records the test cases before any are deselected or
+           reordered
+        """
+        nodeids = collections.defaultdict(list)
+        for item in items:
+            nodeids[item.nodeid.split('::')[0]].append(item.nodeid)
+        for module in self._collected:
+            if module in nodeids or self._cache.nodeids(module) != []:
+                self._cache.record(module, nodeids.get(module, []))
+
+    def pytest_sessionfinish(self):
+        self._cache.save()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""Index of the contents of project files, to recognize file events which
+   do not change anything (e.g. saving an unmodified file, touch, switching
+   to a branch with identical file contents)
+"""
+
+import json
+import logging
+import os
+import os.path as op
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = 'content.json'
+
+# Increased whenever the format of the index file changes
+CACHE_VERSION = 1
+
+# Size of the blocks in which files are read for hashing (bytes)
+BLOCK_SIZE = 64 * 1024
+
+
+def file_hash(path):
+    """:return: CRC32 of the contents of a file
+    """
+    result = 0
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                return result
+            result = zlib.crc32(block, result)
+
+
+def _stat(path):
+    """:return: (modification time, size), or None if the file does not
+                exist
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+class ContentIndex(object):
+
+    """Modification time, size and hash of the contents of files, stored
+       in a JSON file. Files whose modification time and size are
+       unchanged are not read again.
+    """
+
+    def __init__(self, path=None):
+        """:param path: path of the index file; if None, the index is kept
+                        in memory only
+        """
+        self._path = path
+        # path -> [modification time, size, hash]
+        self._files = {}
+        self._lock = threading.Lock()
+        # serializes writing the index file, so that a snapshot cannot
+        # replace a newer one
+        self._save_lock = threading.Lock()
+        self._modified = False
+        self._load()
+
+    def _load(self):
+        if self._path is None:
+            return
+        try:
+            with open(self._path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if data.get('version') != CACHE_VERSION:
+            return
+        self._files = data['files']
+
+    def save(self):
+        with self._save_lock:
+            with self._lock:
+                if self._path is None or not self._modified:
+                    return
+                files = dict(self._files)
+                self._modified = False
+            dir_ = op.dirname(self._path)
+            if dir_ and not op.isdir(dir_):
+                os.makedirs(dir_)
+            # unique per process: several runners may share the directory
+            tmp_path = '{0}.{1}.tmp'.format(self._path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': CACHE_VERSION, 'files': files}, f)
+            os.rename(tmp_path, self._path)
+
+    def _update(self, path):
+        """:return: True if the contents of a file differ from the indexed
+                    ones (including creation and deletion)
+        """
+        stat = _stat(path)
+        entry = self._files.get(path)
+        if stat is None:
+            if entry is None:
+                return False
+            del self._files[path]
+            self._modified = True
+            return True
+        if entry is not None and tuple(entry[:2]) == stat:
+            return False
+        try:
+            hash_ = file_hash(path)
+        except (IOError, OSError) as e:  # deleted in the meantime
+            logger.debug('Cannot hash %s: %s', path, e)
+            return self._files.pop(path, None) is not None
+        self._files[path] = [stat[0], stat[1], hash_]
+        self._modified = True
+        return entry is None or entry[2] != hash_
+
+    def changed(self, paths):
+        """Updates the index for files which may have changed
+
+           :return: the paths among them whose contents have actually
+                    changed
+        """
+        with self._lock:
+            return [x for x in paths if self._update(x)]
+
+    def scan(self, paths):
+        """Updates the index for existing files without reporting changes
+           (e.g. when starting to watch a project)
+        """
+        self.changed(paths)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+"""Common definitions"""
+
+import os.path as op
+import time
+
+# Directory (relative to the project directory) in which purkinje keeps
+# its caches and indices
+CACHE_DIR = '.purkinje'
+
+# Directories that never contain files relevant to test execution
+IGNORED_DIRS = frozenset([
+    '.git', '.hg', '.svn', '.tox', '.nox', '.venv', 'venv',
+    '__pycache__', '.pytest_cache', 'node_modules', CACHE_DIR])
+
+
+# File (in the cache directory) in which events are kept while the
+# purkinje server is not reachable
+SPOOL_FILE = 'events.spool'
+
+# Special values of --purkinje_suite_key
+SUITE_KEY_GIT_COMMIT = 'git-commit'
+SUITE_KEY_GIT_BRANCH = 'git-branch'
+SUITE_KEY_ROOTDIR = 'rootdir'
+
+# Which test case results to send: all, only those of test cases which
+# did not pass, or none (e.g. if only progress events are of interest)
+RESULTS_ALL = 'all'
+RESULTS_FAILURES = 'failures'
+RESULTS_NONE = 'none'
+
+RESULT_STREAMS = (RESULTS_ALL, RESULTS_FAILURES, RESULTS_NONE)
+
+# What to do when the queue of events to be sent to the purkinje server is
+# full (see sender.EventSender): wait for the sender thread to catch
+# up ...
+BLOCK = 'block'
+# ... discard the oldest pending event ...
+DROP_OLDEST = 'drop-oldest'
+# ... or write the event to a temporary file, to be sent later
+SPILL = 'spill'
+
+BACKPRESSURE_POLICIES = (BLOCK, DROP_OLDEST, SPILL)
+
+DEFAULT_BATCH_SIZE = 1
+DEFAULT_FLUSH_INTERVAL = 0.05
+DEFAULT_QUEUE_SIZE = 10000
+
+# Maximum time (seconds) to wait for the purkinje server to accept a
+# connection ...
+DEFAULT_CONNECT_TIMEOUT = 3.0
+# ... and to accept a frame
+DEFAULT_SEND_TIMEOUT = 10.0
+
+# Clock for measuring time intervals (seconds), unaffected by changes of
+# the system time where available (Python 3)
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+def cache_path(dir_, name):
+    """:return: path of a cache file inside the cache directory of
+                project directory dir_
+    """
+    return op.join(dir_, CACHE_DIR, name)
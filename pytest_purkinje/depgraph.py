@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+"""Selection of test modules affected by a change, based on the import
+   dependencies between the Python modules of a project
+"""
+
+import ast
+import json
+import logging
+import os
+import os.path as op
+
+from .defs import IGNORED_DIRS, cache_path
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = 'depgraph.json'
+
+# Increased whenever the format of the cache file changes
+CACHE_VERSION = 1
+
+# Changes to these files may affect any test
+GLOBAL_FILES = frozenset(['conftest.py', 'setup.py', 'setup.cfg',
+                          'pytest.ini', 'tox.ini'])
+
+
+def is_test_file(path):
+    """Determines whether a file contains test cases (based on
+       py.test's default naming conventions)
+    """
+    name = op.basename(path)
+    return name.endswith('.py') and (name.startswith('test_') or
+                                     name.endswith('_test.py'))
+
+
+def module_name(root_dir, rel_path):
+    """Determines the name under which a module is imported, following
+       the package structure (__init__.py files) upwards from the module,
+       like py.test does when importing test modules
+
+       :param rel_path: path relative to project directory root_dir
+    """
+    dir_, name = op.split(rel_path)
+    parts = [] if name == '__init__.py' else [name[:-len('.py')]]
+    while dir_ and op.isfile(op.join(root_dir, dir_, '__init__.py')):
+        dir_, package = op.split(dir_)
+        parts.insert(0, package)
+    return '.'.join(parts)
+
+
+def parse_imports(source, mod_name, is_package):
+    """Extracts the names of all modules that might get imported by a
+       module (including parent packages)
+
+       :param mod_name: name of the importing module, required to resolve
+                        relative imports
+    """
+    tree = ast.parse(source)
+    package = mod_name if is_package else mod_name.rpartition('.')[0]
+    result = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                result.update(_with_parents(alias.name))
+        elif isinstance(node, ast.ImportFrom):
+            base = _resolve_relative(package, node.module, node.level)
+            if base is None:
+                continue
+            result.update(_with_parents(base))
+            # "from package import name" may refer to a submodule
+            for alias in node.names:
+                if alias.name != '*':
+                    result.add('{0}.{1}'.format(base, alias.name)
+                               if base else alias.name)
+    result.discard('')
+    result.discard(mod_name)
+    return result
+
+
+def _with_parents(name):
+    parts = name.split('.')
+    return ['.'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+
+def _resolve_relative(package, module, level):
+    if not level:
+        return module
+    parts = package.split('.') if package else []
+    if level - 1 > len(parts):
+        return None  # beyond top-level package
+    parts = parts[:len(parts) - (level - 1)]
+    if module:
+        parts.append(module)
+    return '.'.join(parts)
+
+
+class ImportGraph(object):
+
+    """Import dependencies between the Python files of a project
+       directory.
+
+       The graph is cached on disk; on startup, only files that were
+       modified in the meantime have to be parsed again.
+    """
+
+    def __init__(self, dir_, cache_file=None):
+        self._dir = op.abspath(dir_)
+        self._cache_file = cache_file or cache_path(self._dir, CACHE_FILE)
+        # relative path -> {'mtime': float, 'module': str,
+        #                   'imports': [str]}
+        self._files = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self._cache_file) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if data.get('version') != CACHE_VERSION:
+            return
+        self._files = data['files']
+
+    def save(self):
+        cache_dir = op.dirname(self._cache_file)
+        if not op.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with open(self._cache_file, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'files': self._files}, f)
+
+    def _rel_path(self, path):
+        return op.relpath(op.abspath(path), self._dir)
+
+    def update(self):
+        """Brings the graph up to date with the contents of the project
+           directory
+        """
+        found = set()
+        for root, dirs, files in os.walk(self._dir):
+            dirs[:] = [x for x in dirs if x not in IGNORED_DIRS]
+            for name in files:
+                if name.endswith('.py'):
+                    rel_path = self._rel_path(op.join(root, name))
+                    found.add(rel_path)
+                    self._update_file(rel_path)
+        for rel_path in set(self._files) - found:
+            del self._files[rel_path]
+        self.save()
+
+    def _update_file(self, rel_path):
+        """Parses a file again if it has been modified
+        """
+        abs_path = op.join(self._dir, rel_path)
+        try:
+            mtime = op.getmtime(abs_path)
+        except OSError:
+            self._files.pop(rel_path, None)
+            return
+
+        info = self._files.get(rel_path)
+        if info is not None and info['mtime'] == mtime:
+            return
+
+        mod_name = module_name(self._dir, rel_path)
+        try:
+            with open(abs_path, 'rb') as f:
+                imports = parse_imports(f.read(), mod_name,
+                                        rel_path.endswith('__init__.py'))
+        except (SyntaxError, ValueError) as e:
+            logger.warning('Cannot parse %s: %s', rel_path, e)
+            imports = info['imports'] if info else []
+        self._files[rel_path] = {'mtime': mtime,
+                                 'module': mod_name,
+                                 'imports': sorted(imports)}
+
+    def dependents(self, rel_paths):
+        """:return: files which (directly or indirectly) import any of
+                    the given files, including the files themselves
+        """
+        importers = {}
+        for path, info in self._files.items():
+            for imported in info['imports']:
+                importers.setdefault(imported, []).append(path)
+
+        result = set()
+        pending = list(rel_paths)
+        while pending:
+            path = pending.pop()
+            if path in result:
+                continue
+            result.add(path)
+            info = self._files.get(path)
+            if info is not None:
+                pending.extend(importers.get(info['module'], []))
+        return result
+
+    def select(self, changed_paths):
+        """Determines the test files affected by changed files
+
+           :return: list of test files (relative to the project directory),
+                    or None if all tests should be executed
+        """
+        rel_paths = [self._rel_path(x) for x in changed_paths]
+        if any(op.basename(x) in GLOBAL_FILES for x in rel_paths):
+            return None
+
+        # dependents before and after the change: imports may have
+        # been added or removed, and files may have been deleted
+        affected = self.dependents(rel_paths)
+        for rel_path in rel_paths:
+            self._update_file(rel_path)
+        affected.update(self.dependents(rel_paths))
+        self.save()
+
+        return sorted(x for x in affected
+                      if is_test_file(x) and
+                      op.isfile(op.join(self._dir, x)))
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+"""Events in addition to those defined by purkinje_messages"""
+
+import six
+from voluptuous import Required
+
+from purkinje_messages.message import Event, register_eventclass
+
+
+class MsgType(object):
+
+    """Constants for messages"""
+
+    # Durations of the phases of a test case
+    TC_TIMING = 'tc_timing'
+
+    # Resources used by a test case
+    TC_RESOURCES = 'tc_resources'
+
+    # Aggregated progress of a test session
+    SESSION_PROGRESS = 'session_progress'
+
+    # Test case which has become slower than in previous sessions
+    TC_REGRESSION = 'tc_regression'
+
+
+@register_eventclass(MsgType.TC_TIMING)
+class TestCaseTimingEvent(Event):
+
+    def __init__(self, **kwargs):
+        """Message fields:
+            file:        name of file in which the test case is defined
+            name:        name of test case
+            setup_us:    duration of setup (fixtures), in microseconds
+            call_us:     duration of the test function, in microseconds
+            teardown_us: duration of teardown, in microseconds
+            suite_hash:  hash of suite_name for correlation
+        """
+        schema = {Required('file'): six.string_types[0],
+                  Required('name'): six.string_types[0],
+                  Required('setup_us'): int,
+                  Required('call_us'): int,
+                  Required('teardown_us'): int,
+                  Required('suite_hash'): six.string_types[0]}
+        kwargs['type'] = MsgType.TC_TIMING
+        super(TestCaseTimingEvent, self).__init__(schema, **kwargs)
+
+    def _serialize(self, body):
+        pass  # no extra data
+
+
+@register_eventclass(MsgType.TC_RESOURCES)
+class TestCaseResourcesEvent(Event):
+
+    def __init__(self, **kwargs):
+        """Message fields:
+            file:             name of file in which the test case is defined
+            name:             name of test case
+            cpu_us:           CPU time, in microseconds
+            max_rss_delta_kb: growth of the peak resident set size of the
+                              test process, in kB
+            gc_collections:   number of garbage collections
+            alloc_peak_kb:    peak of additionally allocated memory, in kB
+                              (optional)
+            suite_hash:       hash of suite_name for correlation
+        """
+        schema = {Required('file'): six.string_types[0],
+                  Required('name'): six.string_types[0],
+                  Required('cpu_us'): int,
+                  Required('max_rss_delta_kb'): int,
+                  Required('gc_collections'): int,
+                  Required('suite_hash'): six.string_types[0]}
+        if 'alloc_peak_kb' in kwargs:
+            schema[Required('alloc_peak_kb')] = int
+        kwargs['type'] = MsgType.TC_RESOURCES
+        super(TestCaseResourcesEvent, self).__init__(schema, **kwargs)
+
+    def _serialize(self, body):
+        pass  # no extra data
+
+
+@register_eventclass(MsgType.SESSION_PROGRESS)
+class SessionProgressEvent(Event):
+
+    def __init__(self, **kwargs):
+        """Message fields:
+            completed:                number of completed test cases
+            total:                    number of test cases of the session
+            tests_per_second:         test cases completed per second
+            eta:                      estimated remaining time, in seconds
+                                      (-1 if unknown)
+            slowest_running:          node ID of the test case running for
+                                      the longest time ('' if none)
+            slowest_running_duration: time it has been running, in seconds
+            suite_hash:               hash of suite_name for correlation
+        """
+        schema = {Required('completed'): int,
+                  Required('total'): int,
+                  Required('tests_per_second'): float,
+                  Required('eta'): int,
+                  Required('slowest_running'): six.string_types[0],
+                  Required('slowest_running_duration'): float,
+                  Required('suite_hash'): six.string_types[0]}
+        kwargs['type'] = MsgType.SESSION_PROGRESS
+        super(SessionProgressEvent, self).__init__(schema, **kwargs)
+
+    def _serialize(self, body):
+        pass  # no extra data
+
+
+@register_eventclass(MsgType.TC_REGRESSION)
+class TestCaseRegressionEvent(Event):
+
+    def __init__(self, **kwargs):
+        """Message fields:
+            file:        name of file in which the test case is defined
+            name:        name of test case
+            duration_us: duration of the test function, in microseconds
+            baseline_us: median duration in previous sessions, in
+                         microseconds
+            stddev_us:   standard deviation of the previous durations, in
+                         microseconds
+            sigma:       slowdown, in standard deviations (optional;
+                         missing if the previous durations were all
+                         equal)
+            suite_hash:  hash of suite_name for correlation
+        """
+        schema = {Required('file'): six.string_types[0],
+                  Required('name'): six.string_types[0],
+                  Required('duration_us'): int,
+                  Required('baseline_us'): int,
+                  Required('stddev_us'): int,
+                  Required('suite_hash'): six.string_types[0]}
+        if 'sigma' in kwargs:
+            schema[Required('sigma')] = float
+        kwargs['type'] = MsgType.TC_REGRESSION
+        super(TestCaseRegressionEvent, self).__init__(schema, **kwargs)
+
+    def _serialize(self, body):
+        pass  # no extra data
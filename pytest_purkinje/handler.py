@@ -1,20 +1,17 @@
 # -*- coding: utf-8 -*-
 
-import os
-import expiringdict
-from watchdog.events import FileSystemEventHandler, FileMovedEvent
-from datetime import datetime, timedelta
-
+import threading
 
-FILE_CACHE_SIZE = 10000
-
-# Avoid triggering test execution multiple times when the same file
-# was touched more than once; this might happen when the editor creates
-# a backup copy when saving a file
-FILE_CACHE_AGE = 1
+from six.moves import shlex_quote
+from watchdog.events import FileSystemEventHandler, FileMovedEvent
 
+from .procrunner import ProcessRunner, ShardedRunner
+from .quarantine import EXCLUDE, ONLY, load_quarantine
+from .scheduler import RunScheduler, DEFAULT_DEBOUNCE_PERIOD
 
-RETENTION_PERIOD = 1
+# Reported as changed path if changes may have been missed, so that all
+# tests are executed
+ALL_FILES = ''
 
 
 class Handler(FileSystemEventHandler):
@@ -22,17 +19,69 @@ class Handler(FileSystemEventHandler):
     """Triggers test execution when project contents change
     """
 
-    def __init__(self):
-        self._tests_running = False
-        self.clear_cache()
-        self._last_finished = None
-
-    def clear_cache(self):
-        """Clears/initializes file cache
+    def __init__(self, selector=None, pytest_args=None, pool=None,
+                 debounce=DEFAULT_DEBOUNCE_PERIOD, cancel_stale_runs=False,
+                 watch_filter=None, quarantine_lane=None, shards=0,
+                 content_index=None):
+        """:param selector: determines the tests affected by changed files
+                           (see depgraph.ImportGraph.select); if None,
+                           all tests are executed
+           :param pytest_args: additional py.test command line arguments
+           :param pool: if given, a workerpool.WorkerPool executing tests
+                        in warm worker processes instead of a new py.test
+                        process (procrunner.ProcessRunner)
+           :param debounce: time (seconds) to wait for further changes
+                            before starting a test run
+           :param cancel_stale_runs: if True, a test run in progress is
+                                     cancelled when files change
+           :param watch_filter: decides which files are relevant (see
+                                watchfilter.WatchFilter); by default, all
+                                Python files are
+           :param quarantine_lane: if given, the path of a quarantine file
+                                   (see quarantine.QuarantinePolicy); the
+                                   test cases listed in it are executed
+                                   in a separate py.test process in
+                                   parallel to the other tests
+           :param shards: if greater than 1 (and no pool is given), the
+                          tests are distributed to this number of py.test
+                          processes running concurrently
+                          (procrunner.ShardedRunner)
+           :param content_index: if given, a contentindex.ContentIndex;
+                                 changes which leave the contents of all
+                                 files unchanged do not trigger a test
+                                 run
+        """
+        self._selector = selector
+        self._pytest_args = list(pytest_args or [])
+        if pool is not None:
+            self._backend = pool
+        elif shards > 1:
+            self._backend = ShardedRunner(shards)
+        else:
+            self._backend = ProcessRunner()
+        self._watch_filter = watch_filter
+        self._content_index = content_index
+        self._quarantine_lane = quarantine_lane
+        self._lane_runner = None
+        self._lane_thread = None
+        # Editors may touch a file several times when saving it, and
+        # version control operations change many files at once; all of
+        # these changes are handled by a single test run
+        self._scheduler = RunScheduler(
+            self._run_scheduled, debounce,
+            cancel=self.cancel_run if cancel_stale_runs else None)
+
+    def wait_idle(self, timeout=None):
+        """Blocks until all changes seen so far have been tested
         """
-        self._file_cache = expiringdict.ExpiringDict(
-            max_len=FILE_CACHE_SIZE,
-            max_age_seconds=FILE_CACHE_AGE)
+        return self._scheduler.wait_idle(timeout)
+
+    def stop(self):
+        self._scheduler.stop()
+        if self._content_index is not None:
+            self._content_index.save()
+        if self._lane_runner is not None:
+            self._lane_runner.cancel()
 
     def on_created(self, event):
         self._trigger(event)
@@ -48,78 +97,128 @@ class Handler(FileSystemEventHandler):
 
     def _filter(self, path):
         """Determine whether a file is relevant to test execution"""
+        if self._watch_filter is not None:
+            return self._watch_filter.is_relevant_file(path)
         return path.endswith('.py')
 
-    def _is_relevant(self, event):
-        """Determines whether an event is relevant for test execution
-           (based on the file extension)
+    def _event_paths(self, event):
+        """:return: relevant paths to which an event refers
         """
-        relevant = False
+        paths = [event.src_path]
         if isinstance(event, FileMovedEvent):
-            path = event.dest_path
-            if self._filter(path):
-                relevant = True
-        else:
-            path = False
-
-        # for any event
-        if self._filter(event.src_path):
-            relevant = True
-        return relevant
+            paths.append(event.dest_path)
+        return [x for x in paths if self._filter(x)]
 
-    def _get_cache_key(self, event):
-        """Creates key for storing the path to which an event refers
+    def _changed(self, paths):
+        """:return: the paths among the given ones whose contents have
+                    changed
         """
-        if (isinstance(event, FileMovedEvent) and
-                self._filter(event.dest_path)):
-            path = event.dest_path
-        else:
-            path = event.src_path
-        return path
+        if self._content_index is None:
+            return paths
+        return self._content_index.changed(paths)
 
-    def _in_retention_period(self):
-        """:return: True, if the last test execution was just
-                    finished
+    def index_files(self, paths):
+        """Records the current contents of files (e.g. when starting to
+           watch a project), so that later changes can be recognized
         """
-        if not self._last_finished:
-            return False
-        else:
-            time_diff = self._last_finished + timedelta(
-                seconds=RETENTION_PERIOD)
-            return time_diff > datetime.now()
+        if self._content_index is not None:
+            self._content_index.scan(paths)
 
     def _trigger(self, event):
         """Called for any file event that might be of interest for test
            execution.
         """
-        if self._tests_running:
-            # Avoid infinite loop
+        paths = self._event_paths(event)
+        if not paths:
             return
 
-        if self._in_retention_period():
+        paths = self._changed(paths)
+        if not paths:
             return
+        print('>> Trigger: {0}'.format(event))
+        self._scheduler.add(paths)
 
-        relevant = self._is_relevant(event)
+    def add_paths(self, paths):
+        """Reports changed files (e.g. files found in a new directory)
+        """
+        paths = self._changed([x for x in paths if self._filter(x)])
+        if paths:
+            self._scheduler.add(paths)
 
-        if not relevant:
-            return
+    def add_relevant_paths(self, paths):
+        """Reports changed files which are known to be relevant (e.g. a
+           batch of changes reported by inotify.InotifyObserver)
+        """
+        paths = self._changed(paths)
+        if paths:
+            self._scheduler.add(paths)
 
-        cache_key = self._get_cache_key(event)
-        if cache_key in self._file_cache:
-            print('>>>> {0} is cached'.format(cache_key))
+    def add_all(self):
+        """Reports that changes may have been missed, so that all tests
+           are executed in the next run
+        """
+        self._scheduler.add([ALL_FILES])
+
+    def _run_scheduled(self, changed_paths):
+        if self._content_index is not None:
+            self._content_index.save()
+        if ALL_FILES in changed_paths:
+            changed_paths = None
+        self.run_tests(changed_paths)
+
+    def cancel_run(self):
+        """Aborts the test run in progress
+        """
+        self._backend.cancel()
+
+    def _pytest_arguments(self, changed_paths):
+        """:return: py.test command line arguments, or None if no test is
+                    affected by the changes
+        """
+        selected = []
+        if self._selector is not None and changed_paths:
+            selected = self._selector.select(changed_paths)
+            if selected is None:
+                selected = []
+            elif not selected:
+                return None
+        return self._pytest_args + selected
+
+    def _start_lane(self, args):
+        """Executes the quarantined tests among the selected ones in the
+           background; a lane run still in progress is cancelled
+        """
+        if self._lane_runner is None:
+            self._lane_runner = ProcessRunner()
+        if self._lane_thread is not None:
+            self._lane_runner.cancel()
+            self._lane_thread.join()
+        lane_args = args + ['--purkinje_quarantine_mode', ONLY]
+        print('Running quarantined tests: {0}'.format(
+            _format_command(lane_args)))
+        self._lane_thread = threading.Thread(
+            target=self._run_lane, args=(lane_args,),
+            name='purkinje-quarantine')
+        self._lane_thread.daemon = True
+        self._lane_thread.start()
+
+    def _run_lane(self, args):
+        exit_code = self._lane_runner.run(args)
+        print('Quarantined tests finished (exit code {0})'.format(exit_code))
+
+    def run_tests(self, changed_paths=None):
+        args = self._pytest_arguments(changed_paths)
+        if args is None:
+            print('No tests affected by changes')
             return
-        else:
-            print('>>>> {0} NOT in cache'.format(cache_key))
-            self._file_cache[cache_key] = True
+        if (self._quarantine_lane is not None and
+                load_quarantine(self._quarantine_lane)):
+            self._start_lane(args)
+            args = args + ['--purkinje_quarantine_mode', EXCLUDE]
+        print('Running tests: {0}'.format(_format_command(args)))
+        exit_code = self._backend.run(args)
+        print('Test run finished (exit code {0})'.format(exit_code))
 
-        print('>> Trigger: {0}'.format(event))
-        self.run_tests()
-
-    def run_tests(self):
-        print('Running tests')
-        self._tests_running = True
-        try:
-            os.system('py.test')
-        finally:
-            self._tests_running = False
-            self._last_finished = datetime.now()
+
+def _format_command(pytest_args):
+    return ' '.join(shlex_quote(x) for x in ['py.test'] + pytest_args)
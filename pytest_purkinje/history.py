@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+"""History of test outcomes and durations, used to execute the tests
+   most likely to give useful feedback first
+"""
+
+import json
+import logging
+import os
+import os.path as op
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = 'history.json'
+
+# Increased whenever the format of the history file changes
+CACHE_VERSION = 1
+
+
+class TestHistory(object):
+
+    """Outcome and duration of the most recent execution of each test
+       case, stored in a JSON file
+    """
+
+    def __init__(self, path):
+        self._path = path
+        # node ID -> {'failed': bool, 'duration': int (milliseconds)}
+        self._tests = self._read()
+        # node IDs of the test cases recorded in this session
+        self._recorded = set()
+
+    def _read(self):
+        """:return: test cases stored in the history file
+        """
+        try:
+            with open(self._path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        if data.get('version') != CACHE_VERSION:
+            return {}
+        return data['tests']
+
+    def save(self):
+        """Writes the test cases recorded in this session to the history
+           file. Other py.test processes (e.g. shards) may have written it
+           in the meantime; their results are kept.
+        """
+        if not self._recorded:
+            return
+        dir_ = op.dirname(self._path)
+        if dir_ and not op.isdir(dir_):
+            os.makedirs(dir_)
+        tests = self._read()
+        tests.update((x, self._tests[x]) for x in self._recorded)
+        # write to a temporary file first, so that an interrupted session
+        # does not leave a truncated history behind
+        tmp_path = '{0}.{1}.tmp'.format(self._path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'tests': tests}, f)
+        os.rename(tmp_path, self._path)
+        self._tests = tests
+        self._recorded = set()
+
+    def record(self, nodeid, failed, duration):
+        """Records the result of a test case execution
+
+           :param duration: duration in milliseconds
+        """
+        self._tests[nodeid] = {'failed': failed, 'duration': duration}
+        self._recorded.add(nodeid)
+
+    def record_failure(self, nodeid):
+        """Marks a test case as failed (e.g. because of an error during
+           setup or teardown), keeping its duration
+        """
+        entry = self._tests.setdefault(nodeid, {'duration': None})
+        entry['failed'] = True
+        self._recorded.add(nodeid)
+
+    def failed(self, nodeid):
+        entry = self._tests.get(nodeid)
+        return bool(entry and entry['failed'])
+
+    def duration(self, nodeid):
+        """:return: duration (milliseconds) of the last execution, or None
+                    if unknown
+        """
+        entry = self._tests.get(nodeid)
+        return entry['duration'] if entry else None
+
+    def order(self, items):
+        """Sorts test items in place (see order_by_history)
+        """
+        order_by_history(items, self)
+
+
+def order_by_history(items, history):
+    """Sorts test items in place: tests which failed in their last
+       execution come first, followed by the remaining tests grouped
+       by module, fastest module first. Within a module, collection
+       order is retained, so that module and class scoped fixtures
+       are not set up repeatedly. Tests without history count as
+       fast, as they are usually the ones being worked on.
+
+       :param history: provides failed(nodeid) and duration(nodeid)
+                       (milliseconds, or None if unknown)
+    """
+    module_durations = {}
+    for item in items:
+        module = item.nodeid.split('::')[0]
+        module_durations[module] = (module_durations.get(module, 0) +
+                                    (history.duration(item.nodeid) or 0))
+    positions = dict((id(x), i) for i, x in enumerate(items))
+
+    def key(item):
+        return (not history.failed(item.nodeid),
+                module_durations[item.nodeid.split('::')[0]],
+                positions[id(item)])
+
+    items.sort(key=key)
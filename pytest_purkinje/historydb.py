@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+"""Persistent history of test outcomes and durations across sessions, with
+   rolling duration statistics per test case
+"""
+
+import collections
+import json
+import math
+import os
+import os.path as op
+import sqlite3
+import time
+
+from .history import order_by_history
+
+CACHE_FILE = 'history.db'
+
+# Number of most recent durations of a test case from which percentiles
+# are computed
+WINDOW_SIZE = 50
+
+# Number of results after which recorded results are written
+BATCH_SIZE = 500
+
+# Increased whenever the statistics table changes; statistics of other
+# versions are discarded
+SCHEMA_VERSION = 2
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS results (
+           suite_hash TEXT NOT NULL,
+           nodeid TEXT NOT NULL,
+           outcome TEXT NOT NULL,
+           duration_us INTEGER NOT NULL,
+           timestamp REAL NOT NULL)""",
+    """CREATE INDEX IF NOT EXISTS results_test
+           ON results (suite_hash, nodeid)""",
+    """CREATE TABLE IF NOT EXISTS statistics (
+           suite_hash TEXT NOT NULL,
+           nodeid TEXT NOT NULL,
+           runs INTEGER NOT NULL,
+           failures INTEGER NOT NULL,
+           last_outcome TEXT NOT NULL,
+           durations TEXT NOT NULL,
+           outcomes TEXT NOT NULL,
+           PRIMARY KEY (suite_hash, nodeid))""",
+]
+
+# Durations of the recent passed executions of a test case (microseconds)
+DurationStatistics = collections.namedtuple(
+    'DurationStatistics', ['count', 'mean', 'stddev', 'p50', 'p90', 'p99'])
+
+
+def percentile(sorted_values, fraction):
+    """:return: percentile (nearest rank) of a non-empty sorted list
+    """
+    index = int(math.ceil(fraction * len(sorted_values))) - 1
+    return sorted_values[max(0, index)]
+
+
+class TestStatistics(object):
+
+    """Number of executions and failures, last outcome, the outcomes of
+       the most recent executions (first letters) and the durations of the
+       most recent passed executions of a test case. Durations of failed
+       executions are not taken into account, as failing tests often end
+       prematurely.
+    """
+
+    __slots__ = ('runs', 'failures', 'last_outcome', 'durations',
+                 'outcomes')
+
+    def __init__(self, runs=0, failures=0, last_outcome=None,
+                 durations=(), outcomes=''):
+        self.runs = runs
+        self.failures = failures
+        self.last_outcome = last_outcome
+        self.durations = collections.deque(durations, maxlen=WINDOW_SIZE)
+        self.outcomes = outcomes
+
+    def add(self, outcome, duration_us):
+        self.runs += 1
+        if outcome == 'failed':
+            self.failures += 1
+        elif outcome == 'passed':
+            self.durations.append(duration_us)
+        self.last_outcome = outcome
+        self.outcomes = (self.outcomes + outcome[0])[-WINDOW_SIZE:]
+
+    @property
+    def flips(self):
+        """:return: number of changes between passing and failing in the
+                    most recent executions (skipped ones are ignored)
+        """
+        outcomes = self.outcomes.replace('s', '')
+        return sum(1 for a, b in zip(outcomes, outcomes[1:]) if a != b)
+
+    def duration_statistics(self):
+        """:return: DurationStatistics, or None without passed executions
+        """
+        if not self.durations:
+            return None
+        values = sorted(self.durations)
+        count = len(values)
+        mean = float(sum(values)) / count
+        variance = sum((x - mean) ** 2 for x in values) / count
+        return DurationStatistics(count, mean, math.sqrt(variance),
+                                  percentile(values, 0.5),
+                                  percentile(values, 0.9),
+                                  percentile(values, 0.99))
+
+
+class SuiteHistory(object):
+
+    """History of the test cases of one test suite (identified by its
+       suite hash). Like history.TestHistory, it can be used to order
+       tests and to estimate their durations.
+    """
+
+    def __init__(self, database, suite_hash, tests):
+        """:param tests: node ID -> TestStatistics
+        """
+        self._database = database
+        self.suite_hash = suite_hash
+        self._tests = tests
+
+    def record(self, nodeid, outcome, duration_us):
+        """Records the result of a test case execution
+
+           :param outcome: passed, failed or skipped
+        """
+        stats = self._tests.get(nodeid)
+        if stats is None:
+            stats = self._tests[nodeid] = TestStatistics()
+        stats.add(outcome, duration_us)
+        self._database.add_result(self.suite_hash, nodeid, outcome,
+                                  duration_us, stats)
+
+    def statistics(self, nodeid):
+        """:return: DurationStatistics, or None if unknown
+        """
+        stats = self._tests.get(nodeid)
+        return stats.duration_statistics() if stats else None
+
+    def tests(self):
+        """:return: iterable of (node ID, TestStatistics)
+        """
+        return self._tests.items()
+
+    def failed(self, nodeid):
+        stats = self._tests.get(nodeid)
+        return bool(stats and stats.last_outcome == 'failed')
+
+    def duration(self, nodeid):
+        """:return: median duration (milliseconds), or None if unknown
+        """
+        stats = self.statistics(nodeid)
+        return stats.p50 / 1000.0 if stats else None
+
+    def order(self, items):
+        """Sorts test items in place (see history.order_by_history)
+        """
+        order_by_history(items, self)
+
+
+class HistoryDatabase(object):
+
+    """On-disk (SQLite) log of all test case results, and statistics per
+       test case. Results are written in batches.
+    """
+
+    def __init__(self, db_path, batch_size=BATCH_SIZE):
+        dir_ = op.dirname(db_path)
+        if dir_ and not op.isdir(dir_):
+            os.makedirs(dir_)
+        self._db = sqlite3.connect(db_path, timeout=30)
+        version, = self._db.execute('PRAGMA user_version').fetchone()
+        if version != SCHEMA_VERSION:
+            self._db.execute('DROP TABLE IF EXISTS statistics')
+            self._db.execute(
+                'PRAGMA user_version = {0:d}'.format(SCHEMA_VERSION))
+        for statement in SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+        self._batch_size = batch_size
+        self._suites = {}
+        self._results = []
+        # (suite hash, node ID) -> TestStatistics, to be written
+        self._modified = {}
+
+    def suite(self, suite_hash):
+        """:return: SuiteHistory of a test suite
+        """
+        result = self._suites.get(suite_hash)
+        if result is None:
+            rows = self._db.execute(
+                'SELECT nodeid, runs, failures, last_outcome, durations,'
+                ' outcomes FROM statistics WHERE suite_hash = ?',
+                (suite_hash,))
+            tests = dict(
+                (row[0], TestStatistics(row[1], row[2], row[3],
+                                        json.loads(row[4]), row[5]))
+                for row in rows)
+            result = self._suites[suite_hash] = SuiteHistory(
+                self, suite_hash, tests)
+        return result
+
+    def add_result(self, suite_hash, nodeid, outcome, duration_us, stats):
+        """Queues a result and the updated statistics of a test case for
+           writing
+        """
+        self._results.append((suite_hash, nodeid, outcome, duration_us,
+                              time.time()))
+        self._modified[suite_hash, nodeid] = stats
+        if len(self._results) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._results and not self._modified:
+            return
+        self._db.executemany(
+            'INSERT INTO results VALUES (?, ?, ?, ?, ?)', self._results)
+        self._db.executemany(
+            'INSERT OR REPLACE INTO statistics'
+            ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(suite_hash, nodeid, x.runs, x.failures, x.last_outcome,
+              json.dumps(list(x.durations)), x.outcomes)
+             for (suite_hash, nodeid), x in self._modified.items()])
+        self._db.commit()
+        self._results = []
+        self._modified = {}
+
+    def close(self):
+        if self._db is not None:
+            self.flush()
+            self._db.close()
+            self._db = None
+
+    def results(self, suite_hash, nodeid):
+        """:return: list of (outcome, duration (microseconds), timestamp)
+                    of all recorded executions of a test case, oldest
+                    first
+        """
+        self.flush()
+        return self._db.execute(
+            'SELECT outcome, duration_us, timestamp FROM results'
+            ' WHERE suite_hash = ? AND nodeid = ? ORDER BY rowid',
+            (suite_hash, nodeid)).fetchall()
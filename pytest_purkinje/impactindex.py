@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+
+"""Test impact index: records which source files are executed by which
+   test case, so that only the tests affected by a change need to be
+   executed
+"""
+
+import logging
+import os.path as op
+import sqlite3
+import sys
+
+import pytest
+
+from .depgraph import GLOBAL_FILES, is_test_file
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = 'coverage.db'
+
+# Maximum time (seconds) to wait for other processes (pytest-xdist
+# workers) writing to the index
+LOCK_TIMEOUT = 30
+
+SCHEMA = [
+    # line ranges recorded by earlier versions
+    'DROP TABLE IF EXISTS coverage',
+    """CREATE TABLE IF NOT EXISTS file_coverage (
+           nodeid TEXT NOT NULL,
+           file TEXT NOT NULL)""",
+    'CREATE INDEX IF NOT EXISTS file_coverage_file ON file_coverage (file)',
+    """CREATE INDEX IF NOT EXISTS file_coverage_nodeid
+           ON file_coverage (nodeid)""",
+]
+
+
+class CallTracer(object):
+
+    """Lightweight tracer recording the code objects (functions, methods,
+       module bodies) which are called while tracing is active.
+
+       Only 'call' events are observed; no per-line tracing takes place.
+       A tracer which was installed before (e.g. by coverage.py) keeps
+       working.
+    """
+
+    def __init__(self, root_dir):
+        self._root_dir = op.abspath(root_dir)
+        self._codes = set()
+        self._previous = None
+        # code object -> relative path, or None for code outside of the
+        # project directory
+        self._paths = {}
+
+    def _trace(self, frame, event, arg):
+        self._codes.add(frame.f_code)
+        if self._previous is not None:
+            return self._previous(frame, event, arg)
+        return None
+
+    def start(self):
+        self._codes = set()
+        self._previous = sys.gettrace()
+        sys.settrace(self._trace)
+
+    def stop(self):
+        """Stops tracing
+
+           :return: set of relative paths of all files within the project
+                    directory whose code has been executed since start()
+        """
+        sys.settrace(self._previous)
+        self._previous = None
+
+        result = set()
+        for code in self._codes:
+            if code not in self._paths:
+                self._paths[code] = self._project_path(code)
+            if self._paths[code] is not None:
+                result.add(self._paths[code])
+        self._codes = set()
+        return result
+
+    def _project_path(self, code):
+        if code.co_filename.startswith('<'):
+            return None  # e.g. <frozen importlib._bootstrap>, <string>
+        filename = op.abspath(code.co_filename)
+        if not filename.startswith(self._root_dir + op.sep):
+            return None
+        return op.relpath(filename, self._root_dir)
+
+
+class CoverageIndex(object):
+
+    """On-disk (SQLite) index mapping source files to the test cases
+       executing them. Test cases are selected per file: a change anywhere
+       in a file selects all test cases which have executed any of its
+       code.
+
+       Several processes (pytest-xdist workers) may write to the index
+       concurrently: the database is used in WAL mode, and the coverage of
+       each test case is committed right away, so that write locks are
+       only held briefly.
+    """
+
+    def __init__(self, db_path, dir_='.'):
+        """:param dir_: project directory; paths in the index are relative
+                        to this directory
+        """
+        self._dir = op.abspath(dir_)
+        self._db = sqlite3.connect(db_path, timeout=LOCK_TIMEOUT,
+                                   check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        for statement in SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+
+    def record(self, nodeid, coverage):
+        """Replaces coverage information of a test case
+
+           :param coverage: relative paths of the executed files
+        """
+        with self._db:
+            self._db.execute('DELETE FROM file_coverage WHERE nodeid = ?',
+                             (nodeid,))
+            self._db.executemany(
+                'INSERT INTO file_coverage VALUES (?, ?)',
+                [(nodeid, path) for path in coverage])
+
+    def prune(self, module_nodeid, child_nodeids):
+        """Removes test cases of a test module which no longer exist
+
+           :param child_nodeids: node IDs of the functions and classes
+                                 which have been collected from the module
+        """
+        children = set(child_nodeids)
+        prefix = module_nodeid + '::'
+        rows = self._db.execute(
+            "SELECT DISTINCT nodeid FROM file_coverage"
+            " WHERE nodeid LIKE ? ESCAPE '\\'",
+            (_escape_like(prefix) + '%',)).fetchall()
+        stale = [(nodeid,) for nodeid, in rows
+                 if '::'.join(nodeid.split('::')[:2]) not in children]
+        with self._db:
+            self._db.executemany(
+                'DELETE FROM file_coverage WHERE nodeid = ?', stale)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def is_empty(self):
+        return self._db.execute(
+            'SELECT 1 FROM file_coverage LIMIT 1').fetchone() is None
+
+    def tests_for(self, rel_path):
+        """:return: node IDs of test cases executing code in a file
+        """
+        rows = self._db.execute(
+            'SELECT DISTINCT nodeid FROM file_coverage WHERE file = ?',
+            (rel_path,)).fetchall()
+        return set(nodeid for nodeid, in rows)
+
+    def update(self):
+        """The index is updated by the py.test plugin; nothing to do
+        """
+
+    def select(self, changed_paths):
+        """Determines the test cases affected by changed files
+
+           :return: list of test files and node IDs, or None if all tests
+                    should be executed
+        """
+        if self.is_empty():
+            return None
+        result = set()
+        for path in changed_paths:
+            rel_path = op.relpath(op.abspath(path), self._dir)
+            if op.basename(rel_path) in GLOBAL_FILES:
+                return None
+            if is_test_file(rel_path):
+                if op.isfile(op.join(self._dir, rel_path)):
+                    result.add(rel_path)
+            else:
+                result.update(self.tests_for(rel_path))
+
+        # no need to list test cases of modules which run completely
+        modules = set(x for x in result if '::' not in x)
+        return sorted(x for x in result
+                      if x in modules or x.split('::')[0] not in modules)
+
+
+def _escape_like(text):
+    return (text.replace('\\', '\\\\')
+            .replace('%', '\\%')
+            .replace('_', '\\_'))
+
+
+def _index_error(nodeid, error):
+    # e.g. the database is locked by another process for too long; the
+    # test session goes on, and the previous coverage is kept
+    logger.warning('Cannot record coverage of %s: %s', nodeid, error)
+
+
+class CoveragePlugin(object):
+
+    """py.test plugin recording per-test coverage in a CoverageIndex.
+
+       Code executed while collecting a test module (module level code of
+       imported modules) is attributed to the test module as a whole.
+    """
+
+    def __init__(self, index, root_dir):
+        self._index = index
+        self._tracer = CallTracer(root_dir)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_make_collect_report(self, collector):
+        if not isinstance(collector, pytest.Module):
+            yield
+            return
+        self._tracer.start()
+        try:
+            outcome = yield
+        finally:
+            coverage = self._tracer.stop()
+        report = outcome.get_result()
+        try:
+            self._index.record(collector.nodeid, coverage)
+            if report.passed:
+                self._index.prune(collector.nodeid,
+                                  [x.nodeid for x in report.result])
+        except sqlite3.Error as e:
+            _index_error(collector.nodeid, e)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_protocol(self, item, nextitem):
+        self._tracer.start()
+        try:
+            yield
+        finally:
+            coverage = self._tracer.stop()
+        try:
+            self._index.record(item.nodeid, coverage)
+        except sqlite3.Error as e:
+            _index_error(item.nodeid, e)
+
+    def pytest_sessionfinish(self):
+        self._index.close()
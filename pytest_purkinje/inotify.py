@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+"""Native Linux inotify backend for watching project directories
+
+   Compared with watchdog's observer, which creates and dispatches an
+   event object for every file system event, events are read in bulk from
+   the inotify file descriptor, irrelevant file names (compiled files,
+   editor swap files, ...) are dropped while still raw bytes, and the
+   remaining changes are delivered in batches.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import os.path as op
+import select
+import struct
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o0004000
+
+# Events of interest: completed writes, creation, deletion and renaming of
+# files and directories
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_ONLYDIR)
+
+_DIR_CREATED = IN_CREATE | IN_MOVED_TO
+_DIR_DELETED = IN_DELETE | IN_MOVED_FROM
+# Events which are not about files
+_NO_FILE = IN_ISDIR | IN_Q_OVERFLOW | IN_IGNORED
+
+# struct inotify_event: wd, mask, cookie, len (followed by the name)
+EVENT_HEADER = struct.Struct('iIII')
+
+# Size of the buffer for reading events (bytes)
+READ_SIZE = 256 * 1024
+
+# Time (seconds) between checks whether the observer has been stopped
+POLL_INTERVAL = 0.5
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        libc.inotify_init1  # not available in very old C libraries
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+def is_available():
+    """:return: True if inotify can be used on this system
+    """
+    return _libc is not None
+
+
+def _check(result):
+    if result < 0:
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code))
+    return result
+
+
+def parse_events(data, names_of_interest=None):
+    """Parses a buffer of inotify events
+
+       :param names_of_interest: function deciding on the raw (bytes) name
+                                 whether a file event is of interest;
+                                 other events are always returned
+       :return: iterator of (watch descriptor, mask, name (bytes))
+    """
+    offset = 0
+    header_size = EVENT_HEADER.size
+    while offset + header_size <= len(data):
+        wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+        offset += header_size
+        name = data[offset:offset + length].rstrip(b'\0')
+        offset += length
+        if (mask & _NO_FILE or names_of_interest is None or
+                names_of_interest(name)):
+            yield wd, mask, name
+
+
+class InotifyObserver(object):
+
+    """Watches directories (not recursively) using inotify. Relevant
+       changes are reported to the handler by a background thread:
+
+       handler.files_changed(paths)   paths of changed relevant files
+                                      (one call per batch of events)
+       handler.directory_created(path)
+       handler.directory_deleted(path)
+       handler.events_lost()          the kernel's event queue
+                                      overflowed
+    """
+
+    def __init__(self, handler, watch_filter=None):
+        """:param watch_filter: watchfilter.WatchFilter deciding which
+                                files are relevant; by default, all files
+                                are
+        """
+        if _libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._handler = handler
+        self._watch_filter = watch_filter
+        self._suffixes = None
+        if watch_filter is not None:
+            self._suffixes = watch_filter.name_suffixes()
+            if self._suffixes is not None:
+                self._suffixes = tuple(x.encode('utf-8')
+                                       for x in self._suffixes)
+        self._fd = _check(_libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+        self._lock = threading.Lock()
+        # watch descriptor -> directory
+        self._dirs = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def schedule(self, dir_):
+        """Starts watching a directory
+
+           :return: watch descriptor, to be passed to unschedule()
+        """
+        path = dir_ if isinstance(dir_, bytes) else dir_.encode(
+            sys.getfilesystemencoding())
+        wd = _check(_libc.inotify_add_watch(self._fd, path, WATCH_MASK))
+        with self._lock:
+            self._dirs[wd] = dir_
+        return wd
+
+    def unschedule(self, wd):
+        with self._lock:
+            if self._dirs.pop(wd, None) is None:
+                raise KeyError(wd)
+        # fails if the directory no longer exists, in which case the
+        # kernel has removed the watch already
+        _libc.inotify_rm_watch(self._fd, wd)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name='purkinje-inotify')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._fd is not None and not self.is_alive():
+            os.close(self._fd)
+            self._fd = None
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _is_name_of_interest(self, name):
+        return name.endswith(self._suffixes)
+
+    def _run(self):
+        names_of_interest = None
+        if self._suffixes is not None:
+            names_of_interest = self._is_name_of_interest
+        while not self._stopped.is_set():
+            readable, _, _ = select.select([self._fd], [], [],
+                                           POLL_INTERVAL)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._fd, READ_SIZE)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    continue
+                raise
+            try:
+                self._dispatch(parse_events(data, names_of_interest))
+            except Exception as e:
+                logger.exception(e)
+
+    def _dispatch(self, events):
+        changed = []
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                self._handler.events_lost()
+                continue
+            with self._lock:
+                dir_ = self._dirs.get(wd)
+                if mask & IN_IGNORED:
+                    self._dirs.pop(wd, None)
+            if dir_ is None or not name:
+                continue
+            path = op.join(dir_, name.decode(sys.getfilesystemencoding(),
+                                             'replace'))
+            if mask & IN_ISDIR:
+                if mask & _DIR_DELETED:
+                    self._handler.directory_deleted(path)
+                if mask & _DIR_CREATED:
+                    self._handler.directory_created(path)
+            elif (self._watch_filter is None or
+                    self._watch_filter.is_relevant_file(path)):
+                changed.append(path)
+        if changed:
+            # several events (e.g. creation and writing) per file
+            self._handler.files_changed(sorted(set(changed)))
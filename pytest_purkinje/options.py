@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+
+"""Command line options of the py.test plugin
+
+   Registered by the plugin entry point (see plugin.py) in every py.test
+   session, so only lightweight modules may be imported here.
+"""
+
+import os
+
+from . import quarantine, sharding, wireformat
+from .defs import (BACKPRESSURE_POLICIES, BLOCK, DEFAULT_BATCH_SIZE,
+                   DEFAULT_CONNECT_TIMEOUT, DEFAULT_FLUSH_INTERVAL,
+                   DEFAULT_QUEUE_SIZE, DEFAULT_SEND_TIMEOUT, RESULTS_ALL,
+                   RESULT_STREAMS, SPOOL_FILE, SUITE_KEY_GIT_BRANCH,
+                   SUITE_KEY_GIT_COMMIT, SUITE_KEY_ROOTDIR)
+from .regression import DEFAULT_MIN_DELTA, DEFAULT_SIGMA
+from .reportstore import RETAIN_ALL, RETAIN_MODES
+
+# Environment variable enabling the plugin without --purkinje
+ENV_VAR = 'PURKINJE'
+
+# Values of ENV_VAR which enable the plugin
+_ENABLED_VALUES = ('1', 'true', 'yes', 'on')
+
+
+def is_enabled(config):
+    """:return: True if reporting to the purkinje server has been enabled
+                (--purkinje or environment variable ENV_VAR)
+    """
+    return bool(config.getoption('purkinje') or
+                os.environ.get(ENV_VAR, '').lower() in _ENABLED_VALUES)
+
+
+def add_options(parser):
+    parser.addoption(
+        '--purkinje',
+        action='store_true',
+        default=False,
+        dest='purkinje',
+        help=('Report test results to the purkinje server (can also be'
+              ' enabled by setting the environment variable {0} to'
+              ' 1)'.format(ENV_VAR))
+    )
+
+    parser.addoption(
+        '--websocket_host',
+        nargs='?',
+        default='localhost',
+        const=True,
+        dest='websocket_host',
+        help='WebSocket hostname or IP address of purkinje server'
+    )
+
+    parser.addoption(
+        '--websocket_port',
+        nargs='?',
+        default=5000,
+        const=True,
+        dest='websocket_port',
+        help='WebSocket TCP ort of purkinje server'
+    )
+
+    parser.addoption(
+        '--purkinje_connect_timeout',
+        type=float,
+        default=DEFAULT_CONNECT_TIMEOUT,
+        dest='purkinje_connect_timeout',
+        metavar='SECONDS',
+        help=('Maximum time to wait for the purkinje server to accept the'
+              ' connection (0: no limit)')
+    )
+
+    parser.addoption(
+        '--purkinje_send_timeout',
+        type=float,
+        default=DEFAULT_SEND_TIMEOUT,
+        dest='purkinje_send_timeout',
+        metavar='SECONDS',
+        help=('Maximum time to wait for the purkinje server to accept'
+              ' events; on timeout, the connection is re-established and'
+              ' the events are spooled (0: no limit)')
+    )
+
+    parser.addoption(
+        '--purkinje_sync_connect',
+        action='store_true',
+        default=False,
+        dest='purkinje_sync_connect',
+        help=('Connect to the purkinje server before the session starts'
+              ' instead of in the background while tests are collected')
+    )
+
+    parser.addoption(
+        '--purkinje_batch_size',
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        dest='purkinje_batch_size',
+        help=('Maximum number of events per WebSocket frame; with more'
+              ' than one event, frames contain a JSON array of events')
+    )
+
+    parser.addoption(
+        '--purkinje_flush_interval',
+        type=float,
+        default=DEFAULT_FLUSH_INTERVAL,
+        dest='purkinje_flush_interval',
+        help='Maximum time (seconds) to wait for a batch to fill up'
+    )
+
+    parser.addoption(
+        '--purkinje_queue_size',
+        type=int,
+        default=DEFAULT_QUEUE_SIZE,
+        dest='purkinje_queue_size',
+        help='Maximum number of events waiting to be sent'
+    )
+
+    parser.addoption(
+        '--purkinje_backpressure',
+        choices=BACKPRESSURE_POLICIES,
+        default=BLOCK,
+        dest='purkinje_backpressure',
+        help=('What to do when the event queue is full: block the test'
+              ' run, drop the oldest event, or spill events to disk')
+    )
+
+    parser.addoption(
+        '--purkinje_encoding',
+        choices=wireformat.ENCODINGS,
+        default=wireformat.JSON,
+        dest='purkinje_encoding',
+        help=('Encoding of events: JSON, the compact binary encoding'
+              ' (requires server support), or the compact encoding if'
+              ' the server accepts it when offered')
+    )
+
+    parser.addoption(
+        '--purkinje_compress',
+        action='store_true',
+        default=False,
+        dest='purkinje_compress',
+        help='Compress frames with zlib (compact encoding only)'
+    )
+
+    parser.addoption(
+        '--purkinje_resources',
+        action='store_true',
+        default=False,
+        dest='purkinje_resources',
+        help=('Measure CPU time, peak memory growth and garbage'
+              ' collections of each test case (requires server support)')
+    )
+
+    parser.addoption(
+        '--purkinje_trace_allocations',
+        action='store_true',
+        default=False,
+        dest='purkinje_trace_allocations',
+        help=('With --purkinje_resources, also measure the memory'
+              ' allocated by each test case using tracemalloc (slow)')
+    )
+
+    parser.addoption(
+        '--purkinje_retain_reports',
+        choices=RETAIN_MODES,
+        default=RETAIN_ALL,
+        dest='purkinje_retain_reports',
+        help=('Which test reports to keep in memory during the session:'
+              ' complete reports, a summary (outcome and duration), or'
+              ' none')
+    )
+
+    parser.addoption(
+        '--purkinje_max_section_size',
+        type=int,
+        default=None,
+        dest='purkinje_max_section_size',
+        metavar='CHARS',
+        help=('Truncate sections (e.g. captured output) and tracebacks of'
+              ' retained test reports to CHARS characters')
+    )
+
+    parser.addoption(
+        '--purkinje_section_spill_dir',
+        default=None,
+        dest='purkinje_section_spill_dir',
+        metavar='DIR',
+        help=('Write the complete content of truncated sections and'
+              ' tracebacks to files in DIR')
+    )
+
+    parser.addoption(
+        '--purkinje_coverage_index',
+        default=None,
+        dest='purkinje_coverage_index',
+        metavar='PATH',
+        help=('Record the code executed by each test case in the test'
+              ' impact index (SQLite database) at PATH')
+    )
+
+    parser.addoption(
+        '--purkinje_collection_cache',
+        default=None,
+        dest='purkinje_collection_cache',
+        metavar='PATH',
+        help=('Cache the test cases of each test module in PATH: unchanged'
+              ' modules without test cases are not collected again, and'
+              ' the number of test cases is announced before collection'
+              ' if no module has changed')
+    )
+
+    parser.addoption(
+        '--purkinje_history',
+        default=None,
+        dest='purkinje_history',
+        metavar='PATH',
+        help=('Record outcome and duration of each test case in the'
+              ' history file at PATH')
+    )
+
+    parser.addoption(
+        '--purkinje_history_db',
+        default=None,
+        dest='purkinje_history_db',
+        metavar='PATH',
+        help=('Record outcome and duration of each test case in the SQLite'
+              ' database at PATH, which keeps rolling duration statistics'
+              ' across sessions (used instead of --purkinje_history for'
+              ' ordering tests and estimating durations)')
+    )
+
+    parser.addoption(
+        '--purkinje_regressions',
+        action='store_true',
+        default=False,
+        dest='purkinje_regressions',
+        help=('Report test cases which have become slower than in previous'
+              ' sessions (requires --purkinje_history_db)')
+    )
+
+    parser.addoption(
+        '--purkinje_regression_sigma',
+        type=float,
+        default=DEFAULT_SIGMA,
+        dest='purkinje_regression_sigma',
+        metavar='N',
+        help=('A test case is slower if its duration exceeds the median'
+              ' of previous durations by more than N standard'
+              ' deviations ...')
+    )
+
+    parser.addoption(
+        '--purkinje_regression_min_delta',
+        type=float,
+        default=DEFAULT_MIN_DELTA,
+        dest='purkinje_regression_min_delta',
+        metavar='MS',
+        help='... and by at least MS milliseconds'
+    )
+
+    parser.addoption(
+        '--purkinje_fail_on_regression',
+        action='store_true',
+        default=False,
+        dest='purkinje_fail_on_regression',
+        help=('Fail the session if a test case has become slower (implies'
+              ' --purkinje_regressions)')
+    )
+
+    parser.addoption(
+        '--purkinje_quarantine',
+        default=None,
+        dest='purkinje_quarantine',
+        metavar='PATH',
+        help=('Quarantine file listing flaky and slow test cases; it is'
+              ' updated at the end of the session if'
+              ' --purkinje_history_db is given')
+    )
+
+    parser.addoption(
+        '--purkinje_quarantine_mode',
+        choices=quarantine.MODES,
+        default=quarantine.INCLUDE,
+        dest='purkinje_quarantine_mode',
+        help=('How to execute quarantined test cases: like other tests,'
+              ' after all other tests, not at all, or only those')
+    )
+
+    parser.addoption(
+        '--purkinje_quarantine_flips',
+        type=int,
+        default=quarantine.DEFAULT_MIN_FLIPS,
+        dest='purkinje_quarantine_flips',
+        metavar='N',
+        help=('Quarantine test cases whose outcome changed between passing'
+              ' and failing at least N times in recent sessions')
+    )
+
+    parser.addoption(
+        '--purkinje_quarantine_slow',
+        type=float,
+        default=quarantine.DEFAULT_SLOW,
+        dest='purkinje_quarantine_slow',
+        metavar='SECONDS',
+        help=('Quarantine test cases taking SECONDS or more (median), or'
+              ' whose duration varies widely')
+    )
+
+    parser.addoption(
+        '--purkinje_shard',
+        type=sharding.parse_shard,
+        default=None,
+        dest='purkinje_shard',
+        metavar='I/N',
+        help=('Execute only the I-th of N shards of the test cases,'
+              ' balanced by their durations in previous sessions')
+    )
+
+    parser.addoption(
+        '--purkinje_shard_dir',
+        default=None,
+        dest='purkinje_shard_dir',
+        metavar='DIR',
+        help=('Directory shared by the shards of a session running on'
+              ' this host; with it, the shards use the same plan and'
+              ' report a single session')
+    )
+
+    parser.addoption(
+        '--purkinje_failed_first',
+        action='store_true',
+        default=False,
+        dest='purkinje_failed_first',
+        help=('Using the history (--purkinje_history or'
+              ' --purkinje_history_db), execute tests'
+              ' which failed last time first, followed by the remaining'
+              ' test modules, fastest first')
+    )
+
+    parser.addoption(
+        '--purkinje_spool',
+        default=None,
+        dest='purkinje_spool',
+        metavar='PATH',
+        help=('File in which events are kept while the purkinje server is'
+              ' not reachable, to be sent once it is (default: {0} in'
+              ' the cache directory; empty: discard such'
+              ' events)'.format(SPOOL_FILE))
+    )
+
+    parser.addoption(
+        '--purkinje_suite_key',
+        default=None,
+        dest='purkinje_suite_key',
+        metavar='KEY',
+        help=('Distinguishes test suites run on the same host in the same'
+              ' directory: "{0}", "{1}", "{2}" or any other'
+              ' text'.format(SUITE_KEY_GIT_COMMIT, SUITE_KEY_GIT_BRANCH,
+                             SUITE_KEY_ROOTDIR))
+    )
+
+    parser.addoption(
+        '--purkinje_phase_timings',
+        action='store_true',
+        default=False,
+        dest='purkinje_phase_timings',
+        help=('Report the durations of setup, call and teardown of each'
+              ' test case (requires server support)')
+    )
+
+    parser.addoption(
+        '--purkinje_progress_interval',
+        type=float,
+        default=None,
+        dest='purkinje_progress_interval',
+        metavar='SECONDS',
+        help=('Report the progress of the session (completed tests, tests'
+              ' per second, estimated remaining time, slowest running'
+              ' test) every SECONDS seconds (requires server support)')
+    )
+
+    parser.addoption(
+        '--purkinje_result_stream',
+        choices=RESULT_STREAMS,
+        default=RESULTS_ALL,
+        dest='purkinje_result_stream',
+        help=('Which test case results to send: all, only those of tests'
+              ' which did not pass, or none (e.g. for huge test suites,'
+              ' with --purkinje_progress_interval)')
+    )
+
+    parser.addoption(
+        '--purkinje_result_sample',
+        type=int,
+        default=1,
+        dest='purkinje_result_sample',
+        metavar='N',
+        help=('Send only every Nth result of a passed test case; results'
+              ' of other test cases are always sent')
+    )
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+"""Entry point of the py.test plugin (pytest11)
+
+   py.test loads this module in every session, also in projects which do
+   not use purkinje at all. Unless purkinje is enabled (see
+   options.is_enabled), only the command line options are registered:
+   the monitoring plugin (testmonitorplugin) and its dependencies are not
+   even imported, and no connection to the purkinje server is attempted.
+"""
+
+from .options import add_options, is_enabled
+
+
+def pytest_addoption(parser):
+    add_options(parser)
+
+
+def pytest_configure(config):
+    if not is_enabled(config):
+        return
+    from . import testmonitorplugin
+    testmonitorplugin.pytest_configure(config)
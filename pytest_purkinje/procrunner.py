@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+"""Execution of py.test in a cancellable child process"""
+
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Command line to start py.test with the interpreter running purkinje
+PYTEST_COMMAND = [sys.executable, '-m', 'pytest']
+
+# Time (seconds) a cancelled test process gets to terminate before it
+# is killed
+KILL_TIMEOUT = 5
+
+# Exit code of py.test if no tests were collected
+EXIT_NO_TESTS = 5
+
+
+def _get_stdout_buffer():
+    return getattr(sys.stdout, 'buffer', sys.stdout)
+
+
+class ProcessRunner(object):
+
+    """Runs py.test in a child process which is the leader of its own
+       process group, so that a run can be cancelled including any
+       processes started by the tests.
+
+       Output of the child process is streamed line by line to the
+       given binary stream (default: sys.stdout).
+    """
+
+    def __init__(self, output=None, kill_timeout=KILL_TIMEOUT):
+        self._output = output
+        self._kill_timeout = kill_timeout
+        self._lock = threading.Lock()
+        self._process = None
+        # set from the start of run() until it returns
+        self._active = False
+        # set by cancel() if no process has been started yet
+        self._cancelled = False
+
+    def _popen(self, args):
+        kwargs = {'stdout': subprocess.PIPE,
+                  'stderr': subprocess.STDOUT}
+        if sys.version_info >= (3, 2):
+            kwargs['start_new_session'] = True
+        else:
+            kwargs['preexec_fn'] = os.setsid
+        return subprocess.Popen(PYTEST_COMMAND + list(args), **kwargs)
+
+    def run(self, args):
+        """Executes py.test and waits for it to finish
+
+           :return: py.test exit code (negative if terminated by a signal)
+        """
+        self._begin()
+        try:
+            with self._lock:
+                if self._cancelled:
+                    logger.info('Test run cancelled before it started')
+                    return -signal.SIGTERM
+                self._process = process = self._popen(args)
+            return self._stream(process)
+        finally:
+            with self._lock:
+                self._active = False
+                self._cancelled = False
+
+    def _begin(self):
+        """Marks the start of a run: cancel() requests which arrive before
+           the process has been started are remembered
+        """
+        with self._lock:
+            self._active = True
+
+    def _stream(self, process):
+        output = self._output or _get_stdout_buffer()
+        try:
+            for line in iter(process.stdout.readline, b''):
+                output.write(line)
+                output.flush()
+        finally:
+            process.stdout.close()
+            exit_code = process.wait()
+            with self._lock:
+                self._process = None
+        return exit_code
+
+    @property
+    def is_running(self):
+        return self._process is not None
+
+    def cancel(self):
+        """Terminates the process group of the run in progress
+        """
+        with self._lock:
+            process = self._process
+            if process is None:
+                # the run in progress (if any) will not start a process
+                self._cancelled = self._active
+                return
+        if not self._signal(process, signal.SIGTERM):
+            return
+        timer = threading.Timer(self._kill_timeout, self._kill, [process])
+        timer.daemon = True
+        timer.start()
+
+    def _kill(self, process):
+        if process.poll() is None:
+            logger.warning('Killing test process %d', process.pid)
+            self._signal(process, signal.SIGKILL)
+
+    @staticmethod
+    def _signal(process, signum):
+        try:
+            os.killpg(process.pid, signum)
+            return True
+        except OSError:  # already terminated
+            return False
+
+
+def combine_exit_codes(exit_codes):
+    """:return: exit code of a run consisting of several py.test processes:
+                the first failure, 0 if at least one process executed tests
+                successfully, else EXIT_NO_TESTS
+    """
+    failures = [x for x in exit_codes if x not in (0, EXIT_NO_TESTS)]
+    if failures:
+        return failures[0]
+    return 0 if 0 in exit_codes else EXIT_NO_TESTS
+
+
+class ShardedRunner(object):
+
+    """Runs py.test in several child processes concurrently, each executing
+       one shard of the tests (see py.test option --purkinje_shard). The
+       shards share a temporary directory, through which they report a
+       single purkinje session.
+    """
+
+    def __init__(self, count, output=None, kill_timeout=KILL_TIMEOUT):
+        self._runners = [ProcessRunner(output, kill_timeout)
+                         for _ in range(count)]
+
+    def _shard_args(self, args, index, shard_dir):
+        return list(args) + [
+            '--purkinje_shard', '{0}/{1}'.format(index + 1,
+                                                 len(self._runners)),
+            '--purkinje_shard_dir', shard_dir]
+
+    def run(self, args):
+        """Executes all shards and waits for them to finish
+
+           :return: combined exit code (see combine_exit_codes)
+        """
+        shard_dir = tempfile.mkdtemp(prefix='purkinje-shards-')
+        results = [None] * len(self._runners)
+
+        def run_shard(index):
+            try:
+                results[index] = self._runners[index].run(
+                    self._shard_args(args, index, shard_dir))
+            except Exception as e:
+                results[index] = e
+
+        for runner in self._runners:
+            # cancel() applies to shards whose thread has not started yet
+            runner._begin()
+        threads = [threading.Thread(target=run_shard, args=(x,),
+                                    name='purkinje-shard-{0}'.format(x))
+                   for x in range(len(self._runners))]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            shutil.rmtree(shard_dir, ignore_errors=True)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return combine_exit_codes(results)
+
+    @property
+    def is_running(self):
+        return any(x.is_running for x in self._runners)
+
+    def cancel(self):
+        """Terminates all shards of the run in progress
+        """
+        for runner in self._runners:
+            runner.cancel()
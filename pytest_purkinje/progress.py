@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+"""Aggregated progress of a test session"""
+
+import logging
+import threading
+
+from .defs import monotonic
+
+logger = logging.getLogger(__name__)
+
+# Interval (seconds) between progress events
+DEFAULT_PROGRESS_INTERVAL = 1.0
+
+
+class ProgressTracker(object):
+
+    """Keeps track of completed and running test cases and estimates the
+       remaining time of the session.
+
+       The estimate is based on the durations of the remaining tests in
+       previous sessions (see history.TestHistory; the average duration
+       of the tests completed so far for unknown tests), scaled by the
+       ratio of elapsed time to test durations in this session, which
+       accounts for parallel execution and overhead.
+
+       Methods may be called from different threads.
+    """
+
+    def __init__(self, history=None, clock=monotonic):
+        self._history = history
+        self._clock = clock
+        self._lock = threading.Lock()
+        # start of test execution (i.e. after collection)
+        self._start = None
+        # node ID -> expected duration (seconds, or None if unknown), of
+        # the remaining tests
+        self._remaining = {}
+        # total expected duration of the remaining tests with known
+        # durations, and number of those with unknown durations
+        self._remaining_duration = 0.0
+        self._remaining_unknown = 0
+        self._total = 0
+        self._completed = 0
+        # total duration (seconds) of the completed tests
+        self._completed_duration = 0.0
+        # node ID -> start time, of the running tests
+        self._running = {}
+
+    def set_tests(self, nodeids):
+        """Announces the tests of the session; their expected durations
+           are looked up once, here
+        """
+        remaining = dict((x, self._expected_duration(x)) for x in nodeids)
+        known = [x for x in remaining.values() if x is not None]
+        with self._lock:
+            self._remaining = remaining
+            self._remaining_duration = sum(known)
+            self._remaining_unknown = len(remaining) - len(known)
+            self._total = len(remaining)
+            self._start = self._clock()
+
+    def started(self, nodeid):
+        with self._lock:
+            now = self._clock()
+            if self._start is None:
+                self._start = now
+            self._running[nodeid] = now
+
+    def finished(self, nodeid, duration):
+        """:param duration: duration (seconds) of the test
+        """
+        with self._lock:
+            self._running.pop(nodeid, None)
+            if nodeid in self._remaining:
+                expected = self._remaining.pop(nodeid)
+                if expected is None:
+                    self._remaining_unknown -= 1
+                else:
+                    self._remaining_duration -= expected
+            self._completed += 1
+            self._completed_duration += duration
+
+    def _expected_duration(self, nodeid):
+        """:return: duration (seconds) of a test in previous sessions, or
+                    None if unknown
+        """
+        if self._history is not None:
+            duration = self._history.duration(nodeid)
+            if duration is not None:
+                return duration / 1000.0
+        return None
+
+    def _eta(self, elapsed, completed, completed_duration,
+             remaining_duration, remaining_unknown):
+        """:return: estimated remaining time (seconds), or None
+        """
+        expected = max(0.0, remaining_duration)
+        if remaining_unknown:
+            if not completed:
+                return None
+            # unknown tests take as long as the average completed one
+            expected += remaining_unknown * completed_duration / completed
+        if completed_duration > 0:
+            expected *= elapsed / completed_duration
+        return expected
+
+    def snapshot(self):
+        """:return: dict with the fields of an events.SessionProgressEvent
+        """
+        with self._lock:
+            now = self._clock()
+            start = self._start
+            completed = self._completed
+            completed_duration = self._completed_duration
+            remaining_duration = self._remaining_duration
+            remaining_unknown = self._remaining_unknown
+            total = self._total
+            running = list(self._running.items())
+        elapsed = now - start if start is not None else 0
+        eta = self._eta(elapsed, completed, completed_duration,
+                        remaining_duration, remaining_unknown)
+        slowest, slowest_duration = '', 0.0
+        if running:
+            slowest, started = min(running, key=lambda x: x[1])
+            slowest_duration = now - started
+        return {
+            'completed': completed,
+            'total': max(total, completed),
+            'tests_per_second': (float(completed) / elapsed
+                                 if elapsed > 0 else 0.0),
+            'eta': -1 if eta is None else int(round(eta)),
+            'slowest_running': slowest,
+            'slowest_running_duration': float(slowest_duration),
+        }
+
+
+class ProgressReporter(object):
+
+    """Reports the progress of a session periodically from a background
+       thread
+    """
+
+    def __init__(self, tracker, report, interval=DEFAULT_PROGRESS_INTERVAL):
+        """:param report: function called with a progress snapshot (see
+                          ProgressTracker.snapshot)
+        """
+        self._tracker = tracker
+        self._report = report
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run,
+                                        name='purkinje-progress')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            self._send()
+
+    def _send(self):
+        try:
+            self._report(self._tracker.snapshot())
+        except Exception as e:
+            logger.exception(e)
+
+    def stop(self):
+        """Stops periodic reporting and reports the final state
+        """
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        self._send()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""Quarantine of flaky and slow test cases, which can be executed last or
+   separately from the other tests to get feedback sooner
+"""
+
+import json
+import os
+import os.path as op
+
+CACHE_FILE = 'quarantine.json'
+
+# Increased whenever the format of the quarantine file changes
+CACHE_VERSION = 1
+
+# A test case is flaky if its outcome changed between passing and failing
+# at least DEFAULT_MIN_FLIPS times in its recent executions
+DEFAULT_MIN_FLIPS = 3
+# A test case is slow if its median duration is DEFAULT_SLOW seconds or
+# more ...
+DEFAULT_SLOW = 5.0
+# ... and its duration is unstable if the standard deviation exceeds
+# DEFAULT_MAX_VARIATION times the mean
+DEFAULT_MAX_VARIATION = 1.0
+
+# Number of durations required to judge the stability of durations
+MIN_SAMPLES = 5
+
+FLAKY = 'flaky'
+SLOW = 'slow'
+UNSTABLE = 'unstable duration'
+
+# Execute quarantined tests like any other test ...
+INCLUDE = 'include'
+# ... after all other tests ...
+LAST = 'last'
+# ... not at all ...
+EXCLUDE = 'exclude'
+# ... or only those
+ONLY = 'only'
+
+MODES = (INCLUDE, LAST, EXCLUDE, ONLY)
+
+
+class QuarantinePolicy(object):
+
+    """Decides which test cases to quarantine, based on the statistics of
+       the history database (see historydb.TestStatistics)
+    """
+
+    def __init__(self, min_flips=DEFAULT_MIN_FLIPS, slow=DEFAULT_SLOW,
+                 max_variation=DEFAULT_MAX_VARIATION):
+        """:param slow: minimum median duration (seconds) of slow tests
+        """
+        self._min_flips = min_flips
+        self._slow_us = slow * 1000000
+        self._max_variation = max_variation
+
+    def reason(self, stats):
+        """:return: reason to quarantine a test case, or None
+        """
+        if stats.flips >= self._min_flips:
+            return FLAKY
+        durations = stats.duration_statistics()
+        if durations is None:
+            return None
+        if durations.p50 >= self._slow_us:
+            return SLOW
+        if (durations.count >= MIN_SAMPLES and
+                durations.stddev > self._max_variation * durations.mean):
+            return UNSTABLE
+        return None
+
+    def select(self, suite_history):
+        """:param suite_history: historydb.SuiteHistory
+           :return: {node ID: reason} of the test cases to quarantine
+        """
+        result = {}
+        for nodeid, stats in suite_history.tests():
+            reason = self.reason(stats)
+            if reason is not None:
+                result[nodeid] = reason
+        return result
+
+
+def load_quarantine(path):
+    """:return: {node ID: reason} of quarantined test cases (empty if the
+                quarantine file does not exist or cannot be read)
+    """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get('version') != CACHE_VERSION:
+        return {}
+    return data['tests']
+
+
+def save_quarantine(path, tests):
+    dir_ = op.dirname(path)
+    if dir_ and not op.isdir(dir_):
+        os.makedirs(dir_)
+    # the file may be read by other processes at any time
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': CACHE_VERSION, 'tests': tests}, f, indent=1,
+                  sort_keys=True)
+    os.rename(tmp_path, path)
+
+
+def apply_quarantine(items, quarantined, mode):
+    """Reorders or removes quarantined test items in place
+
+       :param quarantined: node IDs of quarantined test cases
+       :return: removed items
+    """
+    if mode == INCLUDE:
+        return []
+    if mode == LAST:
+        # stable sort: the order of the other tests is retained
+        items.sort(key=lambda x: x.nodeid in quarantined)
+        return []
+    keep = mode == ONLY
+    removed = [x for x in items if (x.nodeid in quarantined) != keep]
+    items[:] = [x for x in items if (x.nodeid in quarantined) == keep]
+    return removed
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""Detection of test cases which have become slower than in previous
+   sessions
+"""
+
+import collections
+
+# A duration is a regression if it exceeds the median of previous
+# durations by more than DEFAULT_SIGMA standard deviations ...
+DEFAULT_SIGMA = 3.0
+# ... and by at least DEFAULT_MIN_DELTA milliseconds
+DEFAULT_MIN_DELTA = 100
+
+# Number of previous durations required for a meaningful comparison
+MIN_SAMPLES = 5
+
+# Exit status of py.test if tests failed
+EXIT_TESTS_FAILED = 1
+
+# Durations in microseconds; sigma: deviation from the baseline in
+# standard deviations, or None if all previous durations were equal
+Regression = collections.namedtuple(
+    'Regression', ['nodeid', 'duration_us', 'baseline_us', 'stddev_us',
+                   'sigma'])
+
+
+class RegressionDetector(object):
+
+    """Compares test case durations with statistics of previous
+       executions (see historydb.DurationStatistics)
+    """
+
+    def __init__(self, sigma=DEFAULT_SIGMA, min_delta=DEFAULT_MIN_DELTA,
+                 min_samples=MIN_SAMPLES):
+        """:param min_delta: minimum slowdown (milliseconds)
+        """
+        self._sigma = sigma
+        self._min_delta_us = min_delta * 1000
+        self._min_samples = min_samples
+        # regressions detected in this session
+        self.regressions = []
+
+    def check(self, nodeid, duration_us, stats):
+        """:param stats: historydb.DurationStatistics of previous
+                         executions, or None if unknown
+           :return: Regression, or None
+        """
+        if stats is None or stats.count < self._min_samples:
+            return None
+        delta = duration_us - stats.p50
+        if delta < self._min_delta_us or delta <= self._sigma * stats.stddev:
+            return None
+        # infinite if the duration used to be constant, which cannot be
+        # represented in JSON
+        sigma = float(delta) / stats.stddev if stats.stddev else None
+        result = Regression(nodeid, duration_us, stats.p50,
+                            int(round(stats.stddev)), sigma)
+        self.regressions.append(result)
+        return result
+
+
+class RegressionPlugin(object):
+
+    """py.test plugin listing the regressions found by a
+       RegressionDetector at the end of the session, and optionally
+       failing the session if there are any
+    """
+
+    def __init__(self, detector, fail=False):
+        self._detector = detector
+        self._fail = fail
+
+    def pytest_sessionfinish(self, session, exitstatus):
+        if self._fail and self._detector.regressions and exitstatus == 0:
+            session.exitstatus = EXIT_TESTS_FAILED
+
+    def pytest_terminal_summary(self, terminalreporter):
+        regressions = self._detector.regressions
+        if not regressions:
+            return
+        terminalreporter.write_sep('=', 'purkinje: {0} performance'
+                                   ' regression(s)'.format(len(regressions)))
+        for x in regressions:
+            terminalreporter.write_line(
+                '{0}: {1:.1f} ms (median {2:.1f} ms, {3})'.format(
+                    x.nodeid, x.duration_us / 1000.0, x.baseline_us / 1000.0,
+                    'constant before' if x.sigma is None
+                    else '{0:.1f} sigma'.format(x.sigma)))
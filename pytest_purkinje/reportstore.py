@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+"""Retention of test reports with bounded memory usage"""
+
+import copy
+import io
+import os
+import os.path as op
+
+# Keep complete test reports ...
+RETAIN_ALL = 'all'
+# ... only outcome and duration ...
+RETAIN_SUMMARY = 'summary'
+# ... or nothing at all
+RETAIN_NONE = 'none'
+
+RETAIN_MODES = (RETAIN_ALL, RETAIN_SUMMARY, RETAIN_NONE)
+
+
+class ReportSummary(object):
+
+    """The essentials of a test report"""
+
+    __slots__ = ('nodeid', 'when', 'outcome', 'duration', 'fspath')
+
+    def __init__(self, report):
+        self.nodeid = report.nodeid
+        self.when = report.when
+        self.outcome = report.outcome
+        self.duration = report.duration
+        self.fspath = report.fspath
+
+    @property
+    def passed(self):
+        return self.outcome == 'passed'
+
+    @property
+    def failed(self):
+        return self.outcome == 'failed'
+
+    @property
+    def skipped(self):
+        return self.outcome == 'skipped'
+
+
+class SectionLimiter(object):
+
+    """Truncates large sections (captured output, logs) and tracebacks
+       (longrepr) of test reports. If a spill directory is given, the
+       complete content of truncated parts is written to a file in that
+       directory.
+    """
+
+    def __init__(self, max_size, spill_dir=None):
+        """:param max_size: maximum length of a section or of a
+                            traceback (characters)
+        """
+        self._max_size = max_size
+        self._spill_dir = spill_dir
+
+    def apply(self, report):
+        """:return: the report, or a copy of it with truncated sections
+                    and traceback (the original is still used by
+                    py.test's reporting)
+        """
+        sections = getattr(report, 'sections', None) or []
+        longrepr = _longrepr_text(report)
+        if not (any(len(content) > self._max_size
+                    for _, content in sections) or
+                len(longrepr or '') > self._max_size):
+            return report
+        result = copy.copy(report)
+        result.sections = [
+            (title, self._truncate(report, i, content))
+            for i, (title, content) in enumerate(sections)]
+        if len(longrepr or '') > self._max_size:
+            result.longrepr = self._truncate(report, 'longrepr', longrepr)
+        return result
+
+    def _truncate(self, report, key, content):
+        """:param key: identifies the part of the report (section index)
+        """
+        if len(content) <= self._max_size:
+            return content
+        note = '[truncated {0} characters]'.format(
+            len(content) - self._max_size)
+        if self._spill_dir is not None:
+            path = self._spill(report, key, content)
+            note = '[truncated; complete content in {0}]'.format(path)
+        return u'{0}\n... {1}'.format(content[:self._max_size], note)
+
+    def _spill(self, report, key, content):
+        if not op.isdir(self._spill_dir):
+            os.makedirs(self._spill_dir)
+        import hashlib  # not needed unless sections are spilled
+        name = '{0}-{1}-{2}.txt'.format(
+            hashlib.md5(report.nodeid.encode('utf-8')).hexdigest(),
+            report.when, key)
+        path = op.join(self._spill_dir, name)
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+
+def _longrepr_text(report):
+    """:return: serialized traceback (longrepr) of a report, or None
+    """
+    longrepr = getattr(report, 'longrepr', None)
+    if longrepr is None or isinstance(longrepr, tuple):
+        return None  # (path, line, reason) of skipped tests
+    import six  # keeps the import of the plugin entry point light
+    if isinstance(longrepr, six.string_types):
+        return longrepr
+    return six.text_type(longrepr)
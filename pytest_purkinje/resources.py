@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+"""Measurement of the resources (CPU time, memory, garbage collections)
+   used by each test case
+"""
+
+import gc
+import logging
+import os
+import sys
+import time
+
+import pytest
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+logger = logging.getLogger(__name__)
+
+# Name of the test report attribute holding the measured resources
+REPORT_ATTRIBUTE = 'purkinje_resources'
+
+# Unit of ru_maxrss
+_MAXRSS_BYTES = 1 if sys.platform == 'darwin' else 1024
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+def cpu_time():
+    """:return: CPU time (user + system, seconds) used by the process
+    """
+    if hasattr(time, 'process_time'):
+        return time.process_time()
+    times = os.times()  # resolution of clock ticks only
+    return times[0] + times[1]
+
+
+def max_rss():
+    """:return: peak resident set size of the process (bytes), or 0 if
+                unknown
+    """
+    if resource is None:
+        return 0
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_maxrss * _MAXRSS_BYTES
+
+
+def gc_collections():
+    """:return: number of garbage collections so far (all generations)
+    """
+    if not hasattr(gc, 'get_stats'):
+        return 0
+    return sum(x['collections'] for x in gc.get_stats())
+
+
+class ResourceSampler(object):
+
+    """Measures the resources used between start() and stop()"""
+
+    def __init__(self, trace_allocations=False):
+        """:param trace_allocations: if True, the peak of memory allocated
+                                     by Python code is determined using
+                                     tracemalloc (slows down execution
+                                     considerably)
+        """
+        self._trace_allocations = (trace_allocations and
+                                   tracemalloc is not None)
+        if trace_allocations and tracemalloc is None:
+            logger.warning('tracemalloc is not available')
+
+    def start(self):
+        """:return: sample to be passed to stop()
+        """
+        if self._trace_allocations:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            allocated = tracemalloc.get_traced_memory()[0]
+        else:
+            allocated = None
+        return (cpu_time(), max_rss(), gc_collections(), allocated)
+
+    def stop(self, sample):
+        """:return: {'cpu_us': CPU time (microseconds),
+                     'max_rss_delta_kb': growth of the peak resident set
+                                         size (kB),
+                     'gc_collections': number of garbage collections,
+                     'alloc_peak_kb': peak of memory allocated in addition
+                                      to the memory allocated at start()
+                                      (kB; only if allocations are
+                                      traced)}
+        """
+        cpu, rss, collections, allocated = sample
+        result = {
+            'cpu_us': int(round((cpu_time() - cpu) * 1000000)),
+            'max_rss_delta_kb': (max_rss() - rss) // 1024,
+            'gc_collections': gc_collections() - collections,
+        }
+        if allocated is not None:
+            peak = tracemalloc.get_traced_memory()[1]
+            result['alloc_peak_kb'] = max(0, peak - allocated) // 1024
+        return result
+
+    def close(self):
+        if self._trace_allocations and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+class ResourcePlugin(object):
+
+    """py.test plugin measuring the resources used by each test case
+       (setup, call and teardown). The result is attached to the teardown
+       report (attribute purkinje_resources), from where it is reported
+       by TestMonitorPlugin - also for reports received from pytest-xdist
+       workers.
+    """
+
+    def __init__(self, sampler):
+        self._sampler = sampler
+        self._samples = {}
+        # time (seconds) spent measuring
+        self.overhead = 0.0
+        self.count = 0
+
+    def pytest_runtest_logstart(self, nodeid, location):
+        start = _clock()
+        self._samples[nodeid] = self._sampler.start()
+        self.overhead += _clock() - start
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(self, item, call):
+        outcome = yield
+        if call.when != 'teardown':
+            return
+        start = _clock()
+        sample = self._samples.pop(item.nodeid, None)
+        if sample is not None:
+            report = outcome.get_result()
+            setattr(report, REPORT_ATTRIBUTE, self._sampler.stop(sample))
+            self.count += 1
+        self.overhead += _clock() - start
+
+    def pytest_sessionfinish(self):
+        self._sampler.close()
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if self.count:
+            terminalreporter.write_line(
+                'purkinje: resource measurement took {0:.1f} ms for {1}'
+                ' tests ({2:.0f} us per test)'.format(
+                    self.overhead * 1000, self.count,
+                    self.overhead * 1000000 / self.count))
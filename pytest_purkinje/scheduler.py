@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+"""Scheduling of test runs for bursts of file changes"""
+
+import logging
+import threading
+
+from .defs import monotonic
+
+logger = logging.getLogger(__name__)
+
+# Time (seconds) without further changes after which a test run starts
+DEFAULT_DEBOUNCE_PERIOD = 0.5
+
+
+class RunScheduler(object):
+
+    """Accumulates changed paths and starts a test run once no further
+       change has been reported for the debounce period (trailing edge).
+
+       Changes reported while a run is in progress are never lost: they
+       cause another run as soon as the current one has finished. If a
+       cancel function is given, the run in progress is cancelled when
+       newer changes arrive, and its paths are included in the next run.
+
+       Runs are executed by a dedicated thread.
+    """
+
+    def __init__(self, run, debounce=DEFAULT_DEBOUNCE_PERIOD, cancel=None):
+        """:param run: function executing the tests for a sorted list of
+                       changed paths
+           :param cancel: function aborting the run in progress
+        """
+        self._run = run
+        self._debounce = debounce
+        self._cancel = cancel
+        self._cond = threading.Condition()
+        self._changes = set()
+        self._deadline = None
+        self._running = False
+        self._cancelled = False
+        self._stopped = False
+        self._thread = None
+
+    @property
+    def is_running(self):
+        return self._running
+
+    @property
+    def has_pending_changes(self):
+        return bool(self._changes)
+
+    def add(self, paths):
+        """Reports changed paths
+        """
+        cancel = False
+        with self._cond:
+            if self._thread is None:
+                self._start()
+            self._changes.update(paths)
+            self._deadline = monotonic() + self._debounce
+            if self._running and self._cancel and not self._cancelled:
+                self._cancelled = cancel = True
+            self._cond.notify_all()
+        if cancel:
+            logger.info('Cancelling test run because of newer changes')
+            self._cancel()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._loop,
+                                        name='purkinje-scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _next_run(self):
+        """Waits until the debounce period has elapsed
+
+           :return: changed paths, or None when stopped
+        """
+        with self._cond:
+            while not self._stopped:
+                if not self._changes:
+                    self._cond.wait()
+                    continue
+                remaining = self._deadline - monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                paths = self._changes
+                self._changes = set()
+                self._running = True
+                self._cancelled = False
+                return paths
+        return None
+
+    def _loop(self):
+        while True:
+            paths = self._next_run()
+            if paths is None:
+                return
+            try:
+                self._run(sorted(paths))
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                with self._cond:
+                    if self._cancelled:
+                        self._changes.update(paths)
+                    self._running = False
+                    self._cond.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """Blocks until all reported changes have been handled
+
+           :return: False if the timeout expired
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._cond:
+            while self._changes or self._running:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        return False
+                self._cond.wait(remaining)
+        return True
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
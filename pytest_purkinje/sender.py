@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+
+"""Background delivery of events to the purkinje server"""
+
+import json
+import logging
+import threading
+import time
+
+from six.moves import queue
+
+from . import wireformat
+from .defs import (BACKPRESSURE_POLICIES, BLOCK, DEFAULT_BATCH_SIZE,
+                   DEFAULT_FLUSH_INTERVAL, DEFAULT_QUEUE_SIZE, SPILL,
+                   monotonic)
+from .spool import Spool
+
+logger = logging.getLogger(__name__)
+
+# How often an idle sender thread looks for spilled events (seconds)
+IDLE_POLL_INTERVAL = 0.5
+
+# Delay (seconds) before the first attempt to reconnect after the
+# connection has been lost; doubled after each failed attempt, up to
+# MAX_RECONNECT_DELAY
+INITIAL_RECONNECT_DELAY = 0.5
+MAX_RECONNECT_DELAY = 30
+
+# Maximum time (seconds) to wait for pending events to be delivered when
+# the sender is closed; undelivered events are kept in the offline spool
+CLOSE_TIMEOUT = 15
+
+# Marks the end of the event stream
+_STOP = object()
+
+
+class EventSender(object):
+
+    """Sends events via a WebSocket connection from a background thread.
+
+       Events are queued by the test process and sent in batches of up to
+       batch_size events; an incomplete batch is sent after flush_interval
+       seconds.
+
+       If a connect function is given, the sender reconnects (with
+       exponential backoff) after the connection has been lost. Events
+       which cannot be delivered in the meantime are kept in the offline
+       spool, and sent once the connection is back - possibly only in a
+       later session, if the spool is file-based.
+
+       Frames are encoded as JSON, or in the compact encoding (see
+       wireformat), which may be negotiated with the server on each
+       connection.
+    """
+
+    def __init__(self, websocket,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 queue_size=DEFAULT_QUEUE_SIZE,
+                 backpressure=BLOCK,
+                 connect=None,
+                 offline_spool=None,
+                 encoding=wireformat.JSON,
+                 compress=False,
+                 eager_connect=False):
+        """:param websocket: connection to the purkinje server, or None if
+                             not connected
+           :param connect: function returning a new connection
+           :param eager_connect: if True and not connected, the sender
+                                 thread connects right away instead of
+                                 when the first events are to be sent;
+                                 events are queued meanwhile
+           :param offline_spool: spool.Spool for undeliverable events; if
+                                 None, such events are lost
+           :param encoding: wireformat.JSON, COMPACT or AUTO
+           :param compress: compress frames (compact encoding only)
+        """
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError('Unknown back-pressure policy: {0}'.format(
+                backpressure))
+        if encoding not in wireformat.ENCODINGS:
+            raise ValueError('Unknown encoding: {0}'.format(encoding))
+        self._encoding = encoding
+        self._compress = compress
+        self._encoder = wireformat.JsonEncoder()
+        self._websocket = websocket
+        self._connect = connect
+        self._eager_connect = eager_connect
+        self._offline = offline_spool
+        self._reconnect_delay = 0
+        self._next_reconnect = 0
+        self._batch_size = max(1, batch_size)
+        self._flush_interval = flush_interval
+        self._backpressure = backpressure
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._drop_lock = threading.Lock()
+        self._spool = Spool() if backpressure == SPILL else None
+        self.dropped_count = 0
+        self.spilled_count = 0
+        self.undeliverable_count = 0
+        # set while spilled events are being delivered
+        self._replaying = False
+        # set if close() has given up waiting for the sender thread
+        self._abandoned = False
+        self._offline_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run,
+                                        name='purkinje-sender')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def send(self, event):
+        """Queues an event for delivery
+        """
+        if self._spool is not None and len(self._spool):
+            # keep ordering: once spilling has started, later events
+            # have to wait behind the spilled ones
+            self._spill(event)
+        elif self._backpressure == BLOCK:
+            self._queue.put(event)
+        else:
+            try:
+                self._queue.put_nowait(event)
+            except queue.Full:
+                self._handle_full(event)
+
+    def _handle_full(self, event):
+        if self._backpressure == SPILL:
+            self._spill(event)
+            return
+
+        with self._drop_lock:
+            while True:
+                try:
+                    self._queue.get_nowait()
+                    self._queue.task_done()
+                    self.dropped_count += 1
+                except queue.Empty:
+                    pass
+                try:
+                    self._queue.put_nowait(event)
+                    return
+                except queue.Full:
+                    continue
+
+    def _spill(self, event):
+        ser_event = _dumps(_serialize(event))
+        if ser_event is not None:
+            self._spool.append(ser_event)
+            self.spilled_count += 1
+
+    def flush(self, timeout=None):
+        """Blocks until all events queued so far have been sent (or stored
+           in the offline spool, if they cannot be delivered)
+
+           :param timeout: maximum time (seconds) to wait (None: no limit)
+           :return: False if the timeout expired
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+
+        def expired():
+            return deadline is not None and monotonic() >= deadline
+
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                if expired():
+                    return False
+                self._queue.all_tasks_done.wait(
+                    None if deadline is None else deadline - monotonic())
+        while self._spool is not None and (len(self._spool) or
+                                           self._replaying):
+            if expired():
+                return False
+            time.sleep(self._flush_interval)
+        return True
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        """Sends all pending events and stops the sender thread
+
+           :param timeout: maximum time (seconds) to wait for the events to
+                           be delivered (None: no limit); the events which
+                           have not been sent by then are stored in the
+                           offline spool
+        """
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            self._abandon()
+        if self._spool is not None:
+            self._spool.close()
+        if self.dropped_count:
+            logger.warning('Dropped %d events because the purkinje server'
+                           ' did not keep up', self.dropped_count)
+        if self._offline is not None:
+            if len(self._offline):
+                logger.warning('%d events could not be delivered; they'
+                               ' will be sent in a later session',
+                               len(self._offline))
+            self._offline.close()
+        if self.undeliverable_count:
+            logger.warning('Lost %d events which could not be delivered',
+                           self.undeliverable_count)
+        if (self._websocket is not None and self._connect is not None and
+                not self._abandoned):
+            # the connection is owned by the sender
+            self._disconnect()
+
+    def _abandon(self):
+        """Stops delivery by the sender thread (which is stuck sending to
+           or connecting to the server) and moves the pending events to the
+           offline spool
+        """
+        logger.warning('Timeout while sending events to the purkinje'
+                       ' server')
+        with self._offline_lock:
+            self._abandoned = True
+        pending = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._queue.task_done()
+            if item is not _STOP:
+                pending.append(_serialize(item))
+        # lets the sender thread terminate once it is no longer stuck
+        self._queue.put(_STOP)
+        if self._spool is not None:
+            pending.extend(_load_records(self._spool.pop_all()))
+        self._store_offline([x for x in pending if x is not None],
+                            force=True)
+
+    @property
+    def is_connected(self):
+        return self._websocket is not None
+
+    def _run(self):
+        self._guarded(self._start)
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch()
+            try:
+                self._guarded(self._process, batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+        self._queue.task_done()  # for _STOP
+
+    def _guarded(self, func, *args):
+        """Calls func, logging any error: the sender thread must keep
+           running, or send() would queue events which are never delivered
+        """
+        try:
+            func(*args)
+        except Exception as e:
+            logger.exception(e)
+            logger.error('Error in purkinje sender thread: %s', e)
+
+    def _start(self):
+        if self._websocket is not None:
+            try:
+                self._start_connection()
+            except Exception as e:
+                logger.error('Error while setting up connection: %s', e)
+        elif self._eager_connect:
+            self._ensure_connection()
+        self._replay_offline()  # events left over by an earlier session
+
+    def _process(self, batch):
+        if batch:
+            self._deliver([_serialize(event) for event in batch])
+        self._replay_spool()
+        if self._queue.empty():
+            self._replay_offline()
+
+    def _next_batch(self):
+        """Collects events until the batch is complete, the flush interval
+           has elapsed, or the end of the stream is reached
+
+           :return: (list of events, end of stream reached)
+        """
+        try:
+            item = self._queue.get(timeout=IDLE_POLL_INTERVAL)
+        except queue.Empty:
+            return [], False
+
+        batch = []
+        deadline = monotonic() + self._flush_interval
+        while item is not _STOP:
+            batch.append(item)
+            remaining = deadline - monotonic()
+            if len(batch) >= self._batch_size or remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+        return batch, item is _STOP
+
+    def _replay_spool(self):
+        if (self._spool is None or self._abandoned or
+                not self._queue.empty()):
+            return
+        # set before the records are taken from the spool, so that flush()
+        # waits for them to be delivered
+        self._replaying = True
+        try:
+            records = _load_records(self._spool.pop_all())
+            for start in range(0, len(records), self._batch_size):
+                self._deliver(records[start:start + self._batch_size])
+        finally:
+            self._replaying = False
+
+    def _deliver(self, events):
+        """:param events: event data (dicts); None for events which could
+                          not be serialized
+        """
+        events = [x for x in events if x is not None]
+        if not events or self._abandoned:
+            return
+        # events spooled earlier have to be sent first
+        if (self._replay_offline() and self._ensure_connection() and
+                self._send(events)):
+            return
+        self._store_offline(events)
+
+    def _send(self, events):
+        """:return: True if the events have been sent
+        """
+        frame = self._encode(events)
+        if frame is None:
+            return True
+        try:
+            if self._encoder.binary:
+                self._websocket.send_binary(frame)
+            else:
+                self._websocket.send(frame)
+            return True
+        except Exception as e:
+            logger.error('Error while sending %d event(s): %s',
+                         len(events), e)
+            # the server may have missed strings defined in the frame
+            self._encoder.reset()
+            if self._connect is not None:
+                # assume that the connection is broken; reconnect later
+                self._disconnect()
+            return False
+
+    def _encode(self, events):
+        """:return: frame, or None if none of the events can be encoded
+        """
+        try:
+            return self._encoder.encode(events)
+        except (TypeError, ValueError) as e:
+            logger.error('Error while encoding %d event(s): %s',
+                         len(events), e)
+        # drop the events which are not JSON-serializable
+        events = [x for x in events if _dumps(x) is not None]
+        return self._encoder.encode(events) if events else None
+
+    def _store_offline(self, events, force=False):
+        """:param force: store the events even if the sender has been
+                         abandoned (see _abandon)
+        """
+        with self._offline_lock:
+            if self._abandoned and not force:
+                # the offline spool may already have been closed
+                self.undeliverable_count += len(events)
+                return
+            for data in events:
+                ser_event = _dumps(data)
+                if ser_event is None:
+                    continue
+                if (self._offline is None or
+                        not self._offline.append(ser_event)):
+                    self.undeliverable_count += 1
+
+    def _replay_offline(self):
+        """Sends the events in the offline spool
+
+           :return: False if not all of them could be sent
+        """
+        if self._offline is None or not len(self._offline):
+            return True
+        if not self._ensure_connection():
+            return False
+        with self._offline_lock:
+            if self._abandoned:
+                return True
+            records = _load_records(self._offline.pop_all())
+        logger.info('Sending %d spooled events', len(records))
+        for start in range(0, len(records), self._batch_size):
+            if not self._send(records[start:start + self._batch_size]):
+                self._store_offline(records[start:])
+                return False
+        return True
+
+    def _ensure_connection(self):
+        """Reconnects if the connection has been lost and the backoff
+           period has elapsed
+
+           :return: True if connected
+        """
+        if self._websocket is not None:
+            return True
+        if self._connect is None or monotonic() < self._next_reconnect:
+            return False
+        try:
+            self._websocket = self._connect()
+            self._start_connection()
+        except Exception as e:
+            self._reconnect_delay = min(
+                MAX_RECONNECT_DELAY,
+                2 * self._reconnect_delay or INITIAL_RECONNECT_DELAY)
+            self._next_reconnect = monotonic() + self._reconnect_delay
+            logger.info('Cannot connect to purkinje server (%s); retrying'
+                        ' in %.1f s', e, self._reconnect_delay)
+            return False
+        logger.info('Connected to purkinje server')
+        self._reconnect_delay = 0
+        return True
+
+    def _start_connection(self):
+        """Chooses the encoding for a new connection
+        """
+        try:
+            self._encoder = wireformat.create_encoder(
+                self._websocket, self._encoding, self._compress)
+        except Exception:
+            self._disconnect()
+            raise
+
+    def _disconnect(self):
+        websocket, self._websocket = self._websocket, None
+        try:
+            websocket.close()
+        except Exception as e:
+            logger.debug('Error while closing connection: %s', e)
+
+
+def _serialize(event):
+    """Validates an event (see purkinje_messages.message.Event.serialize)
+
+       :return: event data, or None if the event is invalid
+    """
+    try:
+        event.validate()
+        return event.data
+    except Exception as e:
+        logger.exception(e)
+        logger.error('Error while serializing event "%s": %s',
+                     getattr(event, 'data', event), e)
+        return None
+
+
+def _load_records(records):
+    """:return: event data of spooled records; records which cannot be
+                decoded are skipped
+    """
+    result = []
+    for record in records:
+        try:
+            result.append(json.loads(record.decode('utf-8')))
+        except ValueError as e:  # includes UnicodeDecodeError
+            logger.warning('Skipping undecodable spooled event %r: %s',
+                           record[:100], e)
+    return result
+
+
+def _dumps(data):
+    """:return: JSON representation of event data, or None
+    """
+    if data is None:
+        return None
+    try:
+        return json.dumps(data)
+    except (TypeError, ValueError) as e:
+        logger.error('Cannot serialize event "%s": %s', data, e)
+        return None
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+"""Distribution of the tests of a session to several py.test processes
+   (shards) running concurrently
+"""
+
+import collections
+import heapq
+import json
+import os
+import os.path as op
+import time
+import zlib
+
+from .defs import monotonic
+
+PLAN_FILE = 'plan.json'
+STARTED_FILE = 'started'
+TERMINATED_FILE = 'terminated'
+
+# Interval (seconds) for checking whether the session has been announced
+POLL_INTERVAL = 0.05
+
+# Expected duration (milliseconds) of tests if there is no history at all
+DEFAULT_DURATION = 1.0
+
+
+def parse_shard(text):
+    """Parses a shard specification: 'i/N' denotes the i-th of N shards
+       (starting with 1)
+
+       :return: (index (starting with 0), count)
+    """
+    try:
+        index, count = [int(x) for x in text.split('/')]
+    except ValueError:
+        raise ValueError('Invalid shard "{0}"; expected i/N'.format(text))
+    if not 1 <= index <= count:
+        raise ValueError('Invalid shard "{0}"; i must be between 1 and'
+                         ' N'.format(text))
+    return index - 1, count
+
+
+def plan_shards(nodeids, count, estimates=None):
+    """Assigns tests to shards so that all shards take about the same time
+       (longest processing time first). Test modules are assigned as a
+       whole, so that module scoped fixtures are set up once; only modules
+       taking longer than the average shard are split.
+
+       :param estimates: provides duration(nodeid) (milliseconds, or None
+                         if unknown), e.g. history.TestHistory
+       :return: {node ID: shard index}
+    """
+    durations = dict((x, estimates.duration(x) if estimates else None)
+                     for x in nodeids)
+    known = [x for x in durations.values() if x is not None]
+    default = float(sum(known)) / len(known) if known else DEFAULT_DURATION
+    for nodeid, duration in durations.items():
+        if duration is None:
+            durations[nodeid] = default
+
+    modules = collections.OrderedDict()
+    for nodeid in nodeids:
+        modules.setdefault(nodeid.split('::')[0], []).append(nodeid)
+    limit = sum(durations.values()) / count
+    units = []
+    for module_nodeids in modules.values():
+        duration = sum(durations[x] for x in module_nodeids)
+        if duration > limit:
+            units.extend((durations[x], [x]) for x in module_nodeids)
+        else:
+            units.append((duration, module_nodeids))
+
+    shards = [(0.0, x) for x in range(count)]
+    result = {}
+    # stable sort: deterministic for equal durations
+    for duration, unit_nodeids in sorted(units, key=lambda x: -x[0]):
+        load, shard = heapq.heappop(shards)
+        for nodeid in unit_nodeids:
+            result[nodeid] = shard
+        heapq.heappush(shards, (load + duration, shard))
+    return result
+
+
+def fallback_shard(nodeid, count):
+    """:return: shard of a test missing from the plan
+    """
+    return zlib.crc32(nodeid.encode('utf-8')) % count
+
+
+class ShardCoordinator(object):
+
+    """Coordinates the shards of a session through files in a directory
+       shared by all shards: the first shard to finish collecting creates
+       the plan used by all shards and announces the session, and the last
+       shard to finish terminates the session. The other shards start
+       executing tests once the session has been announced.
+    """
+
+    def __init__(self, dir_, index, count):
+        self._dir = dir_
+        self._index = index
+        self._count = count
+
+    def _ensure_dir(self):
+        try:
+            os.makedirs(self._dir)
+        except OSError:  # exists, possibly created by another shard
+            if not op.isdir(self._dir):
+                raise
+
+    def _load_plan(self, path):
+        with open(path) as f:
+            return json.load(f)
+
+    def plan(self, create):
+        """:param create: function returning a plan (see plan_shards)
+           :return: (plan, True if this shard created it)
+        """
+        path = op.join(self._dir, PLAN_FILE)
+        if op.isfile(path):
+            return self._load_plan(path), False
+        self._ensure_dir()
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(create(), f)
+        try:
+            # fails if another shard has created the plan already
+            os.link(tmp_path, path)
+            created = True
+        except OSError:
+            created = False
+        finally:
+            os.remove(tmp_path)
+        return self._load_plan(path), created
+
+    def announced(self):
+        """Records that the shard which created the plan has announced the
+           session
+        """
+        self._ensure_dir()
+        with open(op.join(self._dir, STARTED_FILE), 'w'):
+            pass
+
+    def wait_announced(self, timeout):
+        """Blocks until the session has been announced
+
+           :return: False if the timeout expired
+        """
+        path = op.join(self._dir, STARTED_FILE)
+        deadline = monotonic() + timeout
+        while not op.isfile(path):
+            if monotonic() >= deadline:
+                return False
+            time.sleep(POLL_INTERVAL)
+        return True
+
+    def finish(self):
+        """Records that this shard has finished
+
+           :return: True if all shards have finished, and no other shard
+                    has seen this before
+        """
+        self._ensure_dir()
+        with open(op.join(self._dir, 'done-{0}'.format(self._index)), 'w'):
+            pass
+        finished = sum(1 for x in os.listdir(self._dir)
+                       if x.startswith('done-'))
+        if finished < self._count:
+            return False
+        try:
+            os.close(os.open(op.join(self._dir, TERMINATED_FILE),
+                             os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except OSError:
+            return False
+        return True
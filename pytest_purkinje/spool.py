@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+"""File-backed storage for serialized events that could not be sent
+   immediately
+"""
+
+import os
+import struct
+import tempfile
+import threading
+
+# Each record is prefixed by its length (unsigned 32 bit, big endian)
+RECORD_HEADER = struct.Struct('>I')
+
+
+class Spool(object):
+
+    """Append-only file of length-prefixed records.
+
+       Records are appended by producer threads and read back in the
+       order in which they were written by the consumer. If no path is
+       given, an anonymous temporary file is used.
+
+       Records left in a spool file by a previous process are kept; an
+       incomplete record at the end (e.g. after a crash) is removed.
+    """
+
+    def __init__(self, path=None, max_size=None):
+        """:param max_size: maximum size of the spool (bytes); records
+                            which do not fit are rejected
+        """
+        self._path = path
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._count = 0
+        self._size = 0
+        if path is None:
+            self._file = tempfile.TemporaryFile()
+        else:
+            dir_ = os.path.dirname(path)
+            if dir_ and not os.path.isdir(dir_):
+                os.makedirs(dir_)
+            self._file = open(path, 'a+b')
+            self._file.seek(0)
+            data = self._file.read()
+            records = list(_iter_records(data))
+            self._count = len(records)
+            self._size = sum(RECORD_HEADER.size + len(x) for x in records)
+            if self._size < len(data):
+                # records appended later must not follow the broken tail
+                self._file.truncate(self._size)
+
+    def __len__(self):
+        return self._count
+
+    def append(self, record):
+        """Appends a record (text or bytes) to the end of the spool
+
+           :return: False if the record was rejected because the spool is
+                    full
+        """
+        if not isinstance(record, bytes):
+            record = record.encode('utf-8')
+        size = RECORD_HEADER.size + len(record)
+        with self._lock:
+            if self._file.closed:
+                return False
+            if (self._max_size is not None and
+                    self._size + size > self._max_size):
+                return False
+            self._file.seek(0, 2)
+            self._file.write(RECORD_HEADER.pack(len(record)))
+            self._file.write(record)
+            self._count += 1
+            self._size += size
+        return True
+
+    def pop_all(self):
+        """Removes all records from the spool
+
+           :return: list of records (bytes), oldest first
+        """
+        with self._lock:
+            if not self._count or self._file.closed:
+                return []
+            self._file.flush()
+            self._file.seek(0)
+            data = self._file.read()
+            self._file.seek(0)
+            self._file.truncate()
+            self._count = 0
+            self._size = 0
+        return list(_iter_records(data))
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _iter_records(data):
+    offset = 0
+    header_size = RECORD_HEADER.size
+    while offset + header_size <= len(data):
+        length, = RECORD_HEADER.unpack_from(data, offset)
+        offset += header_size
+        if offset + length > len(data):
+            return  # incomplete record
+        yield data[offset:offset + length]
+        offset += length
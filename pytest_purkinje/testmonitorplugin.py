@@ -4,10 +4,11 @@ from __future__ import print_function
 from builtins import object
 import os
 import logging
-import time
+import subprocess
 import socket
 
 import six
+from six.moves.urllib.parse import urlparse
 import pytest
 import websocket
 
@@ -17,6 +18,25 @@ from purkinje_messages.message import (
     SessionTerminatedEvent,
     ConnectionTerminationEvent)
 
+from . import sender
+from .collectcache import CollectionCache, CollectionCachePlugin
+from .defs import (DEFAULT_CONNECT_TIMEOUT, DEFAULT_SEND_TIMEOUT,
+                   RESULTS_ALL, RESULTS_FAILURES, RESULTS_NONE, SPOOL_FILE,
+                   SUITE_KEY_GIT_BRANCH, SUITE_KEY_GIT_COMMIT,
+                   SUITE_KEY_ROOTDIR, cache_path)
+from .events import (SessionProgressEvent, TestCaseRegressionEvent,
+                     TestCaseResourcesEvent, TestCaseTimingEvent)
+from .history import TestHistory
+from .historydb import HistoryDatabase
+from .impactindex import CoverageIndex, CoveragePlugin
+from .progress import ProgressReporter, ProgressTracker
+from . import quarantine, sharding
+from .regression import RegressionDetector, RegressionPlugin
+from .resources import REPORT_ATTRIBUTE, ResourcePlugin, ResourceSampler
+from .reportstore import (RETAIN_ALL, RETAIN_NONE, RETAIN_SUMMARY,
+                          ReportSummary, SectionLimiter)
+from .spool import Spool
+
 
 VERDICT_MAP = {
     'passed': 'pass',
@@ -25,6 +45,20 @@ VERDICT_MAP = {
     'error': 'error'
 }
 
+# Maximum size (bytes) of the event spool
+MAX_SPOOL_SIZE = 64 * 1024 * 1024
+
+# Appended to the suite name of the quarantine lane (see quarantine.ONLY)
+QUARANTINE_SUITE = 'quarantine'
+
+# Maximum time (seconds) a shard waits for the session to be announced by
+# the shard which created the plan (see sharding.ShardCoordinator)
+ANNOUNCE_TIMEOUT = 2 * sender.CLOSE_TIMEOUT
+
+# Outcomes of test phases, in increasing order of precedence for the
+# outcome of the test case
+_OUTCOMES = ['passed', 'skipped', 'failed']
+
 
 def _log(fmt, *args):
     # TODO use print, logging or py.test facility if it exists
@@ -44,6 +78,31 @@ else:
     def _hash_suite(suite_name):
         return md5.md5(suite_name).hexdigest()
 
+_GIT_COMMANDS = {
+    SUITE_KEY_GIT_COMMIT: ['git', 'rev-parse', 'HEAD'],
+    SUITE_KEY_GIT_BRANCH: ['git', 'rev-parse', '--abbrev-ref', 'HEAD'],
+}
+
+
+def resolve_suite_key(suite_key, root_dir):
+    """Determines the value of a suite key: the current git commit or
+       branch, the root directory, or the key itself
+
+       :return: value, or None if it cannot be determined
+    """
+    if suite_key == SUITE_KEY_ROOTDIR:
+        return root_dir
+    if suite_key not in _GIT_COMMANDS:
+        return suite_key
+    try:
+        output = subprocess.check_output(_GIT_COMMANDS[suite_key],
+                                         cwd=root_dir,
+                                         stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError) as e:
+        _log('Cannot determine suite key "%s": %s', suite_key, e)
+        return None
+    return output.decode('utf-8').strip()
+
 
 class TestMonitorPlugin(object):
 
@@ -52,54 +111,208 @@ class TestMonitorPlugin(object):
 
        TODO graceful termination
     """
-    # needs to be at class level because py.test uses
-    # a new plugin instance when starting the test session
-    # after collecting test cases
-    tc_count = 0
 
-    def __init__(self, websocket_url):
+    def __init__(self, websocket_url, history=None, reorder=False,
+                 spool_path=None, suite_key=None, phase_timings=False,
+                 retain_reports=RETAIN_ALL, section_limiter=None,
+                 progress_interval=None, result_stream=RESULTS_ALL,
+                 result_sample=1, history_db=None, regression_detector=None,
+                 quarantine_path=None, quarantine_policy=None,
+                 quarantine_mode=quarantine.INCLUDE, shard=None,
+                 shard_dir=None, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 send_timeout=DEFAULT_SEND_TIMEOUT, background_connect=False,
+                 **sender_options):
+        """:param history: history.TestHistory in which outcomes and
+                           durations are recorded
+           :param reorder: if True, test cases are executed in the order
+                           determined by the history (see
+                           history.TestHistory.order)
+           :param spool_path: file in which events are kept while the
+                              purkinje server is not reachable
+           :param suite_key: distinguishes test suites which have the same
+                             host and working directory (e.g. the git
+                             commit)
+           :param phase_timings: if True, the durations of setup, call
+                                 and teardown of each test case are
+                                 reported (events.TestCaseTimingEvent)
+           :param retain_reports: which test reports to keep in
+                                  self.reports: all (complete), summary
+                                  (reportstore.ReportSummary) or none
+           :param section_limiter: reportstore.SectionLimiter truncating
+                                   sections of retained reports
+           :param progress_interval: if given, the progress of the session
+                                     is reported every progress_interval
+                                     seconds (events.SessionProgressEvent)
+           :param result_stream: which test case results to send (see
+                                 RESULT_STREAMS)
+           :param result_sample: of the results of passed test cases, only
+                                 every result_sample-th is sent
+           :param history_db: historydb.HistoryDatabase in which all
+                              results are recorded; if given, it is used
+                              instead of history to order tests and to
+                              estimate durations
+           :param regression_detector: regression.RegressionDetector
+                                       comparing durations with the
+                                       statistics in history_db
+           :param quarantine_path: quarantine file; the test cases listed
+                                   in it are handled according to
+                                   quarantine_mode (see quarantine.MODES)
+           :param quarantine_policy: quarantine.QuarantinePolicy; if given,
+                                     the quarantine file is updated at the
+                                     end of the session from the statistics
+                                     in history_db
+           :param shard: (index, count): only the test cases of one of
+                         count shards are executed, balanced by their
+                         durations in previous sessions
+           :param shard_dir: directory shared by all shards of a session
+                             (see sharding.ShardCoordinator), so that they
+                             report a single session
+           :param connect_timeout: maximum time (seconds) to wait for the
+                                   server to accept the connection (None
+                                   or 0: no limit)
+           :param send_timeout: maximum time (seconds) to wait for the
+                                server to accept a frame
+           :param background_connect: if True, the connection is
+                                      established by the sender thread,
+                                      so that the session does not wait
+                                      for the server; events are queued
+                                      until then
+        """
         self.reports = []
+        # number of collected test cases
+        self.tc_count = 0
+        self._retain_reports = retain_reports
+        self._section_limiter = section_limiter
+        self._history = history
+        self._reorder = reorder
         self._websocket_url = websocket_url
+        self._connect_timeout = connect_timeout or None
+        self._send_timeout = send_timeout or None
         self._websocket = None
+        self._sender = None
         self._test_cases = {}
+        self._suite_key = suite_key
+        self._phase_timings = phase_timings
+        # determined once per session (see suite_name(), suite_hash())
+        self._suite_name = None
+        self._suite_hash = None
         self._current_suite = None
         self._start_message_sent = False
+        self._result_stream = result_stream
+        self._result_sample = max(1, result_sample)
+        self._passed_count = 0
+        self._history_db = history_db
+        self._regression_detector = regression_detector
+        self._quarantine_path = quarantine_path
+        self._quarantine_policy = quarantine_policy
+        self._quarantine_mode = quarantine_mode
+        self._shard = shard
+        self._shard_coordinator = None
+        if shard is not None and shard_dir:
+            self._shard_coordinator = sharding.ShardCoordinator(
+                shard_dir, *shard)
+        self._suite_history = None
+        # source of previous outcomes and durations
+        self._estimates = history
+        if history_db is not None:
+            self._suite_history = history_db.suite(
+                self._history_suite_hash())
+            self._estimates = self._suite_history
+        self._progress = None
+        self._progress_reporter = None
+        if progress_interval:
+            self._progress = ProgressTracker(self._estimates)
+            self._progress_reporter = ProgressReporter(
+                self._progress, self._send_progress, progress_interval)
 
         try:
-            _log('Connecting to WebSocket %s', websocket_url)
-            self._websocket = websocket.create_connection(websocket_url)
+            _check_url(websocket_url)
+            if background_connect:
+                _log('Connecting to WebSocket %s in the background',
+                     websocket_url)
+            else:
+                _log('Connecting to WebSocket %s', websocket_url)
+                self._websocket = self._connect()
         except ValueError:
             _log('Invalid WebSocket URL: "%s"',
                  self._websocket_url)
+            return
         except Exception as e:
             _log('Error connecting to WebSocket at URL %s: %s',
                  self._websocket_url, e)
+            if spool_path:
+                _log('Events will be kept in %s until the purkinje server'
+                     ' is reachable', spool_path)
+
+        offline_spool = None
+        if spool_path:
+            offline_spool = Spool(spool_path, MAX_SPOOL_SIZE)
+        self._sender = sender.EventSender(self._websocket,
+                                          connect=self._connect,
+                                          offline_spool=offline_spool,
+                                          eager_connect=background_connect,
+                                          **sender_options)
+
+    def _connect(self):
+        result = websocket.create_connection(self._websocket_url,
+                                             timeout=self._connect_timeout)
+        result.settimeout(self._send_timeout)
+        return result
 
     def is_websocket_connected(self):
+        if self._sender is not None:
+            return self._sender.is_connected
         return self._websocket is not None
 
-    def suite_name(self):
+    def _base_suite_name(self):
         current_dir = os.getcwd()
         # current_dir_base = op.basename(current_dir)
-        return '{0}: {1}'.format(socket.gethostname(),
+        name = '{0}: {1}'.format(socket.gethostname(),
                                  current_dir)
+        if self._suite_key:
+            name = '{0} ({1})'.format(name, self._suite_key)
+        return name
+
+    def suite_name(self):
+        if self._suite_name is None:
+            name = self._base_suite_name()
+            if self._quarantine_mode == quarantine.ONLY:
+                # the quarantine lane runs concurrently with a session of
+                # the other tests, so it is reported as a suite of its own
+                name = '{0} [{1}]'.format(name, QUARANTINE_SUITE)
+            self._suite_name = name
+        return self._suite_name
 
     def suite_hash(self):
-        return _hash_suite(self.suite_name())
+        if self._suite_hash is None:
+            self._suite_hash = _hash_suite(self.suite_name())
+        return self._suite_hash
+
+    def _history_suite_hash(self):
+        """:return: suite hash under which results are recorded in the
+                    history database; the quarantine lane shares the
+                    history of the other tests
+        """
+        if self._quarantine_mode == quarantine.ONLY:
+            return _hash_suite(self._base_suite_name())
+        return self.suite_hash()
 
     def send_event(self, event):
         """Send event via WebSocket connection.
-           If there is no connection, the event will be dumped to the log
-           only, so it is possible to run tests with purkinje enabled even
-           if the server should be down
+           The event is queued and sent by a background thread, so
+           test execution does not have to wait for the server.
+           If the server is not reachable, the event is kept in the
+           spool and sent once the connection has been re-established.
+           Without a sender (invalid URL), the event will be dumped to the
+           log only, so it is possible to run tests with purkinje enabled
+           even if the server should be down
         """
         ser_event = None
         try:
-            ser_event = event.serialize()
-
-            if self._websocket:
-                self._websocket.send(ser_event)
+            if self._sender:
+                self._sender.send(event)
             else:
+                ser_event = event.serialize()
                 _log('purkinje server not available; event: %s',
                      ser_event)
         except Exception as e:
@@ -107,47 +320,177 @@ class TestMonitorPlugin(object):
             _log('Error while sending event "%s": %s',
                  ser_event or event.data, e)
 
+    def flush_events(self, timeout=None):
+        """Waits until all events sent so far have been delivered
+
+           :param timeout: maximum time (seconds) to wait (None: no limit)
+        """
+        if self._sender:
+            self._sender.flush(timeout)
+
     def pytest_sessionstart(self):
         _log('*** py.test session started ***')
+        self.tc_count = 0
 
-    def _send_start_event(self):
+    def _send_start_event(self, tc_count=None):
         self._current_suite = self.suite_name()
         self.send_event(SessionStartedEvent(
             suite_name=self.suite_name(),
             suite_hash=self.suite_hash(),
-            tc_count=TestMonitorPlugin.tc_count
+            tc_count=self.tc_count if tc_count is None else tc_count
         ))
 
+    def announce_tests(self, tc_count):
+        """Announces the session before collection, if the number of test
+           cases is known in advance (see collectcache.CollectionCache) and
+           no test cases are going to be removed after collection
+        """
+        if (self._start_message_sent or self._shard is not None or
+                self._quarantine_mode in (quarantine.EXCLUDE,
+                                          quarantine.ONLY)):
+            return
+        self._send_start_event(tc_count)
+        self._start_message_sent = True
+
+    def _send_progress(self, progress):
+        self.send_event(SessionProgressEvent(suite_hash=self.suite_hash(),
+                                             **progress))
+
     def pytest_sessionfinish(self):
         _log('*** py.test session finished ***')
-        self.send_event(SessionTerminatedEvent(
-            suite_hash=self.suite_hash()
-        ))
+        if self._progress_reporter is not None:
+            self._progress_reporter.stop()
+        terminate = True
+        if self._shard_coordinator is not None:
+            # the results of this shard have to reach the server before
+            # the last shard terminates the session
+            self.flush_events(sender.CLOSE_TIMEOUT)
+            terminate = self._shard_coordinator.finish()
+        if terminate:
+            self.send_event(SessionTerminatedEvent(
+                suite_hash=self.suite_hash()
+            ))
         self.send_event(ConnectionTerminationEvent(
             suite_hash=self.suite_hash()
         ))
+        if self._sender:
+            # deliver everything that is still queued before py.test exits
+            self._sender.close()
+        if self._history is not None:
+            self._history.save()
+        if self._history_db is not None:
+            self._update_quarantine()
+            self._history_db.close()
+
+    def _update_quarantine(self):
+        if self._quarantine_path and self._quarantine_policy is not None:
+            quarantine.save_quarantine(
+                self._quarantine_path,
+                self._quarantine_policy.select(self._suite_history))
+
+    def pytest_collection_modifyitems(self, session, config, items):
+        if self._reorder and self._estimates is not None:
+            self._estimates.order(items)
+        if self._quarantine_path:
+            deselected = quarantine.apply_quarantine(
+                items, quarantine.load_quarantine(self._quarantine_path),
+                self._quarantine_mode)
+            if deselected:
+                config.hook.pytest_deselected(items=deselected)
+        if self._shard is not None:
+            self._select_shard(config, items)
+        if self._progress is not None:
+            self._progress.set_tests([x.nodeid for x in items])
+
+    def _select_shard(self, config, items):
+        """Removes the test items of the other shards. With a shard
+           coordinator, only the shard creating the plan announces the
+           session; the other shards wait until the announcement has been
+           delivered before executing tests.
+        """
+        index, count = self._shard
+        nodeids = [x.nodeid for x in items]
+
+        def create():
+            return sharding.plan_shards(nodeids, count, self._estimates)
+
+        if self._shard_coordinator is not None:
+            plan, created = self._shard_coordinator.plan(create)
+            if created:
+                # all shards together execute the remaining test cases
+                self._send_start_event(len(items))
+                self.flush_events(sender.CLOSE_TIMEOUT)
+                self._shard_coordinator.announced()
+            elif not self._shard_coordinator.wait_announced(
+                    ANNOUNCE_TIMEOUT):
+                _log('Session not announced after %s seconds; executing'
+                     ' tests anyway', ANNOUNCE_TIMEOUT)
+            self._start_message_sent = True
+        else:
+            plan = create()
+        selected, deselected = [], []
+        for item in items:
+            shard = plan.get(item.nodeid)
+            if shard is None:
+                shard = sharding.fallback_shard(item.nodeid, count)
+            (selected if shard == index else deselected).append(item)
+        items[:] = selected
+        if deselected:
+            config.hook.pytest_deselected(items=deselected)
+
+    def pytest_collection_finish(self, session):
+        """The session reports the test cases which remain after
+           deselection (e.g. of quarantined test cases)
+        """
+        self.tc_count = len(session.items)
 
-    # def pytest_collection_modifyitems(self, session, config, items):
-    #     print('pytest_collection_modifyitems: {0} {1} {2}'.format(session,
-    #                                                               config,
-    #                                                               items))
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_xdist_node_collection_finished(self, node, ids):
+        """pytest-xdist controller: all workers collect the complete
+           test suite, so the first worker to finish collecting determines
+           the number of test cases of the distributed session
+        """
+        if self._start_message_sent:
+            return
+        self.tc_count = len(ids)
+        if self._progress is not None:
+            self._progress.set_tests(ids)
+        self._send_start_event()
+        self._start_message_sent = True
+
+    def pytest_runtest_logstart(self, nodeid, location):
+        if self._progress is None:
+            return
+        if not self._start_message_sent:
+            # progress events refer to the session, so it has to be
+            # announced before the first one is sent
+            self._send_start_event()
+            self._start_message_sent = True
+        self._progress.started(nodeid)
+        self._progress_reporter.start()
 
     def pytest_collectstart(self, collector):
         _log('pytest_collectstart: %s', collector)
 
-    def _is_relevant_tc(self, tc):
-        return isinstance(tc, pytest.Item)
-
     def pytest_collectreport(self, report):
         _log('pytest_collectreport: %s', report)
 
-        test_funcs = [x
-                      for x
-                      in report.result
-                      if self._is_relevant_tc(x)
-                      ]
-        TestMonitorPlugin.tc_count += len(test_funcs)
-        # import pdb; pdb.set_trace()
+    def _tc_name(self, report):
+        tc_components = report.nodeid.split('::')
+
+        if len(tc_components) > 1:
+            return tc_components[1]
+
+        # try to find a human-readable name
+        # for the test case
+        if 'pep8' in report.keywords:
+            # when found in cache, the py.test pep8 plugin
+            # reports skipped tests for each unchanged
+            # Python files. For testing, the py.test
+            # option --clearcache may be used to force
+            # execution of pep8 checks on each file
+            return 'PEP8'
+        return str(report.keywords)
 
     def pytest_runtest_logreport(self, report):
         # _log('pytest_runtest_logreport: %s', report)
@@ -156,27 +499,16 @@ class TestMonitorPlugin(object):
         #          report.nodeid, report.when, self._test_cases)
 
         tc_file = report.fspath
-        tc_components = report.nodeid.split('::')
-
-        if len(tc_components) > 1:
-            tc_name = tc_components[1]
-        else:
-            # try to find a human-readable name
-            # for the test case
-            if 'pep8' in report.keywords:
-                tc_name = 'PEP8'
-                # when found in cache, the py.test pep8 plugin
-                # reports skipped tests for each unchanged
-                # Python files. For testing, the py.test
-                # option --clearcache may be used to force
-                # execution of pep8 checks on each file
-            else:
-                tc_name = str(report.keywords)
-
+        tc_name = self._tc_name(report)
         rep_key = report.nodeid
 
-        if report.when == 'setup':
-            self._test_cases[rep_key] = time.time()
+        self._track_phase(report)
+        if report.when == 'teardown':
+            self._finish_test_case(report, tc_name)
+
+        if (self._history is not None and report.failed and
+                report.when != 'call'):
+            self._history.record_failure(rep_key)
 
         if ((report.when != 'call') and not
             (report.when == 'setup' and
@@ -187,8 +519,9 @@ class TestMonitorPlugin(object):
             if rep_key not in self._test_cases:
                 _log('Test case {0} not found'.format(tc_name))
                 return
-            duration = int((time.time() -
-                            self._test_cases[rep_key]) * 1000)
+            call_us = self._test_cases[rep_key]['call'] = \
+                _duration_us(report)
+            duration = call_us // 1000
         else:
             duration = 0
 
@@ -196,37 +529,234 @@ class TestMonitorPlugin(object):
             self._send_start_event()
             self._start_message_sent = True
 
-        self.send_event(TestCaseFinishedEvent(
+        if self._is_result_sent(report):
+            self.send_event(TestCaseFinishedEvent(
+                name=tc_name,
+                file=tc_file,
+                verdict=VERDICT_MAP[report.outcome],
+                duration=duration,
+                suite_hash=self.suite_hash()))
+        if self._history is not None:
+            self._history.record(rep_key, report.failed, duration)
+        self._retain(report)
+
+    def _track_phase(self, report):
+        if report.when == 'setup':
+            # durations (microseconds) of the phases of the test case
+            self._test_cases[report.nodeid] = {'setup': _duration_us(report)}
+        phases = self._test_cases.get(report.nodeid)
+        if phases is not None and report.outcome != 'passed':
+            phases['outcome'] = max(phases.get('outcome', 'passed'),
+                                    report.outcome, key=_OUTCOMES.index)
+
+    def _is_result_sent(self, report):
+        if self._result_stream == RESULTS_NONE:
+            return False
+        if not report.passed:
+            return True
+        if self._result_stream == RESULTS_FAILURES:
+            return False
+        self._passed_count += 1
+        return (self._passed_count - 1) % self._result_sample == 0
+
+    def _retain(self, report):
+        if self._retain_reports == RETAIN_SUMMARY:
+            self.reports.append(ReportSummary(report))
+        elif self._retain_reports != RETAIN_NONE:
+            if self._section_limiter is not None:
+                report = self._section_limiter.apply(report)
+            self.reports.append(report)
+
+    def _finish_test_case(self, report, tc_name):
+        """Reports the resources used by a test case (if measured) and
+           the durations of its phases once it has been torn down
+        """
+        resources = getattr(report, REPORT_ATTRIBUTE, None)
+        if isinstance(resources, dict):
+            self.send_event(TestCaseResourcesEvent(
+                name=tc_name,
+                file=report.fspath,
+                suite_hash=self.suite_hash(),
+                **resources))
+        phases = self._test_cases.pop(report.nodeid, None)
+        call_us = phases.get('call', 0) if phases else 0
+        if self._progress is not None:
+            self._progress.finished(report.nodeid, call_us / 1000000.0)
+        if self._suite_history is not None and phases is not None:
+            self._record_history(report, tc_name,
+                                 phases.get('outcome', 'passed'), call_us)
+        if phases is None or not self._phase_timings:
+            return
+        self.send_event(TestCaseTimingEvent(
             name=tc_name,
-            file=tc_file,
-            verdict=VERDICT_MAP[report.outcome],
-            duration=duration,
+            file=report.fspath,
+            setup_us=phases['setup'],
+            call_us=phases.get('call', 0),
+            teardown_us=_duration_us(report),
             suite_hash=self.suite_hash()))
-        self.reports.append(report)
 
+    def _record_history(self, report, tc_name, outcome, call_us):
+        """Records the result of a test case in the history database,
+           after comparing its duration with previous executions
+        """
+        if self._regression_detector is not None and outcome == 'passed':
+            regression = self._regression_detector.check(
+                report.nodeid, call_us,
+                self._suite_history.statistics(report.nodeid))
+            if regression is not None:
+                self._send_regression(report, tc_name, regression)
+        self._suite_history.record(report.nodeid, outcome, call_us)
+
+    def _send_regression(self, report, tc_name, regression):
+        fields = {}
+        if regression.sigma is not None:
+            fields['sigma'] = regression.sigma
+        self.send_event(TestCaseRegressionEvent(
+            name=tc_name,
+            file=report.fspath,
+            duration_us=regression.duration_us,
+            baseline_us=regression.baseline_us,
+            stddev_us=regression.stddev_us,
+            suite_hash=self.suite_hash(),
+            **fields))
 
-def pytest_addoption(parser):
-    parser.addoption(
-        '--websocket_host',
-        nargs='?',
-        default='localhost',
-        const=True,
-        dest='websocket_host',
-        help='WebSocket hostname or IP address of purkinje server'
-    )
 
-    parser.addoption(
-        '--websocket_port',
-        nargs='?',
-        default=5000,
-        const=True,
-        dest='websocket_port',
-        help='WebSocket TCP ort of purkinje server'
-    )
+def _duration_us(report):
+    """:return: duration (microseconds) of a test phase, as measured by
+                py.test
+    """
+    return int(round(report.duration * 1000000))
+
+
+def _check_url(url):
+    """Raises ValueError unless url is a WebSocket URL"""
+    parsed = urlparse(url)
+    if parsed.scheme not in ('ws', 'wss') or not parsed.netloc:
+        raise ValueError('Invalid WebSocket URL: {0}'.format(url))
+
+
+def is_xdist_worker(config):
+    """Determines whether py.test runs as a pytest-xdist worker process
+    """
+    for attr in ('workerinput', 'slaveinput'):
+        if isinstance(getattr(config, attr, None), dict):
+            return True
+    return False
+
+
+def _rootdir(config):
+    return str(getattr(config, 'rootpath', None) or config.rootdir)
+
+
+def _section_limiter(config):
+    max_size = config.getoption('purkinje_max_section_size')
+    if max_size is None:
+        return None
+    return SectionLimiter(max_size,
+                          config.getoption('purkinje_section_spill_dir'))
+
+
+def _regression_detector(config, history_db):
+    fail = config.getoption('purkinje_fail_on_regression')
+    if not (fail or config.getoption('purkinje_regressions')):
+        return None
+    if history_db is None:
+        _log('Detection of regressions requires --purkinje_history_db')
+        return None
+    detector = RegressionDetector(
+        config.getoption('purkinje_regression_sigma'),
+        config.getoption('purkinje_regression_min_delta'))
+    config.pluginmanager.register(RegressionPlugin(detector, fail))
+    return detector
+
+
+def _spool_file(config):
+    """py.test processes running concurrently (shards, quarantine lane)
+       must not share a spool
+    """
+    shard = config.getoption('purkinje_shard')
+    if shard is not None:
+        return 'events-{0}.spool'.format(shard[0] + 1)
+    if config.getoption('purkinje_quarantine_mode') == quarantine.ONLY:
+        return 'events-quarantine.spool'
+    return SPOOL_FILE
+
+
+def _quarantine_policy(config, history_db):
+    if history_db is None or not config.getoption('purkinje_quarantine'):
+        return None
+    return quarantine.QuarantinePolicy(
+        config.getoption('purkinje_quarantine_flips'),
+        config.getoption('purkinje_quarantine_slow'))
 
 
 def pytest_configure(config):
+    """Registers the plugins; called by plugin.pytest_configure if
+       purkinje is enabled
+    """
+    coverage_index = config.getoption('purkinje_coverage_index')
+    if coverage_index:
+        # needs to be active in pytest-xdist workers, too
+        root_dir = _rootdir(config)
+        config.pluginmanager.register(CoveragePlugin(
+            CoverageIndex(coverage_index, root_dir), root_dir))
+
+    if config.getoption('purkinje_resources'):
+        # measured where tests are executed, i.e. in pytest-xdist workers
+        config.pluginmanager.register(ResourcePlugin(ResourceSampler(
+            config.getoption('purkinje_trace_allocations'))))
+
+    if is_xdist_worker(config):
+        # Test reports of workers are forwarded to the controller
+        # process by pytest-xdist; only the controller talks to the
+        # purkinje server
+        return
+
     websocket_host = config.getoption('websocket_host')
     websocket_port = config.getoption('websocket_port')
     websocket_url = 'ws://{}:{}/event'.format(websocket_host, websocket_port)
-    config.pluginmanager.register(TestMonitorPlugin(websocket_url))
+    history_path = config.getoption('purkinje_history')
+    history_db_path = config.getoption('purkinje_history_db')
+    history_db = HistoryDatabase(history_db_path) if history_db_path else None
+    suite_key = config.getoption('purkinje_suite_key')
+    if suite_key:
+        suite_key = resolve_suite_key(suite_key, _rootdir(config))
+    spool_path = config.getoption('purkinje_spool')
+    if spool_path is None:
+        spool_path = cache_path(_rootdir(config), _spool_file(config))
+    plugin = TestMonitorPlugin(
+        websocket_url,
+        history=TestHistory(history_path) if history_path else None,
+        history_db=history_db,
+        regression_detector=_regression_detector(config, history_db),
+        quarantine_path=config.getoption('purkinje_quarantine'),
+        quarantine_policy=_quarantine_policy(config, history_db),
+        quarantine_mode=config.getoption('purkinje_quarantine_mode'),
+        shard=config.getoption('purkinje_shard'),
+        shard_dir=config.getoption('purkinje_shard_dir'),
+        reorder=config.getoption('purkinje_failed_first'),
+        spool_path=spool_path,
+        suite_key=suite_key,
+        phase_timings=config.getoption('purkinje_phase_timings'),
+        retain_reports=config.getoption('purkinje_retain_reports'),
+        section_limiter=_section_limiter(config),
+        progress_interval=config.getoption('purkinje_progress_interval'),
+        result_stream=config.getoption('purkinje_result_stream'),
+        result_sample=config.getoption('purkinje_result_sample'),
+        batch_size=config.getoption('purkinje_batch_size'),
+        flush_interval=config.getoption('purkinje_flush_interval'),
+        queue_size=config.getoption('purkinje_queue_size'),
+        backpressure=config.getoption('purkinje_backpressure'),
+        connect_timeout=config.getoption('purkinje_connect_timeout'),
+        send_timeout=config.getoption('purkinje_send_timeout'),
+        background_connect=not config.getoption('purkinje_sync_connect'),
+        encoding=config.getoption('purkinje_encoding'),
+        compress=config.getoption('purkinje_compress'))
+    config.pluginmanager.register(plugin)
+
+    collection_cache = config.getoption('purkinje_collection_cache')
+    if collection_cache:
+        root_dir = _rootdir(config)
+        config.pluginmanager.register(CollectionCachePlugin(
+            CollectionCache(collection_cache, root_dir), root_dir,
+            announce=plugin.announce_tests))
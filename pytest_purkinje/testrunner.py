@@ -3,16 +3,68 @@
 """Automatic test execution"""
 
 from __future__ import print_function
+from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
+import argparse
 import logging
 import time
 import os
+import os.path as op
+from . import collectcache, contentindex, depgraph, historydb
+from . import impactindex, inotify
+from . import quarantine, workerpool
+from .scheduler import DEFAULT_DEBOUNCE_PERIOD
+from .defs import cache_path
 from .handler import Handler
+from .watchfilter import WatchFilter, DEFAULT_INCLUDE
 logger = logging.getLogger(__file__)
 
+WATCHDOG = 'watchdog'
+INOTIFY = 'inotify'
 
-# Extensions of files to be watched
-EXTENSIONS = ['.py']
+
+class DirectoryHandler(FileSystemEventHandler):
+
+    """Keeps the set of watched directories up to date when directories
+       are created, moved or deleted
+    """
+
+    def __init__(self, runner):
+        self._runner = runner
+
+    def on_created(self, event):
+        if event.is_directory:
+            self._runner.watch_tree(event.src_path)
+
+    def on_deleted(self, event):
+        if event.is_directory:
+            self._runner.unwatch_tree(event.src_path)
+
+    def on_moved(self, event):
+        if event.is_directory:
+            self._runner.unwatch_tree(event.src_path)
+            self._runner.watch_tree(event.dest_path)
+
+
+class BatchHandler(object):
+
+    """Receives batches of changes from inotify.InotifyObserver"""
+
+    def __init__(self, runner):
+        self._runner = runner
+
+    def files_changed(self, paths):
+        self._runner.event_handler.add_relevant_paths(paths)
+
+    def directory_created(self, path):
+        self._runner.watch_tree(path)
+
+    def directory_deleted(self, path):
+        self._runner.unwatch_tree(path)
+
+    def events_lost(self):
+        logger.warning('inotify event queue overflow; running all tests')
+        self._runner.event_handler.add_all()
 
 
 class TestRunner:
@@ -20,41 +72,52 @@ class TestRunner:
     """Watches project directory and executes test when relevant files
        have been changed
 
-       TODO: ensure that ulimit is sufficient for number of
-             files to be monitored
-       TODO: exclude subdirectories like .tox (configurable)
-       TODO: observer should only look at relevant files (_filter() == True).
-             Is this supported?
+       Only directories which contain relevant files (and the directories
+       leading to them) are watched; excluded directories (see
+       watchfilter.WatchFilter) are skipped entirely. Directories created
+       later on are watched as they appear.
     """
 
-    def __init__(self, dir_):
+    def __init__(self, dir_, selector=None, pytest_args=None, pool=None,
+                 debounce=DEFAULT_DEBOUNCE_PERIOD, cancel_stale_runs=False,
+                 watch_filter=None, quarantine_lane=None, shards=0,
+                 observer=WATCHDOG, content_index=None):
+        """:param observer: WATCHDOG or INOTIFY (see inotify.InotifyObserver)
+           :param content_index: contentindex.ContentIndex (see
+                                 handler.Handler)
+        """
         self._dir = dir_
+        self._selector = selector
+        self._pool = pool
+        self._content_index = content_index
+        self.watch_filter = watch_filter or WatchFilter(dir_)
+        # directory -> watchdog watch (or inotify watch descriptor)
+        self._watches = {}
 
-        self.event_handler = Handler()
-        self.observer = Observer()
+        self.event_handler = Handler(selector, pytest_args, pool,
+                                     debounce, cancel_stale_runs,
+                                     watch_filter=self.watch_filter,
+                                     quarantine_lane=quarantine_lane,
+                                     shards=shards,
+                                     content_index=content_index)
+        self.directory_handler = DirectoryHandler(self)
+        self._native = observer == INOTIFY
+        if self._native:
+            self.observer = inotify.InotifyObserver(BatchHandler(self),
+                                                    self.watch_filter)
+        else:
+            self.observer = Observer()
 
     @staticmethod
-    def check_watch_limit(dir_):
+    def check_watch_limit(watch_count):
         """Checks whether system limit prevents watching all relevant
-           files
+           directories
         """
         max_user_watches = TestRunner.get_max_user_watches()
-        file_count = TestRunner.get_file_count(dir_)
-        if file_count > max_user_watches:
+        if watch_count > max_user_watches:
             raise Exception(('User limit "max_user_watches" too low'
-                             ' ({0}) to watch all {1} files')
-                            .format(max_user_watches, file_count))
-
-    @staticmethod
-    def get_file_count(dir_):
-        """Counts how many relevant files there are to watch
-        """
-        result = 0
-        for roots, dirs, files in os.walk(dir_):
-            for f in files:
-                result += 1
-            result += 1
-        return result
+                             ' ({0}) to watch all {1} directories')
+                            .format(max_user_watches, watch_count))
 
     @staticmethod
     def get_max_user_watches():
@@ -64,16 +127,67 @@ class TestRunner:
         with open('/proc/sys/fs/inotify/max_user_watches') as f:
             return int(f.read())
 
+    def _watch(self, dir_):
+        if dir_ in self._watches:
+            return
+        if self._native:
+            self._watches[dir_] = self.observer.schedule(dir_)
+            return
+        watch = self.observer.schedule(self.event_handler, dir_,
+                                       recursive=False)
+        self.observer.add_handler_for_watch(self.directory_handler, watch)
+        self._watches[dir_] = watch
+
+    def watch_tree(self, dir_):
+        """Starts watching a new directory (and relevant subdirectories)
+        """
+        dir_ = op.abspath(dir_)
+        if self.watch_filter.is_excluded_dir(dir_):
+            return
+        new_files = []
+        for root, files in self.watch_filter.walk(dir_):
+            new_files.extend(op.join(root, x) for x in files)
+        for path in self.watch_filter.watch_dirs(dir_):
+            self._watch(path)
+        # files may have been created before the watch was in place
+        if new_files:
+            self.event_handler.add_paths(new_files)
+        try:
+            self.check_watch_limit(len(self._watches))
+        except Exception as e:
+            logger.warning('%s', e)
+
+    def unwatch_tree(self, dir_):
+        """Stops watching a directory that has been removed
+        """
+        dir_ = op.abspath(dir_)
+        for path in list(self._watches):
+            if path == dir_ or path.startswith(dir_ + op.sep):
+                watch = self._watches.pop(path)
+                try:
+                    self.observer.unschedule(watch)
+                except (KeyError, OSError) as e:
+                    logger.debug('Cannot unschedule %s: %s', path, e)
+
     def start(self, single_run=False):
         """Watch directory forever and execute test cases
            :param single_run: if True, only wait for a short time (testing)
         """
         print('{0}: watching directory "{1}"'.format(
             self.__class__, self._dir))
-        self.observer.schedule(self.event_handler, self._dir, recursive=True)
+        if self._selector is not None:
+            self._selector.update()
 
-        # TODO should be checked when new files get added
-        self.check_watch_limit(self._dir)
+        watch_dirs = self.watch_filter.watch_dirs()
+        self.check_watch_limit(len(watch_dirs))
+        for dir_ in watch_dirs:
+            self._watch(dir_)
+        print('Watching {0} directories'.format(len(watch_dirs)))
+        if self._content_index is not None:
+            self.event_handler.index_files(
+                [op.join(root, x)
+                 for root, files in self.watch_filter.walk(self._dir)
+                 for x in files])
 
         self.observer.start()
 
@@ -84,8 +198,151 @@ class TestRunner:
                 time.sleep(1)
         except KeyboardInterrupt:
             self.observer.stop()
+            self.event_handler.stop()
+            if self._pool is not None:
+                self._pool.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Executes tests when project files change')
+    parser.add_argument(
+        '--selection',
+        choices=['imports', 'coverage', 'none'],
+        default='imports',
+        help=('How to select the tests to execute: tests depending on the'
+              ' changed files via imports, tests which executed code of'
+              ' the changed files in previous runs, or all tests'))
+    parser.add_argument(
+        '--no-reorder',
+        dest='reorder',
+        action='store_false',
+        help=('Execute tests in collection order instead of running'
+              ' tests which failed last time first, then the fastest'
+              ' test modules'))
+    parser.add_argument(
+        '--quarantine',
+        choices=['include', 'last', 'lane'],
+        default='last',
+        help=('How to execute flaky and slow tests: like other tests,'
+              ' after all other tests, or in a separate py.test process in'
+              ' parallel to the other tests'))
+    parser.add_argument(
+        '--include',
+        action='append',
+        metavar='PATTERN',
+        help=('Glob pattern of file names relevant for test execution'
+              ' (may be given multiple times; default: {0})'.format(
+                  ', '.join(DEFAULT_INCLUDE))))
+    parser.add_argument(
+        '--exclude',
+        action='append',
+        default=[],
+        metavar='PATTERN',
+        help=('Files or directories to ignore, in .gitignore syntax'
+              ' (may be given multiple times)'))
+    parser.add_argument(
+        '--no-gitignore',
+        dest='gitignore',
+        action='store_false',
+        help='Do not exclude the files listed in .gitignore')
+    parser.add_argument(
+        '--no-content-check',
+        dest='content_check',
+        action='store_false',
+        help=('Run tests whenever files are written, even if their'
+              ' contents have not changed'))
+    parser.add_argument(
+        '--debounce',
+        type=float,
+        default=DEFAULT_DEBOUNCE_PERIOD,
+        metavar='SECONDS',
+        help=('Time to wait for further changes before starting a test'
+              ' run'))
+    parser.add_argument(
+        '--cancel-stale-runs',
+        action='store_true',
+        help='Cancel the test run in progress when files change')
+    parser.add_argument(
+        '--warm-workers',
+        type=int,
+        default=0,
+        metavar='N',
+        help=('Execute tests in a pool of N pre-started worker processes'
+              ' instead of starting py.test for each run'))
+    parser.add_argument(
+        '--shards',
+        type=int,
+        default=0,
+        metavar='N',
+        help=('Distribute the tests to N py.test processes running'
+              ' concurrently, balanced by their durations in previous'
+              ' runs (cannot be combined with --warm-workers)'))
+    parser.add_argument(
+        '--observer',
+        choices=['auto', INOTIFY, WATCHDOG],
+        default='auto',
+        help=('How to watch the project directory: natively via inotify'
+              ' (Linux), or using watchdog (default: inotify where'
+              ' available)'))
+    parser.add_argument(
+        '--preload',
+        default='',
+        metavar='MODULES',
+        help=('Comma-separated list of modules to import in warm workers'
+              ' before the first run'))
+    args = parser.parse_args(argv)
+    if args.observer == 'auto':
+        args.observer = INOTIFY if inotify.is_available() else WATCHDOG
+    if args.shards > 1 and args.warm_workers > 0:
+        parser.error('--shards cannot be combined with --warm-workers')
+    return args
+
+
+def create_selector(dir_, selection):
+    """:return: (selector, additional py.test arguments)
+    """
+    if selection == 'imports':
+        return depgraph.ImportGraph(dir_), []
+    elif selection == 'coverage':
+        db_path = cache_path(dir_, impactindex.CACHE_FILE)
+        if not os.path.isdir(os.path.dirname(db_path)):
+            os.makedirs(os.path.dirname(db_path))
+        return (impactindex.CoverageIndex(db_path, dir_),
+                ['--purkinje_coverage_index', db_path])
+    return None, []
 
 
-def main():
-    fw = TestRunner('.')
+def main(argv=None):
+    args = parse_args(argv)
+    dir_ = '.'
+    selector, pytest_args = create_selector(dir_, args.selection)
+    pytest_args.append('--purkinje')
+    if args.reorder:
+        pytest_args.append('--purkinje_failed_first')
+    quarantine_path = cache_path(dir_, quarantine.CACHE_FILE)
+    # the history database is used instead of a history file
+    # (--purkinje_history)
+    pytest_args += ['--purkinje_history_db',
+                    cache_path(dir_, historydb.CACHE_FILE),
+                    '--purkinje_quarantine', quarantine_path,
+                    '--purkinje_collection_cache',
+                    cache_path(dir_, collectcache.CACHE_FILE)]
+    if args.quarantine == quarantine.LAST:
+        pytest_args += ['--purkinje_quarantine_mode', quarantine.LAST]
+    pool = None
+    if args.warm_workers > 0:
+        preload = workerpool.DEFAULT_PRELOAD + tuple(
+            x.strip() for x in args.preload.split(',') if x.strip())
+        pool = workerpool.WorkerPool(dir_, args.warm_workers, preload)
+    watch_filter = WatchFilter(dir_, args.include or DEFAULT_INCLUDE,
+                               args.exclude, args.gitignore)
+    content_index = None
+    if args.content_check:
+        content_index = contentindex.ContentIndex(
+            cache_path(dir_, contentindex.CACHE_FILE))
+    fw = TestRunner(dir_, selector, pytest_args, pool,
+                    args.debounce, args.cancel_stale_runs, watch_filter,
+                    quarantine_path if args.quarantine == 'lane' else None,
+                    args.shards, args.observer, content_index)
     fw.start()
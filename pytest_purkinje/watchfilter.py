@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+"""Selection of the files and directories to be watched"""
+
+import fnmatch
+import logging
+import os
+import os.path as op
+
+from .defs import IGNORED_DIRS
+
+logger = logging.getLogger(__name__)
+
+# Files to be watched
+DEFAULT_INCLUDE = ('*.py',)
+
+# Directories which are never watched
+DEFAULT_EXCLUDE = tuple(x + '/' for x in sorted(IGNORED_DIRS))
+
+
+def parse_ignore_file(path):
+    """Reads exclusion patterns from a .gitignore file
+
+       :return: list of patterns, or an empty list if the file does not
+                exist
+    """
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    except (IOError, OSError):
+        return []
+    return [x.rstrip() for x in lines
+            if x.strip() and not x.startswith('#')]
+
+
+class Pattern(object):
+
+    """A pattern in .gitignore syntax (subset): glob patterns match the
+       file name, unless they contain a slash, in which case they match
+       the path relative to the project directory. A trailing slash
+       restricts the pattern to directories, a leading '!' re-includes
+       previously excluded paths.
+    """
+
+    def __init__(self, pattern):
+        self.negated = pattern.startswith('!')
+        if self.negated:
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        self.anchored = '/' in pattern
+        self.pattern = pattern.lstrip('/')
+
+    def matches(self, rel_path, is_dir):
+        if self.dir_only and not is_dir:
+            return False
+        if self.anchored:
+            return fnmatch.fnmatch(rel_path, self.pattern)
+        return fnmatch.fnmatch(rel_path.rpartition('/')[2], self.pattern)
+
+
+class WatchFilter(object):
+
+    """Decides which files are relevant for test execution, and which
+       directories need to be watched
+    """
+
+    def __init__(self, dir_, include=DEFAULT_INCLUDE, exclude=(),
+                 use_gitignore=True):
+        """:param include: glob patterns of relevant file names
+           :param exclude: patterns (.gitignore syntax) of files and
+                           directories to be ignored
+           :param use_gitignore: if True, the patterns in the project's
+                                 .gitignore are excluded, too
+        """
+        self._dir = op.abspath(dir_)
+        self._include = list(include)
+        patterns = list(DEFAULT_EXCLUDE)
+        if use_gitignore:
+            patterns.extend(parse_ignore_file(op.join(self._dir,
+                                                      '.gitignore')))
+        patterns.extend(exclude)
+        self._exclude = [Pattern(x) for x in patterns]
+
+    def _rel_path(self, path):
+        """:return: path relative to the project directory, with '/' as
+                    separator
+        """
+        return op.relpath(op.abspath(path), self._dir).replace(op.sep, '/')
+
+    def _is_excluded(self, rel_path, is_dir):
+        excluded = False
+        for pattern in self._exclude:
+            if (pattern.negated == excluded and
+                    pattern.matches(rel_path, is_dir)):
+                excluded = not excluded
+        return excluded
+
+    def _is_relevant_name(self, rel_path):
+        name = rel_path.rpartition('/')[2]
+        return (any(fnmatch.fnmatch(name, x) for x in self._include) and
+                not self._is_excluded(rel_path, False))
+
+    def name_suffixes(self):
+        """Allows checking file names quickly for relevance, without
+           matching all patterns
+
+           :return: the suffixes (e.g. '.py') with which the names of
+                    relevant files end, or None if the include patterns are
+                    not all of the form '*suffix'
+        """
+        result = []
+        for pattern in self._include:
+            suffix = pattern[1:]
+            if (not pattern.startswith('*') or
+                    any(x in suffix for x in '*?[')):
+                return None
+            result.append(suffix)
+        return tuple(result)
+
+    def is_excluded_dir(self, path):
+        """:return: True if a directory or any of its parents is excluded
+        """
+        rel_path = self._rel_path(path)
+        if rel_path == '.':
+            return False
+        if rel_path.startswith('..'):
+            return True
+        parts = rel_path.split('/')
+        return any(self._is_excluded('/'.join(parts[:i]), True)
+                   for i in range(1, len(parts) + 1))
+
+    def is_relevant_file(self, path):
+        """:return: True if changes to a file may affect test results
+        """
+        return (self._is_relevant_name(self._rel_path(path)) and
+                not self.is_excluded_dir(op.dirname(op.abspath(path))))
+
+    def walk(self, dir_=None):
+        """Walks the non-excluded directories below dir_ (default: project
+           directory)
+
+           :return: iterator of (directory, [relevant file names])
+        """
+        for root, dirs, files in os.walk(op.abspath(dir_ or self._dir)):
+            rel_root = self._rel_path(root)
+            prefix = '' if rel_root == '.' else rel_root + '/'
+            dirs[:] = [x for x in dirs
+                       if not self._is_excluded(prefix + x, True)]
+            yield root, [x for x in files
+                         if self._is_relevant_name(prefix + x)]
+
+    def watch_dirs(self, dir_=None):
+        """Determines the directories to be watched below dir_ (default:
+           project directory): the directory itself, all directories
+           containing relevant files, and the directories in between (to
+           notice new subdirectories)
+
+           :return: sorted list of directories
+        """
+        top = op.abspath(dir_ or self._dir)
+        result = set([top])
+        for root, files in self.walk(top):
+            path = root
+            while files and path not in result:
+                result.add(path)
+                path = op.dirname(path)
+        return sorted(result)
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+
+"""Encodings of event frames sent to the purkinje server
+
+   Besides plain JSON, a compact binary encoding is supported, in which
+   the file names and suite hashes of test case results are sent only
+   once per connection and referenced by number afterwards.
+
+   Compact frame layout (all numbers big endian):
+
+   header      magic 'PKC', version (1 byte), flags (1 byte)
+   body        sequence of records, zlib-compressed if FLAG_ZLIB is set
+
+   Records start with their type (1 byte):
+
+   REC_STRING       length (2 bytes), UTF-8 text; defines the string with
+                    the next free number (starting at 0)
+   REC_TC_FINISHED  suite hash, file and verdict (string numbers, 4 bytes
+                    each), duration (ms, 4 bytes), timestamp (microseconds
+                    since 1970-01-01, local time, 8 bytes), name length
+                    (2 bytes), UTF-8 name
+   REC_EVENT        length (4 bytes), any event as JSON
+
+   FLAG_RESET tells the receiver to forget all strings defined so far,
+   e.g. after a frame might have been lost.
+"""
+
+from datetime import datetime, timedelta
+import json
+import logging
+import struct
+import zlib
+
+logger = logging.getLogger(__name__)
+
+JSON = 'json'
+COMPACT = 'compact'
+# Use the compact encoding if the server accepts it, else JSON
+AUTO = 'auto'
+
+ENCODINGS = (JSON, COMPACT, AUTO)
+
+# Name of the compact encoding in negotiation messages
+COMPACT_ID = 'purkinje-compact-1'
+
+MAGIC = b'PKC'
+VERSION = 1
+
+FLAG_ZLIB = 0x01
+FLAG_RESET = 0x02
+
+REC_STRING = 1
+REC_TC_FINISHED = 2
+REC_EVENT = 3
+
+FRAME_HEADER = struct.Struct('>3sBB')
+STRING_RECORD = struct.Struct('>BH')
+TC_FINISHED_RECORD = struct.Struct('>BIIIIqH')
+EVENT_RECORD = struct.Struct('>BI')
+
+# Smaller frame bodies are not worth compressing
+COMPRESS_MIN_SIZE = 512
+
+# Time to wait for the server's answer to an encoding offer (seconds)
+NEGOTIATION_TIMEOUT = 1.0
+
+TC_FINISHED = 'tc_finished'
+TC_FINISHED_FIELDS = frozenset(['type', 'timestamp', 'suite_hash', 'file',
+                                'name', 'verdict', 'duration'])
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def make_frame(serialized_events):
+    """Combines serialized (JSON) events into a single WebSocket frame.
+       A single event is sent as is, several events are sent as a
+       JSON array.
+    """
+    if len(serialized_events) == 1:
+        return serialized_events[0]
+    return u'[{0}]'.format(u','.join(serialized_events))
+
+
+def _parse_timestamp(text):
+    if hasattr(datetime, 'fromisoformat'):
+        return datetime.fromisoformat(text)
+    fmt = '%Y-%m-%dT%H:%M:%S.%f' if '.' in text else '%Y-%m-%dT%H:%M:%S'
+    return datetime.strptime(text, fmt)
+
+
+def _timestamp_to_int(text):
+    """:return: microseconds since the epoch
+    """
+    delta = _parse_timestamp(text) - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + \
+        delta.microseconds
+
+
+def _int_to_timestamp(value):
+    return (_EPOCH + timedelta(microseconds=value)).isoformat()
+
+
+class JsonEncoder(object):
+
+    """Text frames containing a JSON event, or a JSON array of events"""
+
+    name = JSON
+    binary = False
+
+    def reset(self):
+        pass
+
+    def encode(self, events):
+        """:param events: list of event data (dicts)
+           :return: frame
+        """
+        return make_frame([json.dumps(x) for x in events])
+
+
+class CompactEncoder(object):
+
+    """Binary frames in the compact encoding (see module documentation).
+       The encoder keeps track of the strings the receiver knows about;
+       reset() has to be called when a new connection is established, or
+       when a frame may have been lost.
+    """
+
+    name = COMPACT
+    binary = True
+
+    def __init__(self, compress=False):
+        self._compress = compress
+        self.reset()
+
+    def reset(self):
+        self._strings = {}
+        self._reset_pending = True
+
+    def _intern(self, text, parts):
+        """:return: number of a string; defines the string if necessary
+        """
+        result = self._strings.get(text)
+        if result is None:
+            data = text.encode('utf-8')
+            parts.append(STRING_RECORD.pack(REC_STRING, len(data)))
+            parts.append(data)
+            result = self._strings[text] = len(self._strings)
+        return result
+
+    def _encode_tc_finished(self, data, parts):
+        """:return: False if the event cannot be encoded as
+                    REC_TC_FINISHED record
+        """
+        if (data.get('type') != TC_FINISHED or
+                set(data) != TC_FINISHED_FIELDS):
+            return False
+        try:
+            timestamp = _timestamp_to_int(data['timestamp'])
+            name = data['name'].encode('utf-8')
+            ids = [self._intern(data[x], parts)
+                   for x in ('suite_hash', 'file', 'verdict')]
+            record = TC_FINISHED_RECORD.pack(
+                REC_TC_FINISHED, ids[0], ids[1], ids[2], data['duration'],
+                timestamp, len(name))
+        except (ValueError, TypeError, AttributeError, struct.error):
+            # strings defined so far remain valid
+            return False
+        parts.append(record)
+        parts.append(name)
+        return True
+
+    def encode(self, events):
+        """:param events: list of event data (dicts)
+           :return: frame (bytes)
+        """
+        parts = []
+        try:
+            for data in events:
+                if not self._encode_tc_finished(data, parts):
+                    text = json.dumps(data).encode('utf-8')
+                    parts.append(EVENT_RECORD.pack(REC_EVENT, len(text)))
+                    parts.append(text)
+        except Exception:
+            # strings defined in this frame will never reach the receiver
+            self.reset()
+            raise
+        body = b''.join(parts)
+        flags = 0
+        if self._reset_pending:
+            flags |= FLAG_RESET
+            self._reset_pending = False
+        if self._compress and len(body) >= COMPRESS_MIN_SIZE:
+            body = zlib.compress(body)
+            flags |= FLAG_ZLIB
+        return FRAME_HEADER.pack(MAGIC, VERSION, flags) + body
+
+
+class FormatError(Exception):
+
+    """A frame does not conform to the compact encoding"""
+
+
+class CompactDecoder(object):
+
+    """Decodes frames created by CompactEncoder (reference implementation
+       for receivers)
+    """
+
+    def __init__(self):
+        self._strings = []
+
+    def decode(self, frame):
+        """:return: list of event data (dicts)
+        """
+        try:
+            magic, version, flags = FRAME_HEADER.unpack_from(frame)
+        except struct.error:
+            raise FormatError('Frame too short')
+        if magic != MAGIC or version != VERSION:
+            raise FormatError('Unsupported frame format')
+        if flags & FLAG_RESET:
+            self._strings = []
+        body = frame[FRAME_HEADER.size:]
+        if flags & FLAG_ZLIB:
+            body = zlib.decompress(body)
+        try:
+            return list(self._records(body))
+        except (struct.error, IndexError) as e:
+            raise FormatError('Invalid record: {0}'.format(e))
+
+    def _records(self, body):
+        offset = 0
+        while offset < len(body):
+            rec_type = ord(body[offset:offset + 1])
+            if rec_type == REC_STRING:
+                _, length = STRING_RECORD.unpack_from(body, offset)
+                offset += STRING_RECORD.size
+                self._strings.append(
+                    body[offset:offset + length].decode('utf-8'))
+                offset += length
+            elif rec_type == REC_TC_FINISHED:
+                (_, suite_hash, file_, verdict, duration, timestamp,
+                 length) = TC_FINISHED_RECORD.unpack_from(body, offset)
+                offset += TC_FINISHED_RECORD.size
+                yield {'type': TC_FINISHED,
+                       'timestamp': _int_to_timestamp(timestamp),
+                       'suite_hash': self._strings[suite_hash],
+                       'file': self._strings[file_],
+                       'verdict': self._strings[verdict],
+                       'duration': duration,
+                       'name': body[offset:offset + length].decode('utf-8')}
+                offset += length
+            elif rec_type == REC_EVENT:
+                _, length = EVENT_RECORD.unpack_from(body, offset)
+                offset += EVENT_RECORD.size
+                yield json.loads(body[offset:offset + length].decode('utf-8'))
+                offset += length
+            else:
+                raise FormatError('Unknown record type {0}'.format(rec_type))
+
+
+def negotiate(websocket, compress=False, timeout=NEGOTIATION_TIMEOUT):
+    """Offers the compact encoding to the server. Servers which do not
+       answer within the timeout are assumed to support JSON only.
+
+       Offer:  {"type": "encoding_offer",
+                "encodings": ["purkinje-compact-1", "json"],
+                "compression": ["zlib"]}
+       Answer: {"type": "encoding_selected",
+                "encoding": "purkinje-compact-1", "compression": "zlib"}
+
+       :return: (encoding, compress)
+    """
+    websocket.send(json.dumps({
+        'type': 'encoding_offer',
+        'encodings': [COMPACT_ID, JSON],
+        'compression': ['zlib'] if compress else []}))
+    previous_timeout = websocket.gettimeout()
+    websocket.settimeout(timeout)
+    try:
+        answer = json.loads(websocket.recv())
+    except Exception as e:
+        logger.info('No encoding negotiated (%s); using JSON', e)
+        return JSON, False
+    finally:
+        websocket.settimeout(previous_timeout)
+    if (not isinstance(answer, dict) or
+            answer.get('type') != 'encoding_selected' or
+            answer.get('encoding') != COMPACT_ID):
+        return JSON, False
+    return COMPACT, compress and answer.get('compression') == 'zlib'
+
+
+def create_encoder(websocket, encoding=JSON, compress=False):
+    """Creates the encoder for a new connection, negotiating the encoding
+       with the server if necessary
+    """
+    if encoding == AUTO:
+        encoding, compress = negotiate(websocket, compress)
+    if encoding == COMPACT:
+        return CompactEncoder(compress)
+    return JsonEncoder()
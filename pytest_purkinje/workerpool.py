@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+"""Pool of pre-warmed processes executing py.test, to avoid paying for
+   interpreter startup and imports of third-party packages on every run
+"""
+
+from __future__ import print_function
+import importlib
+import logging
+import multiprocessing
+import os
+import os.path as op
+import sys
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 2
+
+# Always imported by warm workers
+DEFAULT_PRELOAD = ('pytest',)
+
+# Modules which must not be preloaded because importing them has
+# side effects
+PRELOAD_BLACKLIST = frozenset(['__main__', 'this', 'antigravity'])
+
+
+def _get_mp_context():
+    # Forking the multi-threaded runner process is unsafe; use fresh
+    # interpreters where possible (Python 3)
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('spawn')
+    return multiprocessing
+
+
+def _source_file(module, dir_):
+    path = getattr(module, '__file__', None)
+    if not path:
+        return None
+    path = op.abspath(path)
+    if path.endswith(('.pyc', '.pyo')):
+        path = path[:-1]
+    if not path.startswith(dir_ + op.sep):
+        return None
+    return path
+
+
+def project_files(dir_):
+    """:return: {path: mtime} of all loaded modules located in the project
+                directory
+    """
+    result = {}
+    for module in list(sys.modules.values()):
+        path = _source_file(module, dir_)
+        if path is not None:
+            try:
+                result[path] = op.getmtime(path)
+            except OSError:
+                result[path] = None
+    return result
+
+
+def external_modules(dir_):
+    """:return: names of loaded top-level modules which are not part of
+                the project
+    """
+    names = set(x.partition('.')[0] for x in list(sys.modules))
+    return sorted(x for x in names
+                  if not x.startswith('_') and
+                  x not in PRELOAD_BLACKLIST and
+                  x in sys.modules and
+                  _source_file(sys.modules[x], dir_) is None)
+
+
+def _worker_main(conn, dir_, preload):
+    """Entry point of worker processes
+    """
+    os.chdir(dir_)
+    if dir_ not in sys.path:
+        sys.path.insert(0, dir_)
+    for name in preload:
+        try:
+            importlib.import_module(name)
+        except Exception as e:  # ImportError, or anything raised by module
+            logger.debug('Cannot preload %s: %s', name, e)
+    import pytest
+
+    conn.send(('ready', project_files(dir_), []))
+    while True:
+        args = conn.recv()
+        if args is None:
+            break
+        try:
+            exit_code = int(pytest.main(list(args)))
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else 1
+        sys.stdout.flush()
+        conn.send((exit_code, project_files(dir_), external_modules(dir_)))
+    conn.close()
+
+
+class WorkerDied(Exception):
+
+    """A worker process terminated unexpectedly"""
+
+
+class WarmWorker(object):
+
+    """Worker process with preloaded modules, executing py.test in-process
+       on request
+    """
+
+    def __init__(self, dir_, preload=DEFAULT_PRELOAD):
+        ctx = _get_mp_context()
+        self._conn, child_conn = ctx.Pipe()
+        self._process = ctx.Process(target=_worker_main,
+                                    args=(child_conn, dir_, list(preload)))
+        self._process.daemon = True
+        self._process.start()
+        child_conn.close()
+        self._ready = False
+        # project files (path -> mtime) loaded by the worker
+        self.loaded_files = {}
+        self.external_modules = []
+
+    def _receive(self):
+        try:
+            result, self.loaded_files, external = self._conn.recv()
+        except (EOFError, IOError, OSError):
+            raise WorkerDied('Worker process {0} died'.format(
+                self._process.pid))
+        if external:
+            self.external_modules = external
+        return result
+
+    def wait_ready(self):
+        if not self._ready:
+            self._receive()
+            self._ready = True
+
+    def is_stale(self):
+        """:return: True if any project module loaded by the worker has
+                    been modified since it was loaded
+        """
+        for path, mtime in self.loaded_files.items():
+            try:
+                if op.getmtime(path) != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def run(self, args):
+        """Executes py.test in the worker process
+
+           :return: py.test exit code
+        """
+        self.wait_ready()
+        self._conn.send(list(args))
+        return self._receive()
+
+    def kill(self):
+        """Stops the worker process; may be called from another thread
+           while the worker is running tests
+        """
+        if self._process.is_alive():
+            self._process.terminate()
+
+    def terminate(self):
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process.join()
+        self._conn.close()
+
+
+class WorkerPool(object):
+
+    """Keeps a number of warm workers; each test run is dispatched to a
+       worker whose loaded project modules are still up to date.
+
+       Third-party modules loaded by a worker during a test run are
+       preloaded by the workers started subsequently.
+    """
+
+    def __init__(self, dir_, size=DEFAULT_POOL_SIZE,
+                 preload=DEFAULT_PRELOAD):
+        self._dir = op.abspath(dir_)
+        self._size = max(1, size)
+        self._preload = set(preload)
+        self._workers = []
+        self._busy = None
+        self._fill()
+
+    def _fill(self):
+        while len(self._workers) < self._size:
+            self._workers.append(WarmWorker(self._dir,
+                                            sorted(self._preload)))
+
+    def _acquire(self):
+        """:return: a worker which is up to date; stale workers are
+                    replaced
+        """
+        while True:
+            worker = self._workers.pop(0)
+            try:
+                worker.wait_ready()
+            except WorkerDied as e:
+                logger.warning('%s', e)
+                self._fill()
+                continue
+            if not worker.is_stale():
+                return worker
+            logger.info('Recycling worker with modified project modules')
+            worker.terminate()
+            self._fill()
+
+    def run(self, args):
+        """Executes py.test with the given command line arguments in a
+           warm worker
+
+           :return: py.test exit code
+        """
+        worker = self._busy = self._acquire()
+        try:
+            exit_code = worker.run(args)
+        except WorkerDied as e:
+            logger.warning('%s', e)
+            self._fill()
+            return 1
+        finally:
+            self._busy = None
+        self._preload.update(worker.external_modules)
+        # most recently used worker first: it has the project modules
+        # loaded already
+        self._workers.insert(0, worker)
+        return exit_code
+
+    def cancel(self):
+        """Aborts the test run in progress by killing its worker
+        """
+        worker = self._busy
+        if worker is not None:
+            worker.kill()
+
+    def close(self):
+        for worker in self._workers:
+            worker.terminate()
+        self._workers = []
@@ -49,7 +49,7 @@ setup(name='pytest-purkinje',
       dependency_links=parse_dependency_links(),
       entry_points={
           'pytest11': [
-              'purkinje = pytest_purkinje.testmonitorplugin',
+              'purkinje = pytest_purkinje.plugin',
           ],
           'console_scripts': [
               'purkinje_runner = pytest_purkinje.testrunner:main'
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""Tests for the cache of collected test cases
+"""
+from __future__ import absolute_import
+from builtins import str
+
+import os.path as op
+import pytest
+from mock import Mock
+from pytest_purkinje import collectcache as sut
+
+
+@pytest.fixture
+def project(tmpdir):
+    tmpdir.join('tests', 'a_test.py').write('def test_1(): pass\n',
+                                            ensure=True)
+    tmpdir.join('tests', 'b_test.py').write('', ensure=True)
+    tmpdir.join('tests', 'helper.py').write('', ensure=True)
+    tmpdir.join('.tox', 'c_test.py').write('', ensure=True)
+    return str(tmpdir)
+
+
+@pytest.fixture
+def cache(project):
+    return sut.CollectionCache(op.join(project, '.purkinje', sut.CACHE_FILE),
+                               project)
+
+
+def _reload(cache, project):
+    cache.save()
+    return sut.CollectionCache(op.join(project, '.purkinje', sut.CACHE_FILE),
+                               project)
+
+
+def test_record(cache, project, tmpdir):
+    cache.record('tests/a_test.py', ['tests/a_test.py::test_1'])
+    cache.record('tests/b_test.py', [])
+    cache = _reload(cache, project)
+    assert cache.nodeids('tests/a_test.py') == ['tests/a_test.py::test_1']
+    assert cache.nodeids('tests/b_test.py') == []
+    assert cache.nodeids('tests/helper.py') is None
+
+    tmpdir.join('tests', 'a_test.py').write('def test_2(): pass\n')
+    tmpdir.join('tests', 'conftest.py').write('')
+    cache = _reload(cache, project)
+    assert cache.nodeids('tests/a_test.py') is None
+    assert cache.nodeids('tests/b_test.py') is None
+
+    cache.record('tests/b_test.py', [])
+    cache.forget('tests/b_test.py')
+    assert cache.nodeids('tests/b_test.py') is None
+
+
+def test_invalid_file(project):
+    path = op.join(project, sut.CACHE_FILE)
+    with open(path, 'w') as f:
+        f.write('{"version": 0, "modules": {"x.py": null}}')
+    assert sut.CollectionCache(path, project).nodeids('x.py') is None
+
+
+def test_count(cache):
+    cache.record('tests/a_test.py', ['tests/a_test.py::test_1',
+                                     'tests/a_test.py::test_1x',
+                                     'tests/a_test.py::test_2[1]',
+                                     'tests/a_test.py::test_2[2]'])
+    cache.record('tests/b_test.py', [])
+    modules = ['tests/a_test.py', 'tests/b_test.py']
+    assert cache.count(modules) == 4
+    assert cache.count(modules, {'tests/a_test.py': [
+        'tests/a_test.py::test_1', 'tests/a_test.py::test_2']}) == 3
+    assert cache.count(modules + ['tests/helper.py']) is None
+
+
+def test_find_modules(project, monkeypatch):
+    monkeypatch.chdir(project)
+    patterns = ['*_test.py']
+    assert sut.find_modules(['.'], project, patterns, []) == (
+        set(['tests/a_test.py', 'tests/b_test.py']), {})
+    assert sut.find_modules([project], project, patterns, ['tests']) == (
+        set(), {})
+    assert sut.find_modules(
+        ['tests/a_test.py::test_1', 'tests/b_test.py'], project, patterns,
+        []) == (set(['tests/a_test.py', 'tests/b_test.py']),
+                {'tests/a_test.py': ['tests/a_test.py::test_1']})
+    assert sut.find_modules(
+        ['tests/a_test.py::test_1', 'tests'], project, patterns,
+        []) == (set(['tests/a_test.py', 'tests/b_test.py']), {})
+    assert sut.find_modules([], project, patterns, []) is None
+    assert sut.find_modules(['missing'], project, patterns, []) is None
+    assert sut.find_modules(['/'], project, patterns, []) is None
+
+
+def _config(project, args, **options):
+    result = Mock(args=args)
+    result.getoption.side_effect = lambda name, default: options.get(
+        name, default)
+    result.getini.side_effect = lambda name: {
+        'python_files': ['*_test.py'], 'norecursedirs': []}[name]
+    return result
+
+
+def test_plugin(cache, project, monkeypatch):
+    monkeypatch.chdir(project)
+    announce = Mock()
+    plugin = sut.CollectionCachePlugin(cache, project, announce)
+    session = Mock(config=_config(project, ['tests']))
+    plugin.pytest_collection(session)
+    assert not announce.called
+
+    # collection
+    for nodeid, passed in [('tests/a_test.py', True),
+                           ('tests/b_test.py', True)]:
+        wrapper = plugin.pytest_make_collect_report(
+            Mock(spec=pytest.Module, nodeid=nodeid))
+        next(wrapper)
+        with pytest.raises(StopIteration):
+            wrapper.send(Mock(**{'get_result.return_value.passed': passed}))
+    plugin.pytest_collection_modifyitems(
+        [Mock(nodeid='tests/a_test.py::test_1')])
+    plugin.pytest_sessionfinish()
+
+    cache = sut.CollectionCache(op.join(project, '.purkinje',
+                                        sut.CACHE_FILE), project)
+    plugin = sut.CollectionCachePlugin(cache, project, announce)
+    plugin.pytest_collection(session)
+    announce.assert_called_once_with(1)
+    assert plugin.pytest_ignore_collect(
+        op.join(project, 'tests', 'b_test.py'), None)
+    assert plugin.pytest_ignore_collect(
+        op.join(project, 'tests', 'a_test.py'), None) is None
+    assert plugin.pytest_ignore_collect(
+        op.join(project, 'tests'), None) is None
+
+    announce.reset_mock()
+    plugin.pytest_collection(Mock(config=_config(project, ['tests'],
+                                                 keyword='x')))
+    assert not announce.called
+
+
+def test_plugin_matches_hookspecs(cache, project):
+    from _pytest.config import get_config
+    # raises PluginValidationError for arguments unknown to this pytest
+    get_config().pluginmanager.register(
+        sut.CollectionCachePlugin(cache, project))
+
+
+def test_plugin_collection_error(cache, project):
+    cache.record('tests/a_test.py', ['tests/a_test.py::test_1'])
+    plugin = sut.CollectionCachePlugin(cache, project)
+    plugin.pytest_collection(Mock())  # nothing to announce to
+    wrapper = plugin.pytest_make_collect_report(
+        Mock(spec=pytest.Module, nodeid='tests/a_test.py'))
+    next(wrapper)
+    with pytest.raises(StopIteration):
+        wrapper.send(Mock(**{'get_result.return_value.passed': False}))
+    assert cache.nodeids('tests/a_test.py') is None
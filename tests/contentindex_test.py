@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Tests for the index of file contents
+"""
+from __future__ import absolute_import
+from builtins import str
+
+import os
+import threading
+import pytest
+from pytest_purkinje import contentindex as sut
+
+
+@pytest.fixture
+def index_path(tmpdir):
+    return str(tmpdir.join('cache', sut.CACHE_FILE))
+
+
+@pytest.fixture
+def module(tmpdir):
+    path = tmpdir.join('a.py')
+    path.write('x = 1\n')
+    return str(path)
+
+
+def _touch(path, offset=10):
+    st = os.stat(path)
+    os.utime(path, (st.st_atime, st.st_mtime + offset))
+
+
+def test_file_hash(module, tmpdir, monkeypatch):
+    monkeypatch.setattr(sut, 'BLOCK_SIZE', 2)
+    other = tmpdir.join('b.py')
+    other.write('x = 1\n')
+    assert sut.file_hash(module) == sut.file_hash(str(other))
+    other.write('x = 2\n')
+    assert sut.file_hash(module) != sut.file_hash(str(other))
+
+
+def test_changed(module, tmpdir):
+    index = sut.ContentIndex()
+    assert index.changed([module]) == [module]  # unknown file
+    assert index.changed([module]) == []
+
+    _touch(module)
+    assert index.changed([module]) == []
+    with open(module, 'w') as f:
+        f.write('x = 2\n')
+    _touch(module, 20)
+    assert index.changed([module]) == [module]
+
+    os.remove(module)
+    assert index.changed([module]) == [module]
+    assert index.changed([module]) == []
+    assert index.changed([str(tmpdir.join('missing.py'))]) == []
+
+
+def test_unchanged_stat_not_read(module, monkeypatch):
+    index = sut.ContentIndex()
+    index.scan([module])
+    monkeypatch.setattr(sut, 'file_hash', None)
+    assert index.changed([module]) == []
+
+
+def test_persistence(module, index_path):
+    index = sut.ContentIndex(index_path)
+    index.save()  # nothing to save
+    assert not os.path.exists(index_path)
+    index.scan([module])
+    index.save()
+
+    index = sut.ContentIndex(index_path)
+    _touch(module)
+    assert index.changed([module]) == []
+
+
+def test_concurrent_save(module, index_path, tmpdir, monkeypatch):
+    index = sut.ContentIndex(index_path)
+    index.scan([module])
+    other = tmpdir.join('b.py')
+    other.write('y = 2\n')
+    dump = sut.json.dump
+    saving = threading.Event()
+    release = threading.Event()
+
+    def slow_dump(data, f):
+        if not saving.is_set():  # the first save only
+            saving.set()
+            release.wait(5)
+        dump(data, f)
+
+    monkeypatch.setattr(sut.json, 'dump', slow_dump)
+    first = threading.Thread(target=index.save)
+    first.start()
+    saving.wait(5)
+    index.scan([str(other)])
+    second = threading.Thread(target=index.save)
+    second.start()
+    second.join(0.2)
+    release.set()
+    first.join(5)
+    second.join(5)
+    monkeypatch.undo()
+
+    # the newer snapshot is written last
+    index = sut.ContentIndex(index_path)
+    assert index.changed([module, str(other)]) == []
+    assert os.listdir(os.path.dirname(index_path)) == [sut.CACHE_FILE]
+
+
+@pytest.mark.parametrize('content', ['', '{"version": 0, "files": {}}'])
+def test_invalid_file(module, index_path, content):
+    os.makedirs(os.path.dirname(index_path))
+    with open(index_path, 'w') as f:
+        f.write(content)
+    assert sut.ContentIndex(index_path).changed([module]) == [module]
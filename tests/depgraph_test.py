@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for import dependency graph"""
+
+import os
+import os.path as op
+import pytest
+import pytest_purkinje.depgraph as sut
+
+
+def write(dir_, rel_path, content=''):
+    path = op.join(dir_, rel_path)
+    if not op.isdir(op.dirname(path)):
+        os.makedirs(op.dirname(path))
+    with open(path, 'w') as f:
+        f.write(content)
+    return path
+
+
+@pytest.fixture
+def proj(tmpdir):
+    """Project with a package, and tests depending on it"""
+    dir_ = str(tmpdir)
+    write(dir_, 'pkg/__init__.py')
+    write(dir_, 'pkg/util.py')
+    write(dir_, 'pkg/core.py', 'from . import util\n')
+    write(dir_, 'pkg/other.py')
+    write(dir_, 'tests/__init__.py')
+    write(dir_, 'tests/core_test.py', 'from pkg.core import x\n')
+    write(dir_, 'tests/other_test.py', 'import pkg.other\n')
+    write(dir_, 'tests/conftest.py')
+    write(dir_, '.tox/ignored_test.py', 'import pkg.util\n')
+    return dir_
+
+
+@pytest.fixture
+def graph(proj):
+    result = sut.ImportGraph(proj)
+    result.update()
+    return result
+
+
+@pytest.mark.parametrize('path,expected', [
+    ('a/test_x.py', True),
+    ('a/x_test.py', True),
+    ('a/x.py', False),
+    ('a/test_x.txt', False),
+])
+def test_is_test_file(path, expected):
+    assert sut.is_test_file(path) == expected
+
+
+def test_module_name(proj):
+    assert sut.module_name(proj, 'pkg/core.py') == 'pkg.core'
+    assert sut.module_name(proj, 'pkg/__init__.py') == 'pkg'
+    assert sut.module_name(proj, 'tests/core_test.py') == 'tests.core_test'
+    assert sut.module_name(proj, 'script.py') == 'script'
+
+
+def test_parse_imports():
+    source = ('import a.b\n'
+              'from c import d\n'
+              'from c.h import *\n'
+              'from . import e\n'
+              'from ..f import g\n')
+    assert sut.parse_imports(source, 'x.y.z', False) == set([
+        'a', 'a.b', 'c', 'c.d', 'c.h', 'x.y', 'x.y.e', 'x', 'x.f', 'x.f.g'])
+
+
+def test_parse_imports_package():
+    assert sut.parse_imports('from . import a', 'x', True) == set(
+        ['x.a'])
+
+
+def test_select_indirect(graph, proj):
+    selected = graph.select([op.join(proj, 'pkg/util.py')])
+    assert selected == ['tests/core_test.py']
+
+
+def test_select_test_file(graph, proj):
+    selected = graph.select([op.join(proj, 'tests/other_test.py')])
+    assert selected == ['tests/other_test.py']
+
+
+def test_select_package_init(graph, proj):
+    selected = graph.select([op.join(proj, 'pkg/__init__.py')])
+    assert selected == ['tests/core_test.py', 'tests/other_test.py']
+
+
+def test_select_unaffected(graph, proj):
+    assert graph.select([op.join(proj, 'setup_helper.py')]) == []
+
+
+def test_select_global_file(graph, proj):
+    assert graph.select([op.join(proj, 'tests/conftest.py')]) is None
+
+
+def test_select_new_import(graph, proj):
+    path = write(proj, 'pkg/other.py', 'import pkg.util\n')
+    os.utime(path, (0, 0))  # ensure mtime differs
+    assert graph.select([op.join(proj, 'pkg/util.py')]) == [
+        'tests/core_test.py']
+    assert graph.select([path]) == ['tests/other_test.py']
+    assert graph.select([op.join(proj, 'pkg/util.py')]) == [
+        'tests/core_test.py', 'tests/other_test.py']
+
+
+def test_select_deleted(graph, proj):
+    os.remove(op.join(proj, 'tests/other_test.py'))
+    os.remove(op.join(proj, 'pkg/other.py'))
+    assert graph.select([op.join(proj, 'pkg/other.py')]) == []
+
+
+def test_syntax_error(graph, proj):
+    path = write(proj, 'pkg/util.py', 'import (\n')
+    os.utime(path, (0, 0))
+    assert graph.select([path]) == ['tests/core_test.py']
+
+
+def test_cache(graph, proj, monkeypatch):
+    assert op.isfile(op.join(proj, '.purkinje', 'depgraph.json'))
+
+    def do_raise(*args):
+        raise AssertionError('Unchanged files should not be parsed')
+
+    monkeypatch.setattr(sut, 'parse_imports', do_raise)
+    reloaded = sut.ImportGraph(proj)
+    reloaded.update()
+    assert reloaded.select([op.join(proj, 'pkg/util.py')]) == [
+        'tests/core_test.py']
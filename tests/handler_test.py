@@ -2,20 +2,14 @@
 
 """Test for test runner handler"""
 
-from datetime import datetime
 import pytest
 from mock import Mock
+from watchdog.events import FileMovedEvent
 import pytest_purkinje.handler as sut
+from pytest_purkinje.quarantine import save_quarantine
 
-
-@pytest.fixture
-def mock_date(monkeypatch):
-    m = Mock()
-    m.now.return_value = datetime(2014, 2, 1, 8, 9, 10)
-    monkeypatch.setattr(sut,
-                        'datetime',
-                        m)
-    m.isoformat = datetime.isoformat
+# Short debounce period for tests
+DEBOUNCE = 0.05
 
 
 @pytest.fixture
@@ -33,56 +27,59 @@ def non_py_event():
 
 
 @pytest.fixture
-def unpatched_handler():
+def process_runner(monkeypatch):
+    result = Mock()
+    result.run.return_value = 0
+    monkeypatch.setattr(sut, 'ProcessRunner', Mock(return_value=result))
+    return result
+
+
+@pytest.fixture
+def unpatched_handler(process_runner):
     return sut.Handler()  # need unpatched run_tests
 
 
 @pytest.fixture
 def handler(monkeypatch):
-    result = sut.Handler()
+    result = sut.Handler(debounce=DEBOUNCE)
     monkeypatch.setattr(result,
                         '_trigger',
                         Mock(side_effect=result._trigger))
     monkeypatch.setattr(result,
                         'run_tests',
                         Mock())
-    return result
+    yield result
+    result.stop()
 
 
 def test_created_relevant_event(handler, py_event):
     handler.on_created(py_event)
     assert handler._trigger.called
+    assert handler.wait_idle(1)
     assert handler.run_tests.called
 
 
 def test_multi_trigger_avoidance(handler, py_event):
     handler._trigger(py_event)
-    handler._trigger(py_event)  # second call should get ignored
+    handler._trigger(py_event)  # second call should get coalesced
+    assert handler.wait_idle(1)
     assert len(handler.run_tests.call_args_list) == 1
 
 
-def test_multi_trigger_avoidance_reset(handler, py_event):
-    handler._trigger(py_event)
-    handler.clear_cache()  # forget about first call
-    handler._trigger(py_event)  # second call get through
-    assert len(handler.run_tests.call_args_list) == 2
+def test_changes_accumulated(handler):
+    handler._trigger(FileMovedEvent('/a/x.py', '/a/y.py'))
+    handler._trigger(Mock(src_path='/a/z.py'))
+    handler._trigger(Mock(src_path='/a/z.txt'))
+    assert handler.wait_idle(1)
+    handler.run_tests.assert_called_once_with(
+        ['/a/x.py', '/a/y.py', '/a/z.py'])
 
 
 def test_created_irrelevant_event(handler,
                                   non_py_event):
     handler.on_created(non_py_event)
     assert handler._trigger.called
-    assert not handler.run_tests.called
-
-
-def test_skip_when_in_retention_time(handler,
-                                     py_event,
-                                     monkeypatch):
-    monkeypatch.setattr(handler,
-                        '_in_retention_period',
-                        Mock(return_value=True))
-    handler.on_created(py_event)
-    assert handler._trigger.called
+    assert handler.wait_idle(1)
     assert not handler.run_tests.called
 
 
@@ -101,38 +98,132 @@ def test_moved(handler, py_event):
     assert handler._trigger.called
 
 
-def test_run_tests(unpatched_handler, monkeypatch):
-    assert not unpatched_handler._tests_running
-
-    def check_state(_):
-        assert unpatched_handler._tests_running
-
-    monkeypatch.setattr(sut.os, 'system', Mock(side_effect=check_state))
+def test_run_tests(unpatched_handler, process_runner):
     unpatched_handler.run_tests()
-    assert sut.os.system.called
-    assert not unpatched_handler._tests_running
+    assert process_runner.run.called
 
 
-def test_run_tests_with_error(unpatched_handler, monkeypatch):
-    assert not unpatched_handler._tests_running
-
+def test_run_tests_with_error(unpatched_handler, process_runner):
     def do_raise(_):
         raise Exception('Dummy exception')
 
-    sys_mock = Mock(side_effect=do_raise)
-    monkeypatch.setattr(sut.os, 'system', sys_mock)
+    process_runner.run.side_effect = do_raise
     with pytest.raises(Exception):
         unpatched_handler.run_tests()
-    assert not unpatched_handler._tests_running
-
-
-@pytest.mark.parametrize('last_finished,expected', [
-    (datetime(2014, 2, 1, 8, 9, 10), True),
-    (datetime(2015, 2, 1, 8, 9, 10), True),
-    (datetime(2014, 2, 1, 8, 9, 0), False),
-])
-def test_is_in_retention_period(last_finished, expected,
-                                handler, mock_date, monkeypatch):
-    timestamp = last_finished
-    monkeypatch.setattr(handler, '_last_finished', timestamp)
-    assert handler._in_retention_period() == expected
+
+
+def test_run_tests_selected(process_runner):
+    selector = Mock()
+    selector.select.return_value = ['a/b_test.py', 'c d_test.py']
+    handler = sut.Handler(selector)
+    handler.run_tests(['/x/y.py'])
+    selector.select.assert_called_once_with(['/x/y.py'])
+    process_runner.run.assert_called_once_with(
+        ['a/b_test.py', 'c d_test.py'])
+
+
+def test_format_command():
+    assert sut._format_command(['a/b_test.py', 'c d_test.py']) == \
+        "py.test a/b_test.py 'c d_test.py'"
+
+
+def test_run_tests_nothing_selected(process_runner):
+    selector = Mock()
+    selector.select.return_value = []
+    handler = sut.Handler(selector)
+    handler.run_tests(['/x/y.py'])
+    assert not process_runner.run.called
+
+
+def test_run_tests_pool(process_runner):
+    selector = Mock()
+    selector.select.return_value = ['a_test.py']
+    pool = Mock()
+    handler = sut.Handler(selector, ['-x'], pool)
+    handler.run_tests(['/x/y.py'])
+    pool.run.assert_called_once_with(['-x', 'a_test.py'])
+
+
+def test_cancel_run(process_runner):
+    handler = sut.Handler()
+    handler.cancel_run()
+    assert process_runner.cancel.called
+
+
+def test_watch_filter(tmpdir, process_runner):
+    from pytest_purkinje.watchfilter import WatchFilter
+    h = sut.Handler(watch_filter=WatchFilter(str(tmpdir), exclude=['build/']))
+    assert h._filter(str(tmpdir.join('a.py')))
+    assert not h._filter(str(tmpdir.join('build', 'a.py')))
+
+
+def test_add_paths(handler):
+    handler._scheduler = Mock()
+    handler.add_paths(['/a/b.txt'])
+    assert not handler._scheduler.add.called
+    handler.add_paths(['/a/b.txt', '/a/b.py'])
+    handler._scheduler.add.assert_called_once_with(['/a/b.py'])
+
+
+def test_run_tests_quarantine_lane(process_runner, tmpdir):
+    path = str(tmpdir.join('quarantine.json'))
+    handler = sut.Handler(pytest_args=['-x'], quarantine_lane=path)
+    handler.run_tests()
+    process_runner.run.assert_called_once_with(['-x'])
+
+    save_quarantine(path, {'a_test.py::test_1': 'flaky'})
+    process_runner.run.reset_mock()
+    handler.run_tests()
+    handler._lane_thread.join()
+    assert sorted(x[0][0] for x in process_runner.run.call_args_list) == [
+        ['-x', '--purkinje_quarantine_mode', 'exclude'],
+        ['-x', '--purkinje_quarantine_mode', 'only']]
+
+    # a lane run still in progress is cancelled by the next run
+    handler.run_tests()
+    assert process_runner.cancel.called
+    handler.stop()
+
+
+def test_shards(monkeypatch):
+    monkeypatch.setattr(sut, 'ShardedRunner', Mock())
+    handler = sut.Handler(shards=4)
+    assert handler._backend is sut.ShardedRunner.return_value
+    sut.ShardedRunner.assert_called_once_with(4)
+    assert sut.Handler(shards=4, pool=Mock())._backend is not \
+        sut.ShardedRunner.return_value
+
+
+def test_add_relevant_paths(handler):
+    handler.add_relevant_paths(['/a/b.py', '/a/c.py'])
+    assert handler.wait_idle(1)
+    handler.run_tests.assert_called_once_with(['/a/b.py', '/a/c.py'])
+
+
+def test_add_all(handler):
+    handler.add_relevant_paths(['/a/b.py'])
+    handler.add_all()
+    assert handler.wait_idle(1)
+    handler.run_tests.assert_called_once_with(None)
+
+
+def test_content_index(tmpdir, monkeypatch):
+    from pytest_purkinje.contentindex import ContentIndex
+    module = tmpdir.join('a.py')
+    module.write('x = 1\n')
+    index = ContentIndex(str(tmpdir.join('content.json')))
+    handler = sut.Handler(content_index=index, debounce=DEBOUNCE)
+    monkeypatch.setattr(handler, 'run_tests', Mock())
+    handler.index_files([str(module)])
+    handler.on_modified(Mock(src_path=str(module)))
+    handler.add_paths([str(module)])
+    handler.add_relevant_paths([str(module)])
+    assert handler.wait_idle(1)
+    assert not handler.run_tests.called
+
+    module.write('x = 2\n')
+    handler.on_modified(Mock(src_path=str(module)))
+    assert handler.wait_idle(1)
+    handler.run_tests.assert_called_once_with([str(module)])
+    handler.stop()
+    assert tmpdir.join('content.json').check()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Tests for test history
+"""
+from __future__ import absolute_import
+from builtins import str
+
+import pytest
+from mock import Mock
+from pytest_purkinje import history as sut
+
+
+@pytest.fixture
+def history(tmpdir):
+    return sut.TestHistory(str(tmpdir.join('.purkinje', 'history.json')))
+
+
+def _items(*nodeids):
+    return [Mock(nodeid=x) for x in nodeids]
+
+
+def _nodeids(items):
+    return [x.nodeid for x in items]
+
+
+def test_record(history):
+    assert history.duration('a_test.py::test_1') is None
+    assert not history.failed('a_test.py::test_1')
+    history.record('a_test.py::test_1', True, 12)
+    assert history.duration('a_test.py::test_1') == 12
+    assert history.failed('a_test.py::test_1')
+
+
+def test_record_failure(history):
+    history.record('a_test.py::test_1', False, 12)
+    history.record_failure('a_test.py::test_1')
+    assert history.failed('a_test.py::test_1')
+    assert history.duration('a_test.py::test_1') == 12
+
+    history.record_failure('a_test.py::test_2')
+    assert history.failed('a_test.py::test_2')
+    assert history.duration('a_test.py::test_2') is None
+
+
+def test_save_load(history, tmpdir):
+    history.record('a_test.py::test_1', True, 12)
+    history.save()
+    loaded = sut.TestHistory(history._path)
+    assert loaded.failed('a_test.py::test_1')
+    assert loaded.duration('a_test.py::test_1') == 12
+    assert [x.basename for x in tmpdir.join('.purkinje').listdir()] == [
+        'history.json']
+
+
+def test_save_merges_concurrent_sessions(history):
+    """e.g. shards writing the same history file"""
+    other = sut.TestHistory(history._path)
+    history.record('a_test.py::test_1', False, 10)
+    other.record('b_test.py::test_1', True, 20)
+    history.save()
+    other.save()
+    loaded = sut.TestHistory(history._path)
+    assert loaded.duration('a_test.py::test_1') == 10
+    assert loaded.failed('b_test.py::test_1')
+
+
+def test_load_invalid(tmpdir):
+    path = tmpdir.join('history.json')
+    path.write('{"version": 0, "tests": {"a": 1}}')
+    assert sut.TestHistory(str(path)).duration('a') is None
+    path.write('garbage')
+    assert sut.TestHistory(str(path)).duration('a') is None
+
+
+def test_order(history):
+    history.record('a_test.py::test_1', False, 300)
+    history.record('a_test.py::test_2', False, 300)
+    history.record('b_test.py::test_1', False, 100)
+    history.record('b_test.py::test_2', True, 50)
+    history.record('c_test.py::test_1', False, 200)
+    items = _items('a_test.py::test_1', 'a_test.py::test_2',
+                   'b_test.py::test_1', 'b_test.py::test_2',
+                   'c_test.py::test_1', 'd_test.py::test_new')
+    history.order(items)
+    assert _nodeids(items) == ['b_test.py::test_2',
+                               'd_test.py::test_new',
+                               'b_test.py::test_1',
+                               'c_test.py::test_1',
+                               'a_test.py::test_1',
+                               'a_test.py::test_2']
+
+
+def test_order_keeps_collection_order(history):
+    nodeids = ['a_test.py::test_2', 'a_test.py::test_1', 'b_test.py::test_1']
+    items = _items(*nodeids)
+    history.order(items)
+    assert _nodeids(items) == nodeids
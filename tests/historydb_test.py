@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Tests for the persistent test history database
+"""
+from __future__ import absolute_import
+from builtins import str
+
+import pytest
+from mock import Mock
+from pytest_purkinje import historydb as sut
+
+SUITE = 'abc'
+
+
+@pytest.fixture
+def db_path(tmpdir):
+    return str(tmpdir.join('.purkinje', 'history.db'))
+
+
+@pytest.fixture
+def db(db_path):
+    result = sut.HistoryDatabase(db_path)
+    yield result
+    result.close()
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert sut.percentile(values, 0.5) == 50
+    assert sut.percentile(values, 0.99) == 99
+    assert sut.percentile([7], 0.9) == 7
+
+
+def test_statistics(db):
+    suite = db.suite(SUITE)
+    assert suite.statistics('a_test.py::test_1') is None
+    for duration in [100, 200, 300, 400]:
+        suite.record('a_test.py::test_1', 'passed', duration)
+    stats = suite.statistics('a_test.py::test_1')
+    assert stats.count == 4
+    assert stats.mean == 250
+    assert round(stats.stddev, 3) == 111.803
+    assert stats.p50 == 200
+    assert stats.p90 == 400
+    assert suite.duration('a_test.py::test_1') == 0.2
+
+
+def test_statistics_rolling_window(db):
+    suite = db.suite(SUITE)
+    for _ in range(sut.WINDOW_SIZE):
+        suite.record('a_test.py::test_1', 'passed', 1000)
+    for _ in range(sut.WINDOW_SIZE // 2 + 1):
+        suite.record('a_test.py::test_1', 'passed', 5000)
+    assert suite.statistics('a_test.py::test_1').p50 == 5000
+
+
+def test_failed_durations_ignored(db):
+    suite = db.suite(SUITE)
+    suite.record('a_test.py::test_1', 'passed', 1000)
+    suite.record('a_test.py::test_1', 'failed', 10)
+    suite.record('a_test.py::test_1', 'skipped', 0)
+    assert suite.statistics('a_test.py::test_1').count == 1
+    assert not suite.failed('a_test.py::test_1')
+    suite.record('a_test.py::test_1', 'failed', 10)
+    assert suite.failed('a_test.py::test_1')
+
+
+def test_persistence(db_path):
+    db = sut.HistoryDatabase(db_path)
+    db.suite(SUITE).record('a_test.py::test_1', 'passed', 100)
+    db.suite('other').record('a_test.py::test_1', 'failed', 1)
+    db.close()
+
+    db = sut.HistoryDatabase(db_path)
+    db.suite(SUITE).record('a_test.py::test_1', 'passed', 300)
+    assert db.suite(SUITE).statistics('a_test.py::test_1').mean == 200
+    assert db.suite('other').failed('a_test.py::test_1')
+    assert [x[:2] for x in db.results(SUITE, 'a_test.py::test_1')] == [
+        ('passed', 100), ('passed', 300)]
+    db.close()
+
+
+def test_batched_writes(db_path):
+    db = sut.HistoryDatabase(db_path, batch_size=3)
+    db._db = Mock(wraps=db._db)
+    suite = db.suite(SUITE)
+    suite.record('a_test.py::test_1', 'passed', 1)
+    suite.record('a_test.py::test_2', 'passed', 1)
+    assert not db._db.executemany.called
+    suite.record('a_test.py::test_3', 'passed', 1)
+    assert db._db.executemany.call_count == 2
+    db.close()
+
+
+def test_order(db):
+    suite = db.suite(SUITE)
+    suite.record('a_test.py::test_1', 'passed', 5000)
+    suite.record('b_test.py::test_1', 'passed', 1000)
+    suite.record('c_test.py::test_1', 'failed', 1)
+    items = [Mock(nodeid=x) for x in ['a_test.py::test_1',
+                                      'b_test.py::test_1',
+                                      'c_test.py::test_1']]
+    suite.order(items)
+    assert [x.nodeid for x in items] == ['c_test.py::test_1',
+                                         'b_test.py::test_1',
+                                         'a_test.py::test_1']
+
+
+def test_outcomes_persisted(db_path):
+    db = sut.HistoryDatabase(db_path)
+    for outcome in ['passed', 'failed', 'skipped', 'passed']:
+        db.suite(SUITE).record('a_test.py::test_1', outcome, 1)
+    db.close()
+
+    db = sut.HistoryDatabase(db_path)
+    stats = dict(db.suite(SUITE).tests())['a_test.py::test_1']
+    assert stats.outcomes == 'pfsp'
+    assert stats.flips == 2
+    db.close()
+
+
+def test_outdated_statistics_discarded(db_path):
+    db = sut.HistoryDatabase(db_path)
+    db.suite(SUITE).record('a_test.py::test_1', 'passed', 1)
+    db._db.execute('PRAGMA user_version = 1')
+    db.close()
+
+    db = sut.HistoryDatabase(db_path)
+    assert not list(db.suite(SUITE).tests())
+    assert len(db.results(SUITE, 'a_test.py::test_1')) == 1
+    db.close()
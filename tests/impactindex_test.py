@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for coverage-based test impact index"""
+
+import os
+import os.path as op
+import sqlite3
+import pytest
+from mock import Mock
+import pytest_purkinje.impactindex as sut
+
+
+def sample_function():
+    x = 1
+    return x
+
+
+@pytest.fixture
+def index(tmpdir):
+    result = sut.CoverageIndex(str(tmpdir.join('cov.db')), str(tmpdir))
+    yield result
+    result.close()
+
+
+def test_call_tracer():
+    tracer = sut.CallTracer(op.dirname(__file__))
+    tracer.start()
+    sample_function()
+    assert op.basename(__file__) in tracer.stop()
+
+
+def test_call_tracer_ignores_other_dirs(tmpdir):
+    tracer = sut.CallTracer(str(tmpdir))
+    tracer.start()
+    sample_function()
+    assert tracer.stop() == set()
+
+
+def test_record(index):
+    index.record('a_test.py::test_1', set(['a.py']))
+    index.record('a_test.py::test_2', set(['a.py', 'b.py']))
+    assert index.tests_for('a.py') == set(['a_test.py::test_1',
+                                           'a_test.py::test_2'])
+    assert index.tests_for('b.py') == set(['a_test.py::test_2'])
+    assert index.tests_for('c.py') == set()
+
+
+def test_discard_line_ranges(tmpdir):
+    """Line ranges recorded by earlier versions are discarded"""
+    db_path = str(tmpdir.join('cov.db'))
+    db = sqlite3.connect(db_path)
+    db.execute('CREATE TABLE coverage (nodeid TEXT NOT NULL,'
+               ' file TEXT NOT NULL, first_line INTEGER NOT NULL,'
+               ' last_line INTEGER NOT NULL)')
+    db.execute("INSERT INTO coverage VALUES ('a_test.py::test_1', 'a.py',"
+               " 1, 5)")
+    db.commit()
+    db.close()
+    index = sut.CoverageIndex(db_path, str(tmpdir))
+    assert index.is_empty()
+    index.record('a_test.py::test_1', set(['a.py']))
+    assert index.tests_for('a.py') == set(['a_test.py::test_1'])
+    index.close()
+
+
+def test_record_replaces(index):
+    index.record('a_test.py::test_1', set(['a.py']))
+    index.record('a_test.py::test_1', set(['b.py']))
+    assert index.tests_for('a.py') == set()
+    assert index.tests_for('b.py') == set(['a_test.py::test_1'])
+
+
+def test_concurrent_writers(tmpdir, monkeypatch):
+    """Like pytest-xdist workers, each with its own connection: writers
+       do not keep the database locked between test cases
+    """
+    monkeypatch.setattr(sut, 'LOCK_TIMEOUT', 0.1)
+    db_path = str(tmpdir.join('cov.db'))
+    first, second = [sut.CoverageIndex(db_path, str(tmpdir))
+                     for _ in range(2)]
+    for i in range(3):
+        first.record('a_test.py::test_1_{0}'.format(i), set(['a.py']))
+        second.record('a_test.py::test_2_{0}'.format(i), set(['a.py']))
+    reader = sut.CoverageIndex(db_path, str(tmpdir))
+    assert len(reader.tests_for('a.py')) == 6
+    for index in (first, second, reader):
+        index.close()
+
+
+def test_prune(index):
+    index.record('a_test.py::test_1', set(['a.py']))
+    index.record('a_test.py::test_2[x]', set(['a.py']))
+    index.record('a_test.py::TestC::test_3', set(['a.py']))
+    index.record('a_test.py', set(['a.py']))
+    index.prune('a_test.py', ['a_test.py::test_2[x]', 'a_test.py::TestC'])
+    assert index.tests_for('a.py') == set(['a_test.py',
+                                           'a_test.py::test_2[x]',
+                                           'a_test.py::TestC::test_3'])
+
+
+def test_select_empty_index(index):
+    assert index.select(['a.py']) is None
+
+
+def test_select(index, tmpdir):
+    tmpdir.join('b_test.py').write('')
+    index.record('a_test.py::test_1', set(['a.py']))
+    index.record('b_test.py::test_2', set(['a.py']))
+    index.record('c_test.py::test_3', set(['c.py']))
+    changed = [str(tmpdir.join('a.py')), str(tmpdir.join('b_test.py'))]
+    assert index.select(changed) == ['a_test.py::test_1', 'b_test.py']
+    assert index.select([str(tmpdir.join('d.py'))]) == []
+    assert index.select([str(tmpdir.join('conftest.py'))]) is None
+
+
+def test_plugin(tmpdir, index):
+    tmpdir.join('covlib.py').write('def f():\n    return 1\n\n'
+                                   'def g():\n    return 2\n')
+    tmpdir.join('covlib_test.py').write('import covlib\n\n'
+                                        'def test_f():\n'
+                                        '    assert covlib.f() == 1\n\n'
+                                        'def test_g():\n'
+                                        '    assert covlib.g() == 2\n')
+    plugin = sut.CoveragePlugin(index, str(tmpdir))
+    orig_path = os.getcwd()
+    try:
+        os.chdir(str(tmpdir))
+        assert pytest.main(['-p', 'no:cacheprovider', '-p', 'no:purkinje',
+                            str(tmpdir)], plugins=[plugin]) == 0
+    finally:
+        os.chdir(orig_path)
+
+    reopened = sut.CoverageIndex(str(tmpdir.join('cov.db')), str(tmpdir))
+    assert reopened.tests_for('covlib.py') == set(
+        ['covlib_test.py', 'covlib_test.py::test_f',
+         'covlib_test.py::test_g'])
+    reopened.close()
+
+
+def test_plugin_index_locked(tmpdir):
+    tmpdir.join('locked_test.py').write('def test_f():\n    pass\n')
+    index = Mock()
+    index.record.side_effect = sqlite3.OperationalError('database is locked')
+    plugin = sut.CoveragePlugin(index, str(tmpdir))
+    assert pytest.main(['-p', 'no:cacheprovider', '-p', 'no:purkinje',
+                        str(tmpdir)], plugins=[plugin]) == 0
+    assert index.record.call_count == 2  # module and test case
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+""" Tests for the native inotify observer
+"""
+from __future__ import absolute_import
+
+import threading
+import pytest
+from mock import Mock
+from pytest_purkinje import inotify as sut
+from pytest_purkinje.watchfilter import WatchFilter
+
+# Time to wait for events (seconds)
+TIMEOUT = 5
+
+
+def _event(wd, mask, name=b''):
+    if name:
+        # names are padded with null bytes
+        name += b'\0' * (16 - len(name) % 16)
+    return sut.EVENT_HEADER.pack(wd, mask, 0, len(name)) + name
+
+
+def test_parse_events():
+    data = (_event(1, sut.IN_CLOSE_WRITE, b'a.py') +
+            _event(1, sut.IN_CLOSE_WRITE, b'a.pyc') +
+            _event(1, sut.IN_CREATE | sut.IN_ISDIR, b'sub') +
+            _event(-1, sut.IN_Q_OVERFLOW))
+    assert list(sut.parse_events(data)) == [
+        (1, sut.IN_CLOSE_WRITE, b'a.py'),
+        (1, sut.IN_CLOSE_WRITE, b'a.pyc'),
+        (1, sut.IN_CREATE | sut.IN_ISDIR, b'sub'),
+        (-1, sut.IN_Q_OVERFLOW, b'')]
+    assert [x[2] for x in sut.parse_events(
+        data, lambda x: x.endswith(b'.py'))] == [b'a.py', b'sub', b'']
+
+
+class RecordingHandler(object):
+
+    def __init__(self):
+        self.files = []
+        self.created = []
+        self.deleted = []
+        self.event = threading.Event()
+
+    def files_changed(self, paths):
+        self.files.extend(paths)
+        self.event.set()
+
+    def directory_created(self, path):
+        self.created.append(path)
+        self.event.set()
+
+    def directory_deleted(self, path):
+        self.deleted.append(path)
+        self.event.set()
+
+    def events_lost(self):
+        pass
+
+    def wait(self):
+        assert self.event.wait(TIMEOUT)
+        self.event.clear()
+
+
+@pytest.fixture
+def observer(tmpdir):
+    if not sut.is_available():
+        pytest.skip('inotify is not available')
+    handler = RecordingHandler()
+    result = sut.InotifyObserver(handler, WatchFilter(str(tmpdir)))
+    result.schedule(str(tmpdir))
+    result.start()
+    yield result, handler
+    result.stop()
+    result.join()
+    assert not result.is_alive()
+
+
+def test_observer_files(tmpdir, observer):
+    _, handler = observer
+    tmpdir.join('a.pyc').write('x')
+    tmpdir.join('a.swp').write('x')
+    tmpdir.join('a.py').write('x')
+    handler.wait()
+    # creation and writing may be reported in separate batches
+    assert set(handler.files) == set([str(tmpdir.join('a.py'))])
+
+
+def test_observer_directories(tmpdir, observer):
+    obs, handler = observer
+    sub = tmpdir.mkdir('sub')
+    handler.wait()
+    assert handler.created == [str(sub)]
+    wd = obs.schedule(str(sub))
+    sub.remove()
+    handler.wait()
+    assert handler.deleted == [str(sub)]
+    with pytest.raises(KeyError):
+        obs.unschedule(wd + 1000)
+
+
+def test_observer_unavailable(monkeypatch):
+    monkeypatch.setattr(sut, '_libc', None)
+    assert not sut.is_available()
+    with pytest.raises(OSError):
+        sut.InotifyObserver(Mock())
+
+
+def test_dispatch_overflow():
+    if not sut.is_available():
+        pytest.skip('inotify is not available')
+    handler = Mock()
+    observer = sut.InotifyObserver(handler)
+    observer._dispatch([(-1, sut.IN_Q_OVERFLOW, b'')])
+    assert handler.events_lost.called
+    assert not handler.files_changed.called
+    observer.join()
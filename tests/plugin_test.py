@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Tests for the entry point of the py.test plugin
+"""
+from __future__ import absolute_import
+
+import subprocess
+import sys
+import pytest
+from mock import Mock
+from pytest_purkinje import options
+from pytest_purkinje import plugin as sut
+
+# Modules which must not be imported by the plugin entry point
+HEAVY_MODULES = ('websocket', 'six', 'purkinje_messages', 'hashlib',
+                 'sqlite3', 'watchdog', 'pytest_purkinje.testmonitorplugin')
+
+
+def _config(**options):
+    result = Mock()
+    result.getoption.side_effect = lambda name: options.get(name, False)
+    return result
+
+
+def test_add_options():
+    parser = Mock()
+    sut.pytest_addoption(parser)
+    names = [x[0][0] for x in parser.addoption.call_args_list]
+    assert names[:3] == ['--purkinje', '--websocket_host', '--websocket_port']
+
+
+@pytest.mark.parametrize('purkinje, env, enabled', [
+    (False, None, False),
+    (True, None, True),
+    (False, '1', True),
+    (False, 'yes', True),
+    (False, '0', False),
+    (False, '', False),
+])
+def test_is_enabled(monkeypatch, purkinje, env, enabled):
+    if env is None:
+        monkeypatch.delenv(options.ENV_VAR, raising=False)
+    else:
+        monkeypatch.setenv(options.ENV_VAR, env)
+    assert options.is_enabled(_config(purkinje=purkinje)) == enabled
+
+
+def test_pytest_configure_disabled(monkeypatch):
+    monkeypatch.delenv(options.ENV_VAR, raising=False)
+    config = _config()
+    sut.pytest_configure(config)
+    assert not config.pluginmanager.register.called
+
+
+def test_pytest_configure_enabled(monkeypatch):
+    from pytest_purkinje import testmonitorplugin
+    monkeypatch.setattr(testmonitorplugin, 'pytest_configure', Mock())
+    config = _config(purkinje=True)
+    sut.pytest_configure(config)
+    testmonitorplugin.pytest_configure.assert_called_once_with(config)
+
+
+def test_import_cost():
+    """Importing the entry point must not import the monitoring plugin
+       and its dependencies
+    """
+    output = subprocess.check_output(
+        [sys.executable, '-c',
+         'import sys, pytest_purkinje.plugin;'
+         'print(",".join(sorted(sys.modules)))']).decode('utf-8')
+    modules = output.strip().split(',')
+    assert [x for x in HEAVY_MODULES if x in modules] == []
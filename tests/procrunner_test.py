@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for py.test child process execution"""
+
+import io
+import sys
+import threading
+import time
+import pytest
+from mock import Mock
+import pytest_purkinje.procrunner as sut
+
+
+@pytest.fixture
+def output():
+    return io.BytesIO()
+
+
+@pytest.fixture
+def python_command(monkeypatch):
+    """Runs Python code instead of py.test"""
+    monkeypatch.setattr(sut, 'PYTEST_COMMAND', [sys.executable, '-c'])
+
+
+def test_run(output, python_command):
+    runner = sut.ProcessRunner(output)
+    code = 'import sys; print("line 1"); print("line 2"); sys.exit(3)'
+    assert runner.run([code]) == 3
+    assert output.getvalue().splitlines() == [b'line 1', b'line 2']
+    assert not runner.is_running
+
+
+def test_cancel_without_run(output, python_command):
+    runner = sut.ProcessRunner(output)
+    runner.cancel()
+    # no effect on later runs
+    assert runner.run(['pass']) == 0
+
+
+def test_cancel_before_start(output, monkeypatch):
+    runner = sut.ProcessRunner(output)
+    begin = runner._begin
+
+    def begin_and_cancel():
+        begin()
+        runner.cancel()
+
+    monkeypatch.setattr(runner, '_begin', begin_and_cancel)
+    monkeypatch.setattr(runner, '_popen', Mock())
+    assert runner.run([]) == -15  # SIGTERM
+    assert not runner._popen.called
+    assert not runner.is_running
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='POSIX only')
+def test_cancel(output, python_command):
+    runner = sut.ProcessRunner(output, kill_timeout=1)
+    result = []
+    thread = threading.Thread(
+        target=lambda: result.append(runner.run(
+            ['import time; print("started", flush=True); time.sleep(30)'])))
+    thread.start()
+    deadline = time.time() + 10
+    while not output.getvalue() and time.time() < deadline:
+        time.sleep(0.01)
+    runner.cancel()
+    thread.join(10)
+    assert result == [-15]  # SIGTERM
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='POSIX only')
+def test_kill_after_timeout(output, python_command):
+    runner = sut.ProcessRunner(output, kill_timeout=0.1)
+    code = ('import signal, time\n'
+            'signal.signal(signal.SIGTERM, signal.SIG_IGN)\n'
+            'print("started", flush=True)\n'
+            'time.sleep(30)\n')
+    result = []
+    thread = threading.Thread(
+        target=lambda: result.append(runner.run([code])))
+    thread.start()
+    deadline = time.time() + 10
+    while not output.getvalue() and time.time() < deadline:
+        time.sleep(0.01)
+    runner.cancel()
+    thread.join(10)
+    assert result == [-9]  # SIGKILL
+
+
+@pytest.mark.parametrize('exit_codes, expected', [
+    ([0, 0], 0),
+    ([0, 5], 0),
+    ([5, 5], 5),
+    ([0, 1, 2], 1),
+    ([5, -15], -15),
+])
+def test_combine_exit_codes(exit_codes, expected):
+    assert sut.combine_exit_codes(exit_codes) == expected
+
+
+def test_sharded_run(output, python_command):
+    runner = sut.ShardedRunner(3, output)
+    code = ('import os, sys; shard = sys.argv[2]; '
+            'assert os.path.isdir(sys.argv[4]); print(shard); '
+            'sys.exit(1 if shard == "2/3" else 0)')
+    assert runner.run([code]) == 1
+    assert sorted(output.getvalue().splitlines()) == [b'1/3', b'2/3',
+                                                      b'3/3']
+    assert not runner.is_running
+
+
+def test_sharded_run_error(output, monkeypatch):
+    monkeypatch.setattr(sut, 'PYTEST_COMMAND', ['/nonexistent/python'])
+    with pytest.raises(OSError):
+        sut.ShardedRunner(2, output).run([])
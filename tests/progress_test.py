@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for reporting the progress of test sessions"""
+
+import threading
+from mock import Mock
+import pytest_purkinje.progress as sut
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def _tracker(history=None):
+    clock = Clock()
+    tracker = sut.ProgressTracker(history, clock=clock)
+    tracker.set_tests(['a::1', 'a::2', 'b::1', 'b::2'])
+    return tracker, clock
+
+
+def test_initial_snapshot():
+    tracker, _ = _tracker()
+    assert tracker.snapshot() == {
+        'completed': 0,
+        'total': 4,
+        'tests_per_second': 0.0,
+        'eta': -1,
+        'slowest_running': '',
+        'slowest_running_duration': 0.0,
+    }
+
+
+def test_eta_from_history():
+    history = Mock()
+    history.duration.return_value = 2000
+    tracker, _ = _tracker(history)
+    assert tracker.snapshot()['eta'] == 8
+
+
+def test_durations_looked_up_once():
+    history = Mock()
+    history.duration.return_value = 2000
+    tracker, clock = _tracker(history)
+    tracker.snapshot()
+    clock.now += 1
+    tracker.finished('a::1', 2.0)
+    assert tracker.snapshot()['eta'] == 3  # 3 tests of 2 s, run 2x faster
+    assert history.duration.call_count == 4
+
+
+def test_eta_from_completed_tests():
+    tracker, clock = _tracker()
+    tracker.started('a::1')
+    clock.now += 2
+    tracker.finished('a::1', 1.0)
+    snapshot = tracker.snapshot()
+    assert snapshot['completed'] == 1
+    assert snapshot['tests_per_second'] == 0.5
+    # 3 remaining tests of 1 s each; elapsed time is twice the duration
+    # of the tests so far (e.g. due to overhead)
+    assert snapshot['eta'] == 6
+
+
+def test_eta_unknown_tests_use_average():
+    history = Mock()
+    history.duration.side_effect = lambda x: 4000 if x == 'b::2' else None
+    tracker, clock = _tracker(history)
+    clock.now += 1
+    tracker.finished('a::1', 1.0)
+    assert tracker.snapshot()['eta'] == 6
+
+
+def test_slowest_running():
+    tracker, clock = _tracker()
+    tracker.started('a::1')
+    clock.now += 3
+    tracker.started('b::1')
+    clock.now += 1
+    snapshot = tracker.snapshot()
+    assert snapshot['slowest_running'] == 'a::1'
+    assert snapshot['slowest_running_duration'] == 4.0
+    tracker.finished('a::1', 4.0)
+    assert tracker.snapshot()['slowest_running'] == 'b::1'
+
+
+def test_total_without_collection():
+    tracker = sut.ProgressTracker()
+    tracker.finished('a::1', 0.1)
+    snapshot = tracker.snapshot()
+    assert snapshot['completed'] == snapshot['total'] == 1
+
+
+def test_reporter():
+    reported = threading.Event()
+    report = Mock(side_effect=lambda x: reported.set())
+    reporter = sut.ProgressReporter(sut.ProgressTracker(), report,
+                                    interval=0.01)
+    reporter.start()
+    assert reported.wait(5)
+    reporter.stop()
+    count = report.call_count
+    # final state is reported when stopping
+    assert report.call_args[0][0]['completed'] == 0
+    reporter.stop()
+    assert report.call_count == count
+
+
+def test_reporter_survives_errors():
+    report = Mock(side_effect=ValueError('dummy'))
+    reporter = sut.ProgressReporter(sut.ProgressTracker(), report,
+                                    interval=0.01)
+    reporter.start()
+    reporter.stop()
+    assert report.called
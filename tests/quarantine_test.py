@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Tests for quarantine of flaky and slow tests
+"""
+from __future__ import absolute_import
+from builtins import str
+
+import pytest
+from mock import Mock
+from pytest_purkinje import quarantine as sut
+from pytest_purkinje import historydb
+
+
+def _stats(outcomes, durations=()):
+    result = historydb.TestStatistics()
+    for outcome in outcomes:
+        result.add(outcome, 0)
+    result.durations.extend(durations)
+    return result
+
+
+@pytest.mark.parametrize('stats, expected', [
+    (_stats(['passed'] * 10, [1000] * 10), None),
+    (_stats(['passed', 'failed', 'passed', 'failed']), sut.FLAKY),
+    (_stats(['passed', 'failed', 'skipped', 'failed', 'passed']), None),
+    (_stats(['failed'] * 5), None),
+    (_stats([], [6000000]), sut.SLOW),
+    (_stats([], [10, 10, 10, 10, 1000]), sut.UNSTABLE),
+    (_stats([], [10, 1000]), None),  # not enough samples
+])
+def test_reason(stats, expected):
+    assert sut.QuarantinePolicy().reason(stats) == expected
+
+
+def test_select(tmpdir):
+    db = historydb.HistoryDatabase(str(tmpdir.join('history.db')))
+    suite = db.suite('abc')
+    for outcome in ['passed', 'failed', 'passed', 'failed']:
+        suite.record('a_test.py::test_flaky', outcome, 1000)
+        suite.record('a_test.py::test_ok', 'passed', 1000)
+    assert sut.QuarantinePolicy().select(suite) == {
+        'a_test.py::test_flaky': sut.FLAKY}
+    db.close()
+
+
+def test_save_load(tmpdir):
+    path = str(tmpdir.join('.purkinje', 'quarantine.json'))
+    assert sut.load_quarantine(path) == {}
+    sut.save_quarantine(path, {'a_test.py::test_1': sut.SLOW})
+    assert sut.load_quarantine(path) == {'a_test.py::test_1': sut.SLOW}
+    assert tmpdir.join('.purkinje').listdir() == [tmpdir.join(
+        '.purkinje', 'quarantine.json')]
+
+
+def test_load_other_version(tmpdir):
+    path = tmpdir.join('quarantine.json')
+    path.write('{"version": 0, "tests": {"a_test.py::test_1": "slow"}}')
+    assert sut.load_quarantine(str(path)) == {}
+
+
+@pytest.mark.parametrize('mode, expected, removed', [
+    (sut.INCLUDE, ['a::1', 'a::2', 'b::1'], []),
+    (sut.LAST, ['a::2', 'b::1', 'a::1'], []),
+    (sut.EXCLUDE, ['a::2', 'b::1'], ['a::1']),
+    (sut.ONLY, ['a::1'], ['a::2', 'b::1']),
+])
+def test_apply_quarantine(mode, expected, removed):
+    items = [Mock(nodeid=x) for x in ['a::1', 'a::2', 'b::1']]
+    result = sut.apply_quarantine(items, {'a::1': sut.FLAKY}, mode)
+    assert [x.nodeid for x in items] == expected
+    assert [x.nodeid for x in result] == removed
+
+
+def test_apply_empty_quarantine_only():
+    items = [Mock(nodeid='a::1')]
+    assert len(sut.apply_quarantine(items, {}, sut.ONLY)) == 1
+    assert items == []
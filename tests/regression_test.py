@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for detection of performance regressions"""
+
+import json
+import pytest
+from mock import Mock
+from pytest_purkinje import events
+from pytest_purkinje.historydb import DurationStatistics
+import pytest_purkinje.regression as sut
+
+STATS = DurationStatistics(count=10, mean=1000000, stddev=50000,
+                           p50=1000000, p90=1100000, p99=1200000)
+
+
+@pytest.mark.parametrize('duration_us, expected', [
+    (1100000, False),  # within 3 sigma
+    (1200000, True),
+    (900000, False),
+])
+def test_check(duration_us, expected):
+    detector = sut.RegressionDetector()
+    result = detector.check('a_test.py::test_1', duration_us, STATS)
+    assert (result is not None) == expected
+    assert len(detector.regressions) == int(expected)
+    if expected:
+        assert result.baseline_us == 1000000
+        assert result.stddev_us == 50000
+        assert result.sigma == 4.0
+
+
+def test_check_min_delta():
+    stats = STATS._replace(stddev=1, p50=1000)
+    detector = sut.RegressionDetector(min_delta=100)
+    assert detector.check('a_test.py::test_1', 50000, stats) is None
+    result = detector.check('a_test.py::test_1', 101000, stats)
+    assert result.sigma == 100000
+
+
+def test_check_constant_duration():
+    stats = STATS._replace(stddev=0)
+    detector = sut.RegressionDetector()
+    result = detector.check('a_test.py::test_1', 1200000, stats)
+    assert result.sigma is None
+    event = events.TestCaseRegressionEvent(
+        name='test_1', file='a_test.py', duration_us=result.duration_us,
+        baseline_us=result.baseline_us, stddev_us=result.stddev_us,
+        suite_hash='abc')
+    event.validate()
+    assert 'sigma' not in json.loads(event.serialize())
+
+
+@pytest.mark.parametrize('stats', [None, STATS._replace(count=4)])
+def test_check_insufficient_history(stats):
+    detector = sut.RegressionDetector()
+    assert detector.check('a_test.py::test_1', 5000000, stats) is None
+
+
+@pytest.mark.parametrize('fail, regressions, exitstatus, expected', [
+    (True, ['x'], 0, 1),
+    (True, [], 0, 0),
+    (False, ['x'], 0, 0),
+    (True, ['x'], 2, 2),
+])
+def test_plugin_exitstatus(fail, regressions, exitstatus, expected):
+    detector = sut.RegressionDetector()
+    detector.regressions = regressions
+    session = Mock(exitstatus=exitstatus)
+    sut.RegressionPlugin(detector, fail).pytest_sessionfinish(session,
+                                                              exitstatus)
+    assert session.exitstatus == expected
+
+
+def test_terminal_summary():
+    detector = sut.RegressionDetector()
+    plugin = sut.RegressionPlugin(detector)
+    reporter = Mock()
+    plugin.pytest_terminal_summary(reporter)
+    assert not reporter.write_line.called
+    detector.check('a_test.py::test_1', 1200000, STATS)
+    plugin.pytest_terminal_summary(reporter)
+    assert reporter.write_line.call_args[0][0] == (
+        'a_test.py::test_1: 1200.0 ms (median 1000.0 ms, 4.0 sigma)')
+    detector.check('a_test.py::test_2', 1200000, STATS._replace(stddev=0))
+    plugin.pytest_terminal_summary(reporter)
+    assert reporter.write_line.call_args[0][0] == (
+        'a_test.py::test_2: 1200.0 ms (median 1000.0 ms, constant before)')
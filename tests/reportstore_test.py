@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for retention of test reports"""
+
+import io
+import pytest
+from _pytest.reports import TestReport as Report
+import pytest_purkinje.reportstore as sut
+
+
+def make_report(nodeid='a_test.py::test_1', sections=(), longrepr=None):
+    return Report(nodeid, ('a_test.py', 1, 'test_1'), {},
+                  'failed' if longrepr else 'passed', longrepr,
+                  'call', list(sections), duration=0.5)
+
+
+def test_summary():
+    summary = sut.ReportSummary(make_report())
+    assert summary.nodeid == 'a_test.py::test_1'
+    assert summary.when == 'call'
+    assert summary.duration == 0.5
+    assert summary.passed and not summary.failed and not summary.skipped
+    with pytest.raises(AttributeError):
+        summary.sections = []
+
+
+def test_small_sections_unchanged():
+    report = make_report(sections=[('Captured stdout call', 'abc')])
+    assert sut.SectionLimiter(10).apply(report) is report
+
+
+def test_truncate():
+    report = make_report(sections=[('Captured stdout call', 'x' * 100),
+                                   ('Captured stderr call', 'abc')])
+    result = sut.SectionLimiter(10).apply(report)
+    assert result is not report
+    assert result.sections[0][1].startswith('x' * 10 + '\n...')
+    assert 'truncated 90 characters' in result.sections[0][1]
+    assert result.sections[1] == ('Captured stderr call', 'abc')
+    # py.test still reports the complete output
+    assert report.sections[0][1] == 'x' * 100
+
+
+def test_spill(tmpdir):
+    content = u'ü' * 100
+    report = make_report(sections=[('Captured stdout call', content)])
+    result = sut.SectionLimiter(10, str(tmpdir.join('spill'))).apply(report)
+    spilled = tmpdir.join('spill').listdir()
+    assert len(spilled) == 1
+    assert str(spilled[0]) in result.sections[0][1]
+    with io.open(str(spilled[0]), encoding='utf-8') as f:
+        assert f.read() == content
+
+
+def test_truncate_longrepr(tmpdir):
+    report = make_report(longrepr='E' * 100)
+    result = sut.SectionLimiter(10, str(tmpdir)).apply(report)
+    assert result.longrepr.startswith('E' * 10 + '\n...')
+    assert report.longrepr == 'E' * 100
+    [spilled] = tmpdir.listdir()
+    assert spilled.basename.endswith('-call-longrepr.txt')
+
+
+def test_truncate_longrepr_object():
+    def test_fail():
+        assert 'x' * 200 == 'y'
+    try:
+        test_fail()
+    except AssertionError:
+        excinfo = pytest.ExceptionInfo.from_current()
+    report = make_report(longrepr=excinfo.getrepr())
+    result = sut.SectionLimiter(50).apply(report)
+    assert len(result.longrepr) < 100
+    assert 'truncated' in result.longrepr
+
+
+def test_skipped_longrepr_unchanged():
+    report = make_report()
+    report.longrepr = ('a_test.py', 1, 'Skipped: ' + 'x' * 100)
+    assert sut.SectionLimiter(10).apply(report) is report
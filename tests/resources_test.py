@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for measurement of resources used by test cases"""
+
+import gc
+import pytest
+from mock import Mock
+import pytest_purkinje.resources as sut
+
+
+def test_sampler():
+    sampler = sut.ResourceSampler()
+    sample = sampler.start()
+    data = [list(range(1000)) for _ in range(1000)]
+    gc.collect()
+    result = sampler.stop(sample)
+    del data
+    assert sorted(result) == ['cpu_us', 'gc_collections',
+                              'max_rss_delta_kb']
+    assert result['cpu_us'] > 0
+    assert result['gc_collections'] >= 1
+    assert result['max_rss_delta_kb'] >= 0
+
+
+@pytest.mark.skipif(sut.tracemalloc is None,
+                    reason='tracemalloc not available')
+def test_sampler_trace_allocations():
+    sampler = sut.ResourceSampler(trace_allocations=True)
+    try:
+        sample = sampler.start()
+        data = b'x' * (1024 * 1024)
+        result = sampler.stop(sample)
+        del data
+    finally:
+        sampler.close()
+    assert result['alloc_peak_kb'] >= 1024
+    assert not sut.tracemalloc.is_tracing()
+
+
+def test_plugin_attaches_resources():
+    sampler = Mock()
+    sampler.stop.return_value = {'cpu_us': 1}
+    plugin = sut.ResourcePlugin(sampler)
+    item = Mock(nodeid='a_test.py::test_1')
+    plugin.pytest_runtest_logstart(item.nodeid, ('a_test.py', 1, 'test_1'))
+
+    reports = {}
+    for when in ('setup', 'call', 'teardown'):
+        hook = plugin.pytest_runtest_makereport(item, Mock(when=when))
+        next(hook)
+        reports[when] = Mock(spec=[])
+        with pytest.raises(StopIteration):
+            hook.send(Mock(get_result=Mock(return_value=reports[when])))
+
+    assert not hasattr(reports['call'], sut.REPORT_ATTRIBUTE)
+    assert getattr(reports['teardown'], sut.REPORT_ATTRIBUTE) == \
+        {'cpu_us': 1}
+    assert plugin.count == 1
+    assert plugin.overhead > 0
+    assert not plugin._samples
+
+
+def test_terminal_summary():
+    plugin = sut.ResourcePlugin(Mock())
+    reporter = Mock()
+    plugin.pytest_terminal_summary(reporter)
+    assert not reporter.write_line.called
+    plugin.count = 2
+    plugin.overhead = 0.001
+    plugin.pytest_terminal_summary(reporter)
+    assert 'resource measurement' in reporter.write_line.call_args[0][0]
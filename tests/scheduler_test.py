@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for test run scheduler"""
+
+import threading
+import time
+import pytest
+from mock import Mock
+import pytest_purkinje.scheduler as sut
+
+DEBOUNCE = 0.05
+
+
+@pytest.fixture
+def run():
+    return Mock()
+
+
+@pytest.fixture
+def scheduler(run):
+    result = sut.RunScheduler(run, DEBOUNCE)
+    yield result
+    result.stop()
+
+
+def test_single_change(scheduler, run):
+    scheduler.add(['a.py'])
+    assert scheduler.wait_idle(1)
+    run.assert_called_once_with(['a.py'])
+
+
+def test_burst_is_coalesced(scheduler, run):
+    for i in range(20):
+        scheduler.add(['{0}.py'.format(i % 5)])
+    assert scheduler.wait_idle(1)
+    run.assert_called_once_with(['0.py', '1.py', '2.py', '3.py', '4.py'])
+
+
+def test_trailing_edge(scheduler, run):
+    scheduler.add(['a.py'])
+    time.sleep(DEBOUNCE / 2)
+    scheduler.add(['b.py'])
+    time.sleep(DEBOUNCE / 2)
+    assert not run.called  # debounce period restarted by second change
+    assert scheduler.wait_idle(1)
+    run.assert_called_once_with(['a.py', 'b.py'])
+
+
+@pytest.fixture
+def blocking_run():
+    """Run function which blocks until released"""
+    started = threading.Event()
+    release = threading.Event()
+
+    def run(paths):
+        started.set()
+        release.wait()
+
+    result = Mock(side_effect=run)
+    result.started = started
+    result.release = release
+    return result
+
+
+def test_changes_during_run_are_not_lost(blocking_run):
+    scheduler = sut.RunScheduler(blocking_run, DEBOUNCE)
+    scheduler.add(['a.py'])
+    assert blocking_run.started.wait(1)
+    scheduler.add(['b.py'])
+    assert scheduler.is_running
+    assert scheduler.has_pending_changes
+    blocking_run.release.set()
+    assert scheduler.wait_idle(1)
+    assert [x[0][0] for x in blocking_run.call_args_list] == [
+        ['a.py'], ['b.py']]
+    scheduler.stop()
+
+
+def test_cancel_in_flight(blocking_run):
+    cancel = Mock(side_effect=lambda: blocking_run.release.set())
+    scheduler = sut.RunScheduler(blocking_run, DEBOUNCE, cancel)
+    scheduler.add(['a.py'])
+    assert blocking_run.started.wait(1)
+    scheduler.add(['b.py'])
+    assert scheduler.wait_idle(1)
+    assert cancel.call_count == 1
+    # cancelled run is repeated together with the new changes
+    assert [x[0][0] for x in blocking_run.call_args_list] == [
+        ['a.py'], ['a.py', 'b.py']]
+    scheduler.stop()
+
+
+def test_run_error_does_not_stop_scheduler(scheduler, run):
+    run.side_effect = [Exception('Dummy exception'), None]
+    scheduler.add(['a.py'])
+    assert scheduler.wait_idle(1)
+    scheduler.add(['b.py'])
+    assert scheduler.wait_idle(1)
+    assert run.call_count == 2
+
+
+def test_wait_idle_timeout(blocking_run):
+    scheduler = sut.RunScheduler(blocking_run, DEBOUNCE)
+    scheduler.add(['a.py'])
+    assert not scheduler.wait_idle(DEBOUNCE)
+    blocking_run.release.set()
+    assert scheduler.wait_idle(1)
+    scheduler.stop()
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for background event sender"""
+
+import json
+import threading
+import time
+import pytest
+from mock import Mock
+from pytest_purkinje.defs import DROP_OLDEST, SPILL
+import pytest_purkinje.sender as sut
+from pytest_purkinje.spool import Spool
+
+
+def make_event(text):
+    """:param text: JSON representation of the event"""
+    return Mock(data=json.loads(text))
+
+
+@pytest.fixture
+def websocket():
+    return Mock()
+
+
+def sent_frames(websocket):
+    return [x[0][0] for x in websocket.send.call_args_list]
+
+
+def test_invalid_policy(websocket):
+    with pytest.raises(ValueError):
+        sut.EventSender(websocket, backpressure='xyz')
+
+
+def test_send_single(websocket):
+    sender = sut.EventSender(websocket)
+    sender.send(make_event(u'{}'))
+    sender.close()
+    assert sent_frames(websocket) == [u'{}']
+
+
+def test_send_batches(websocket):
+    sender = sut.EventSender(websocket, batch_size=2, flush_interval=10)
+    for i in range(5):
+        sender.send(make_event(u'{0}'.format(i)))
+    sender.close()
+    assert sent_frames(websocket) == [u'[0,1]', u'[2,3]', u'4']
+
+
+def test_flush_interval(websocket):
+    sender = sut.EventSender(websocket, batch_size=100, flush_interval=0)
+    sender.send(make_event(u'1'))
+    sender.flush()
+    assert sent_frames(websocket) == [u'1']
+    sender.close()
+
+
+def test_serialization_error_does_not_stop_sender(websocket):
+    bad_event = Mock(validate=Mock(side_effect=Exception('Dummy')))
+    sender = sut.EventSender(websocket)
+    sender.send(bad_event)
+    sender.send(make_event(u'2'))
+    sender.close()
+    assert sent_frames(websocket) == [u'2']
+
+
+def test_send_error_does_not_stop_sender(websocket):
+    websocket.send.side_effect = [Exception('Dummy'), None]
+    sender = sut.EventSender(websocket)
+    sender.send(make_event(u'1'))
+    sender.send(make_event(u'2'))
+    sender.close()
+    assert len(sent_frames(websocket)) == 2
+
+
+@pytest.fixture
+def slow_websocket():
+    """WebSocket that blocks until released"""
+    release = threading.Event()
+    ws = Mock()
+    ws.send.side_effect = lambda _: release.wait()
+    ws.release = release
+    return ws
+
+
+def test_drop_oldest(slow_websocket):
+    sender = sut.EventSender(slow_websocket, queue_size=2,
+                             backpressure=DROP_OLDEST)
+    sender.send(make_event(u'0'))
+    while not slow_websocket.send.called:
+        pass  # event 0 is being sent
+    for i in range(1, 5):
+        sender.send(make_event(u'{0}'.format(i)))
+    slow_websocket.release.set()
+    sender.close()
+    assert sender.dropped_count == 2
+    assert sent_frames(slow_websocket) == [u'0', u'3', u'4']
+
+
+def test_spill(slow_websocket):
+    sender = sut.EventSender(slow_websocket, queue_size=1,
+                             backpressure=SPILL)
+    sender.send(make_event(u'0'))
+    while not slow_websocket.send.called:
+        pass
+    for i in range(1, 5):
+        sender.send(make_event(u'{0}'.format(i)))
+    assert sender.spilled_count == 3
+    slow_websocket.release.set()
+    sender.close()
+    assert sent_frames(slow_websocket) == [u'0', u'1', u'2', u'3', u'4']
+
+
+def test_flush_waits_for_spilled_events():
+    ws = Mock()
+    ws.send.side_effect = lambda _: time.sleep(0.05)
+    sender = sut.EventSender(ws, queue_size=1, backpressure=SPILL)
+    for i in range(5):
+        sender.send(make_event(u'{0}'.format(i)))
+    sender.flush()
+    assert sent_frames(ws) == [u'0', u'1', u'2', u'3', u'4']
+    sender.close()
+
+
+def test_flush_timeout(slow_websocket):
+    sender = sut.EventSender(slow_websocket)
+    sender.send(make_event(u'1'))
+    start = time.time()
+    assert not sender.flush(timeout=0.1)
+    assert time.time() - start < 1
+    slow_websocket.release.set()
+    assert sender.flush(timeout=5)
+    sender.close()
+
+
+@pytest.fixture
+def offline_spool(tmpdir):
+    return Spool(str(tmpdir.join('events.spool')))
+
+
+def test_close_timeout(slow_websocket, offline_spool):
+    sender = sut.EventSender(slow_websocket, offline_spool=offline_spool)
+    for i in range(3):
+        sender.send(make_event(u'{0}'.format(i)))
+    while not slow_websocket.send.called:
+        pass  # event 0 is being sent
+    start = time.time()
+    sender.close(timeout=0.1)
+    assert time.time() - start < 1
+    assert len(offline_spool) == 2
+    slow_websocket.release.set()
+    sender._thread.join(5)
+    assert not sender._thread.is_alive()
+
+
+def test_offline_spool(offline_spool, websocket):
+    connect = Mock(side_effect=IOError('Connection refused'))
+    sender = sut.EventSender(None, connect=connect,
+                             offline_spool=offline_spool)
+    assert not sender.is_connected
+    sender.send(make_event(u'1'))
+    sender.flush()
+    assert len(offline_spool) == 1
+    assert connect.called
+
+    # reconnect once the backoff period has elapsed
+    connect.side_effect = None
+    connect.return_value = websocket
+    sender._next_reconnect = 0
+    sender.send(make_event(u'2'))
+    sender.close()
+    assert sent_frames(websocket) == [u'1', u'2']
+    assert not len(offline_spool)
+
+
+def test_undecodable_offline_record(offline_spool, websocket):
+    offline_spool.append(b'{"a"')
+    offline_spool.append(u'1')
+    sender = sut.EventSender(websocket, offline_spool=offline_spool)
+    sender.send(make_event(u'2'))
+    assert sender.flush(timeout=5)
+    assert sender._thread.is_alive()
+    sender.close()
+    assert sent_frames(websocket) == [u'1', u'2']
+
+
+def test_unexpected_error_does_not_stop_sender(websocket, monkeypatch):
+    serialize = sut._serialize
+    monkeypatch.setattr(sut, '_serialize', Mock(
+        side_effect=[RuntimeError('Dummy'), serialize(make_event(u'2'))]))
+    sender = sut.EventSender(websocket, batch_size=1)
+    sender.send(make_event(u'1'))
+    sender.send(make_event(u'2'))
+    sender.close()
+    assert sent_frames(websocket) == [u'2']
+
+
+def test_reconnect_backoff(monkeypatch, offline_spool):
+    now = [100.0]
+    monkeypatch.setattr(sut, 'monotonic', lambda: now[0])
+    connect = Mock(side_effect=IOError('Connection refused'))
+    sender = sut.EventSender(None, connect=connect,
+                             offline_spool=offline_spool)
+    sender.close()
+    delays = []
+    for _ in range(10):
+        connect.reset_mock()
+        assert not sender._ensure_connection()
+        assert connect.called
+        delays.append(sender._next_reconnect - now[0])
+        assert not sender._ensure_connection()  # within backoff period
+        now[0] = sender._next_reconnect
+    assert delays[:3] == [sut.INITIAL_RECONNECT_DELAY,
+                          2 * sut.INITIAL_RECONNECT_DELAY,
+                          4 * sut.INITIAL_RECONNECT_DELAY]
+    assert delays[-1] == sut.MAX_RECONNECT_DELAY
+
+
+def test_send_error_reconnects(offline_spool):
+    broken, ws = Mock(), Mock()
+    broken.send.side_effect = IOError('Connection reset')
+    connect = Mock(return_value=ws)
+    sender = sut.EventSender(broken, connect=connect,
+                             offline_spool=offline_spool)
+    sender.send(make_event(u'1'))
+    sender.send(make_event(u'2'))
+    sender.close()
+    assert broken.close.called
+    assert sent_frames(ws) == [u'1', u'2']
+    assert ws.close.called
+
+
+def test_undeliverable_without_spool():
+    connect = Mock(side_effect=IOError('Connection refused'))
+    sender = sut.EventSender(None, connect=connect)
+    sender.send(make_event(u'1'))
+    sender.close()
+    assert sender.undeliverable_count == 1
+
+
+def test_invalid_encoding(websocket):
+    with pytest.raises(ValueError):
+        sut.EventSender(websocket, encoding='xyz')
+
+
+def test_compact_encoding(websocket):
+    sender = sut.EventSender(websocket, encoding=sut.wireformat.COMPACT)
+    sender.send(make_event(u'{"a": 1}'))
+    sender.close()
+    assert not websocket.send.called
+    frame = websocket.send_binary.call_args[0][0]
+    assert sut.wireformat.CompactDecoder().decode(frame) == [{'a': 1}]
+
+
+def test_negotiation_fallback(websocket):
+    websocket.recv.side_effect = Exception('timed out')
+    sender = sut.EventSender(websocket, encoding=sut.wireformat.AUTO)
+    sender.send(make_event(u'1'))
+    sender.close()
+    assert sent_frames(websocket)[1:] == [u'1']  # after the offer
+
+
+def test_unserializable_event_dropped(websocket):
+    sender = sut.EventSender(websocket, batch_size=2, flush_interval=10)
+    sender.send(Mock(data={'x': object()}))
+    sender.send(make_event(u'2'))
+    sender.close()
+    assert sent_frames(websocket) == [u'2']
+    assert sender.is_connected
+
+
+def test_eager_connect(websocket):
+    connected = threading.Event()
+    release = threading.Event()
+
+    def connect():
+        connected.set()
+        release.wait(5)
+        return websocket
+
+    sender = sut.EventSender(None, connect=connect, eager_connect=True)
+    assert connected.wait(5)  # before any event has been sent
+    sender.send(make_event(u'1'))  # queued while connecting
+    assert not sender.is_connected
+    release.set()
+    sender.close()
+    assert sent_frames(websocket) == [u'1']
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for distribution of tests to shards"""
+
+from __future__ import absolute_import
+from builtins import str
+
+import pytest
+from mock import Mock
+import pytest_purkinje.sharding as sut
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('1/1', (0, 1)),
+    ('3/4', (2, 4)),
+])
+def test_parse_shard(text, expected):
+    assert sut.parse_shard(text) == expected
+
+
+@pytest.mark.parametrize('text', ['1', 'a/b', '0/2', '3/2', '1/2/3'])
+def test_parse_shard_invalid(text):
+    with pytest.raises(ValueError):
+        sut.parse_shard(text)
+
+
+def _loads(plan, durations, count):
+    result = [0] * count
+    for nodeid, shard in plan.items():
+        result[shard] += durations[nodeid]
+    return result
+
+
+def test_plan_balanced():
+    durations = {'a::1': 50, 'a::2': 50, 'b::1': 60, 'c::1': 40,
+                 'd::1': 5, 'd::2': 5, 'e::1': 90}
+    estimates = Mock(duration=durations.get)
+    plan = sut.plan_shards(sorted(durations), 3, estimates)
+    assert sorted(plan) == sorted(durations)
+    assert _loads(plan, durations, 3) == [100, 100, 100]
+    # modules are kept together
+    assert plan['a::1'] == plan['a::2']
+
+
+def test_plan_splits_long_modules():
+    durations = {'a::1': 100, 'a::2': 100, 'b::1': 10, 'b::2': 10}
+    plan = sut.plan_shards(sorted(durations), 2,
+                           Mock(duration=durations.get))
+    assert plan['a::1'] != plan['a::2']
+
+
+def test_plan_without_history():
+    nodeids = ['a::{0}'.format(x) for x in range(4)] + ['b::1', 'c::1']
+    plan = sut.plan_shards(nodeids, 2)
+    assert sorted(plan.values()).count(0) == 3
+
+
+def test_plan_deterministic():
+    nodeids = ['{0}::1'.format(x) for x in 'abcdefgh']
+    assert sut.plan_shards(nodeids, 3) == sut.plan_shards(nodeids, 3)
+
+
+def test_fallback_shard():
+    assert sut.fallback_shard('a::1', 4) == sut.fallback_shard('a::1', 4)
+    assert 0 <= sut.fallback_shard('a::1', 4) < 4
+
+
+def test_coordinator_plan(tmpdir):
+    dir_ = str(tmpdir.join('shards'))
+    first = sut.ShardCoordinator(dir_, 0, 2)
+    second = sut.ShardCoordinator(dir_, 1, 2)
+    assert first.plan(lambda: {'a::1': 1}) == ({'a::1': 1}, True)
+    create = Mock(return_value={'a::1': 0})
+    assert second.plan(create) == ({'a::1': 1}, False)
+    assert not create.called
+    assert sorted(tmpdir.join('shards').listdir()) == [
+        tmpdir.join('shards', sut.PLAN_FILE)]
+
+
+def test_coordinator_finish(tmpdir):
+    dir_ = str(tmpdir)
+    shards = [sut.ShardCoordinator(dir_, x, 3) for x in range(3)]
+    assert not shards[2].finish()
+    assert not shards[0].finish()
+    assert shards[1].finish()
+    # only once
+    assert not shards[1].finish()
+
+
+def test_coordinator_announced(tmpdir):
+    dir_ = str(tmpdir.join('shards'))
+    planner, other = [sut.ShardCoordinator(dir_, x, 2) for x in range(2)]
+    assert not other.wait_announced(0.1)
+    planner.announced()
+    assert other.wait_announced(0.1)
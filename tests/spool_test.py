@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for event spool"""
+
+import os.path as op
+import pytest
+import pytest_purkinje.spool as sut
+
+
+@pytest.fixture
+def spool():
+    return sut.Spool()
+
+
+def test_empty(spool):
+    assert len(spool) == 0
+    assert spool.pop_all() == []
+
+
+def test_append_pop(spool):
+    spool.append(u'abc')
+    spool.append(b'de')
+    spool.append(u'')
+    assert len(spool) == 3
+    assert spool.pop_all() == [b'abc', b'de', b'']
+    assert len(spool) == 0
+    assert spool.pop_all() == []
+
+
+def test_append_after_pop(spool):
+    spool.append(u'first')
+    spool.pop_all()
+    spool.append(u'second')
+    assert spool.pop_all() == [b'second']
+
+
+def test_file_spool(tmpdir):
+    path = op.join(str(tmpdir), 'spool.bin')
+    spool = sut.Spool(path)
+    spool.append(u'xyz')
+    assert spool.pop_all() == [b'xyz']
+    spool.close()
+
+
+def test_reopen_file_spool(tmpdir):
+    path = op.join(str(tmpdir), 'sub', 'spool.bin')
+    spool = sut.Spool(path)
+    spool.append(u'abc')
+    spool.append(u'de')
+    spool.close()
+
+    spool = sut.Spool(path)
+    assert len(spool) == 2
+    spool.append(u'f')
+    assert spool.pop_all() == [b'abc', b'de', b'f']
+    spool.close()
+
+
+def test_incomplete_record_ignored(tmpdir):
+    path = op.join(str(tmpdir), 'spool.bin')
+    with open(path, 'wb') as f:
+        f.write(sut.RECORD_HEADER.pack(3) + b'abc')
+        f.write(sut.RECORD_HEADER.pack(10) + b'xy')
+    spool = sut.Spool(path)
+    assert len(spool) == 1
+    assert spool.pop_all() == [b'abc']
+    spool.close()
+
+
+def test_append_after_incomplete_record(tmpdir):
+    path = op.join(str(tmpdir), 'spool.bin')
+    spool = sut.Spool(path)
+    spool.append(u'abc')
+    spool.append(u'{"a": 1}')
+    spool.close()
+    with open(path, 'r+b') as f:
+        f.truncate(op.getsize(path) - 3)  # cut the last record short
+
+    spool = sut.Spool(path)
+    assert len(spool) == 1
+    spool.append(u'def')
+    spool.close()
+    assert op.getsize(path) == 2 * (sut.RECORD_HEADER.size + 3)
+    spool = sut.Spool(path)
+    assert spool.pop_all() == [b'abc', b'def']
+    spool.close()
+
+
+def test_max_size():
+    spool = sut.Spool(max_size=2 * sut.RECORD_HEADER.size + 5)
+    assert spool.append(u'abc')
+    assert not spool.append(u'def')
+    assert spool.append(u'de')
+    assert len(spool) == 2
+    spool.pop_all()
+    assert spool.append(u'def')
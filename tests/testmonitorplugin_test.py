@@ -11,13 +11,15 @@
 from __future__ import absolute_import
 from builtins import str
 import shutil
+import sys
+import threading
 import os
 import pytest
 import flotsam.file_util as fu
 import json
-import time
 from .conftest import TESTDATA_DIR
 import pytest_purkinje.testmonitorplugin as sut
+from pytest_purkinje.options import add_options
 import purkinje_messages.message as msg
 from mock import Mock
 
@@ -37,12 +39,26 @@ def plugin(mock_ws):
     return sut.TestMonitorPlugin(TEST_WEBSOCKET_URL)
 
 
+@pytest.fixture
+def config(tmpdir):
+    """py.test configuration with default values of all plugin options"""
+    parser = Mock()
+    add_options(parser)
+    result = Mock()
+    result.options = dict((x[1]['dest'], x[1]['default'])
+                          for x in parser.addoption.call_args_list)
+    result.getoption.side_effect = lambda name: result.options[name]
+    result.rootpath = str(tmpdir)
+    return result
+
+
 @pytest.fixture
 def report():
     return Mock(fs_path='dummy_path',
                 nodeid='dummy_path::test_1',
                 outcome='passed',
-                when='call')
+                when='call',
+                duration=0.005)
 
 
 def test_1(plugin):
@@ -51,9 +67,10 @@ def test_1(plugin):
 
 
 def test_send_event(plugin):
-    mock_event = Mock()
+    mock_event = Mock(data={})
     plugin.send_event(mock_event)
-    assert mock_event.serialize.called
+    plugin.flush_events()
+    assert mock_event.validate.called
     assert plugin._websocket.send.called
 
 
@@ -64,8 +81,9 @@ def test_send_event_does_not_raise(plugin):
     def do_raise():
         raise Exception('Dummy exception')
 
-    mock_event.serialize.side_effect = do_raise
+    mock_event.validate.side_effect = do_raise
     plugin.send_event(mock_event)
+    plugin.flush_events()
     assert not plugin._websocket.send.called
 
 
@@ -96,6 +114,11 @@ def test_pytest_sessionstart(plugin, monkeypatch):
     assert not plugin.send_event.called
 
 
+def test_pytest_sessionfinish_drains_queue(plugin):
+    plugin.pytest_sessionfinish()
+    assert len(plugin._websocket.send.call_args_list) == 2
+
+
 def test_pytest_sessionfinish(plugin, monkeypatch):
     monkeypatch.setattr(plugin, 'send_event', Mock())
     plugin.pytest_sessionfinish()
@@ -111,6 +134,7 @@ def test_pytest_sessionfinish(plugin, monkeypatch):
 
 def test_works_if_no_connection(plugin):
     plugin._websocket = None
+    plugin._sender = None
     assert not plugin.is_websocket_connected()
     mock_event = Mock()
     plugin.send_event(mock_event)
@@ -118,13 +142,10 @@ def test_works_if_no_connection(plugin):
 
 
 def test_pytest_runtest_logreport(plugin, report, monkeypatch):
-    start_time = time.time()
     monkeypatch.setattr(plugin, 'send_event', Mock())
-    monkeypatch.setattr(sut.time,
-                        'time',
-                        Mock(return_value=start_time + 5))
-
-    monkeypatch.setattr(plugin, '_test_cases', {report.nodeid: start_time})
+    monkeypatch.setattr(plugin, '_test_cases',
+                        {report.nodeid: {'setup': 3000000}})
+    report.duration = 5.0
     plugin.pytest_runtest_logreport(report)
     assert len(plugin.send_event.call_args_list) == 2
 
@@ -145,25 +166,22 @@ def test_pytest_runtest_logreport_starts_session_only_once(
     monkeypatch.setattr(plugin, 'send_event', Mock())
     monkeypatch.setattr(plugin,
                         '_test_cases',
-                        {report.nodeid: time.time()})
+                        {report.nodeid: {'setup': 0}})
     plugin.pytest_runtest_logreport(report)
     assert len(plugin.send_event.call_args_list) == 2
 
 
-def test_pytest_runtest_logreport_store_tc_start_time(plugin,
-                                                      monkeypatch,
-                                                      report):
-    start_time = time.time()
+def test_pytest_runtest_logreport_store_setup_duration(plugin,
+                                                       monkeypatch,
+                                                       report):
     monkeypatch.setattr(plugin, 'send_event', Mock())
-    monkeypatch.setattr(sut.time,
-                        'time',
-                        Mock(return_value=start_time))
     report.when = 'setup'
+    report.duration = 0.0012345
     plugin.pytest_runtest_logreport(report)
     assert len(plugin.send_event.call_args_list) == 0
     assert len(plugin.reports) == 0
     assert report.nodeid in plugin._test_cases
-    assert plugin._test_cases[report.nodeid] == start_time
+    assert plugin._test_cases[report.nodeid] == {'setup': 1234}
 
 
 def test_pytest_runtest_logreport_ignore_tc_not_found(plugin,
@@ -253,15 +271,662 @@ def test_empty_single_pass(tmpdir, plugin, monkeypatch):
         os.chdir(orig_path)
 
 
-def test_pytest_addoption():
-    parser = Mock()
-    sut.pytest_addoption(parser)
-    print(parser.addoption.call_args_list)
-    assert parser.addoption.call_args_list[0][0][0] == '--websocket_host'
-    assert parser.addoption.call_args_list[1][0][0] == '--websocket_port'
+def test_repeated_sessions_in_process(tmpdir, mock_ws, monkeypatch):
+    """Warm workers (see workerpool) execute py.test repeatedly in the
+       same process; each session reports only its own test cases
+    """
+    test_proj_path = str(tmpdir.join('singlepass'))
+    shutil.copytree(TESTDATA_DIR + '/testproj/singlepass', test_proj_path)
+    fu.ensure_deleted(test_proj_path + '/__pycache__')
+    # may have been imported from another copy by an earlier test
+    monkeypatch.delitem(sys.modules, 'simple_test', raising=False)
+    args = [test_proj_path, '-p', 'pytest_purkinje.plugin', '--purkinje',
+            '--purkinje_sync_connect', '-p', 'no:cacheprovider',
+            '--purkinje_spool', str(tmpdir.join('events.spool'))]
 
+    assert pytest.main(args) == 0
+    assert pytest.main(args) == 0
 
-def test_pytest_configure():
-    config = Mock()
+    frames = [json.loads(x[0][0]) for x in mock_ws.send.call_args_list]
+    events = [y for x in frames for y in (x if isinstance(x, list) else [x])]
+    assert [x['tc_count'] for x in events
+            if x['type'] == 'session_started'] == [1, 1]
+
+
+def test_pytest_configure(config, mock_ws):
     sut.pytest_configure(config)
     assert config.pluginmanager.register.called
+
+
+@pytest.mark.parametrize('attr', ['workerinput', 'slaveinput'])
+def test_pytest_configure_xdist_worker(attr, config):
+    setattr(config, attr, {'workerid': 'gw0'})
+    sut.pytest_configure(config)
+    assert not config.pluginmanager.register.called
+
+
+def test_pytest_configure_coverage_index(config, mock_ws, tmpdir):
+    config.options['purkinje_coverage_index'] = str(tmpdir.join('cov.db'))
+    sut.pytest_configure(config)
+    plugins = [x[0][0] for x in config.pluginmanager.register.call_args_list]
+    assert [type(x) for x in plugins] == [
+        sut.CoveragePlugin, sut.TestMonitorPlugin]
+
+
+def test_xdist_node_collection_finished(plugin, monkeypatch):
+    monkeypatch.setattr(plugin, 'send_event', Mock())
+    ids = ['a_test.py::test_1', 'a_test.py::test_2']
+    plugin.pytest_xdist_node_collection_finished(Mock(), ids)
+    plugin.pytest_xdist_node_collection_finished(Mock(), ids)
+
+    assert len(plugin.send_event.call_args_list) == 1
+    event = plugin.send_event.call_args_list[0][0][0]
+    assert type(event) == msg.SessionStartedEvent
+    assert event['tc_count'] == 2
+
+
+def test_pytest_configure_history(config, mock_ws, tmpdir):
+    config.options['purkinje_history'] = str(tmpdir.join('history.json'))
+    config.options['purkinje_failed_first'] = True
+    sut.pytest_configure(config)
+    plugin = config.pluginmanager.register.call_args[0][0]
+    assert isinstance(plugin._history, sut.TestHistory)
+    assert plugin._reorder
+
+
+def test_history_recorded(mock_ws, report, tmpdir):
+    history = sut.TestHistory(str(tmpdir.join('history.json')))
+    plugin = sut.TestMonitorPlugin(TEST_WEBSOCKET_URL, history=history)
+    report.when = 'setup'
+    report.failed = False
+    plugin.pytest_runtest_logreport(report)
+    report.when = 'call'
+    report.outcome = 'failed'
+    report.failed = True
+    plugin.pytest_runtest_logreport(report)
+    assert history.failed(report.nodeid)
+    assert history.duration(report.nodeid) is not None
+
+    plugin.pytest_sessionfinish()
+    assert tmpdir.join('history.json').exists()
+
+
+def test_history_setup_error(mock_ws, report, tmpdir):
+    history = sut.TestHistory(str(tmpdir.join('history.json')))
+    plugin = sut.TestMonitorPlugin(TEST_WEBSOCKET_URL, history=history)
+    report.when = 'setup'
+    report.outcome = 'failed'
+    report.failed = True
+    plugin.pytest_runtest_logreport(report)
+    assert history.failed(report.nodeid)
+
+
+@pytest.mark.parametrize('reorder', [True, False])
+def test_collection_modifyitems(reorder, mock_ws):
+    history = Mock()
+    plugin = sut.TestMonitorPlugin(TEST_WEBSOCKET_URL, history=history,
+                                   reorder=reorder)
+    items = [Mock()]
+    plugin.pytest_collection_modifyitems(Mock(), Mock(), items)
+    assert history.order.called == reorder
+
+
+def test_connection_error_spools_events(monkeypatch, tmpdir):
+    monkeypatch.setattr(sut.websocket, 'create_connection',
+                        Mock(side_effect=IOError('Connection refused')))
+    spool_path = str(tmpdir.join('events.spool'))
+    plugin = sut.TestMonitorPlugin(TEST_WEBSOCKET_URL,
+                                   spool_path=spool_path)
+    assert not plugin.is_websocket_connected()
+    plugin.send_event(Mock(data={}))
+    plugin.pytest_sessionfinish()
+    records = sut.Spool(spool_path).pop_all()
+    assert len(records) == 3  # including session termination events
+    assert records[0] == b'{}'
+
+
+def test_spooled_events_replayed_next_session(mock_ws, tmpdir):
+    spool_path = str(tmpdir.join('events.spool'))
+    spool = sut.Spool(spool_path)
+    spool.append(u'{"old": 1}')
+    spool.close()
+    plugin = sut.TestMonitorPlugin(TEST_WEBSOCKET_URL,
+                                   spool_path=spool_path)
+    plugin.pytest_sessionfinish()
+    assert mock_ws.send.call_args_list[0][0][0] == u'{"old": 1}'
+
+
+def test_invalid_url(monkeypatch):
+    monkeypatch.setattr(sut.websocket, 'create_connection',
+                        Mock(side_effect=ValueError('Invalid URL')))
+    plugin = sut.TestMonitorPlugin('xyz')
+    assert plugin._sender is None
+
+
+def test_pytest_configure_spool(config, mock_ws, tmpdir):
+    sut.pytest_configure(config)
+    plugin = config.pluginmanager.register.call_args[0][0]
+    assert tmpdir.join('.purkinje', 'events.spool').exists()
+    plugin.pytest_sessionfinish()
+
+
+def test_suite_identity_computed_once(plugin, report, monkeypatch):
+    monkeypatch.setattr(plugin, 'send_event', Mock())
+    hash_suite = Mock(side_effect=sut._hash_suite)
+    monkeypatch.setattr(sut, '_hash_suite', hash_suite)
+    getcwd = Mock(return_value='/abc/xyz')
+    monkeypatch.setattr(sut.os, 'getcwd', getcwd)
+    for i in range(3):
+        report.nodeid = 'dummy_path::test_{0}'.format(i)
+        report.when = 'setup'
+        plugin.pytest_runtest_logreport(report)
+        report.when = 'call'
+        plugin.pytest_runtest_logreport(report)
+    plugin.pytest_sessionfinish()
+    assert len(plugin.send_event.call_args_list) == 6
+    assert hash_suite.call_count == 1
+    assert getcwd.call_count == 1
+
+
+def test_suite_key(mock_ws, monkeypatch):
+    monkeypatch.setattr(sut.os, 'getcwd', Mock(return_value='/abc/xyz'))
+    monkeypatch.setattr(sut.socket, 'gethostname',
+                        Mock(return_value='testhost'))
+    plugin = sut.TestMonitorPlugin(TEST_WEBSOCKET_URL, suite_key='abc123')
+    other = sut.TestMonitorPlugin(TEST_WEBSOCKET_URL)
+    assert plugin.suite_name() == 'testhost: /abc/xyz (abc123)'
+    assert plugin.suite_hash() != other.suite_hash()
+
+
+def test_resolve_suite_key(tmpdir):
+    assert sut.resolve_suite_key('abc', str(tmpdir)) == 'abc'
+    assert sut.resolve_suite_key('rootdir', str(tmpdir)) == str(tmpdir)
+
+
+def test_resolve_suite_key_git(monkeypatch, tmpdir):
+    check_output = Mock(return_value=b'0123abc\n')
+    monkeypatch.setattr(sut.subprocess, 'check_output', check_output)
+    assert sut.resolve_suite_key('git-commit', str(tmpdir)) == '0123abc'
+    assert check_output.call_args[0][0] == ['git', 'rev-parse', 'HEAD']
+
+    check_output.side_effect = OSError('git not found')
+    assert sut.resolve_suite_key('git-branch', str(tmpdir)) is None
+
+
+def _run_phases(plugin, report, durations):
+    for when, duration in zip(['setup', 'call', 'teardown'], durations):
+        report.when = when
+        report.duration = duration
+        plugin.pytest_runtest_logreport(report)
+
+
+@pytest.mark.parametrize('phase_timings', [True, False])
+def test_phase_timings(phase_timings, mock_ws, report, monkeypatch):
+    plugin = sut.TestMonitorPlugin(TEST_WEBSOCKET_URL,
+                                   phase_timings=phase_timings)
+    monkeypatch.setattr(plugin, 'send_event', Mock())
+    report.failed = False
+    report.fspath = 'dummy_path'
+    _run_phases(plugin, report, [0.5, 0.25, 0.125])
+
+    events = [x[0][0] for x in plugin.send_event.call_args_list]
+    assert events[1]['duration'] == 250  # call only, without setup
+    if phase_timings:
+        assert len(events) == 3
+        assert type(events[2]) == sut.TestCaseTimingEvent
+        assert events[2]['setup_us'] == 500000
+        assert events[2]['call_us'] == 250000
+        assert events[2]['teardown_us'] == 125000
+        events[2].serialize()
+    else:
+        assert len(events) == 2
+
+
+def test_test_cases_freed_after_teardown(plugin, report, monkeypatch):
+    monkeypatch.setattr(plugin, 'send_event', Mock())
+    report.failed = False
+    _run_phases(plugin, report, [0.001, 0.001, 0.001])
+    assert not plugin._test_cases
+
+
+def _large_reports(count):
+    from _pytest.reports import TestReport as Report
+    for i in range(count):
+        nodeid = 'a_test.py::test_{0}'.format(i)
+        for when in ('setup', 'call', 'teardown'):
+            yield Report(nodeid, ('a_test.py', i, 'test'), {}, 'passed',
+                         None, when,
+                         [('Captured stdout ' + when, 'x' * 10000)],
+                         duration=0.001)
+
+
+def _retained_memory(plugin, count):
+    """:return: memory (bytes) allocated by the plugin for test reports
+    """
+    import gc
+    import tracemalloc
+    plugin.send_event = Mock()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for report in _large_reports(count):
+            plugin.pytest_runtest_logreport(report)
+        plugin.send_event = None  # drop recorded calls
+        gc.collect()
+        return tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.parametrize('retain,limit', [
+    (sut.RETAIN_SUMMARY, 400),
+    (sut.RETAIN_NONE, 50),
+])
+def test_retained_memory(retain, limit, mock_ws):
+    count = 1000
+    plugin = sut.TestMonitorPlugin(TEST_WEBSOCKET_URL,
+                                   retain_reports=retain)
+    # reports include 10 kB of captured output each; per test case,
+    # at most a few hundred bytes may be kept
+    assert _retained_memory(plugin, count) < count * limit
+    assert len(plugin.reports) == (count if retain == sut.RETAIN_SUMMARY
+                                   else 0)
+    assert not plugin._test_cases
+
+
+def test_retain_all_with_section_limit(mock_ws):
+    plugin = sut.TestMonitorPlugin(TEST_WEBSOCKET_URL,
+                                   section_limiter=sut.SectionLimiter(100))
+    plugin.send_event = Mock()
+    for report in _large_reports(2):
+        plugin.pytest_runtest_logreport(report)
+    assert len(plugin.reports) == 2
+    assert all(len(x.sections[0][1]) < 200 for x in plugin.reports)
+
+
+def test_pytest_configure_retain_reports(config, mock_ws):
+    config.options['purkinje_retain_reports'] = 'summary'
+    config.options['purkinje_max_section_size'] = 100
+    sut.pytest_configure(config)
+    plugin = config.pluginmanager.register.call_args[0][0]
+    assert plugin._retain_reports == 'summary'
+    assert isinstance(plugin._section_limiter, sut.SectionLimiter)
+
+
+def test_resources_reported(plugin, report, monkeypatch):
+    monkeypatch.setattr(plugin, 'send_event', Mock())
+    report.failed = False
+    report.fspath = 'dummy_path'
+    report.purkinje_resources = {'cpu_us': 10, 'max_rss_delta_kb': 0,
+                                 'gc_collections': 1}
+    _run_phases(plugin, report, [0.001, 0.001, 0.001])
+    event = plugin.send_event.call_args[0][0]
+    assert type(event) == sut.TestCaseResourcesEvent
+    assert event['cpu_us'] == 10
+    event.serialize()
+
+
+def test_pytest_configure_resources(config, mock_ws):
+    config.options['purkinje_resources'] = True
+    sut.pytest_configure(config)
+    plugins = [x[0][0] for x in config.pluginmanager.register.call_args_list]
+    assert [type(x) for x in plugins] == [
+        sut.ResourcePlugin, sut.TestMonitorPlugin]
+
+
+def test_resources_event_alloc_peak():
+    event = sut.TestCaseResourcesEvent(
+        name='test_1', file='a_test.py', suite_hash='abc', cpu_us=1,
+        max_rss_delta_kb=0, gc_collections=0, alloc_peak_kb=12)
+    assert json.loads(event.serialize())['alloc_peak_kb'] == 12
+
+
+def test_progress(mock_ws, report, monkeypatch):
+    plugin = sut.TestMonitorPlugin(TEST_WEBSOCKET_URL, progress_interval=60)
+    monkeypatch.setattr(plugin, 'send_event', Mock())
+    plugin.pytest_collection_modifyitems(
+        None, None, [Mock(nodeid='dummy_path::test_1'),
+                     Mock(nodeid='dummy_path::test_2')])
+    report.failed = False
+    report.fspath = 'dummy_path'
+    plugin.pytest_runtest_logstart(report.nodeid, None)
+    _run_phases(plugin, report, [0.001, 0.001, 0.001])
+    plugin.pytest_sessionfinish()
+
+    events = [x[0][0] for x in plugin.send_event.call_args_list]
+    assert type(events[0]) == msg.SessionStartedEvent
+    progress = [x for x in events if type(x) == sut.SessionProgressEvent]
+    assert len(progress) == 1
+    assert progress[0]['completed'] == 1
+    assert progress[0]['total'] == 2
+    assert progress[0]['slowest_running'] == ''
+    progress[0].serialize()
+
+
+def test_no_progress_by_default(plugin, report, monkeypatch):
+    monkeypatch.setattr(plugin, 'send_event', Mock())
+    plugin.pytest_runtest_logstart(report.nodeid, None)
+    plugin.pytest_sessionfinish()
+    assert not any(type(x[0][0]) == sut.SessionProgressEvent
+                   for x in plugin.send_event.call_args_list)
+
+
+@pytest.mark.parametrize('result_stream, sample, expected', [
+    ('all', 1, ['pass', 'pass', 'pass', 'fail']),
+    ('all', 2, ['pass', 'pass', 'fail']),
+    ('failures', 1, ['fail']),
+    ('none', 1, []),
+])
+def test_result_stream(result_stream, sample, expected, mock_ws, report,
+                       monkeypatch):
+    plugin = sut.TestMonitorPlugin(TEST_WEBSOCKET_URL,
+                                   result_stream=result_stream,
+                                   result_sample=sample)
+    monkeypatch.setattr(plugin, 'send_event', Mock())
+    report.fspath = 'dummy_path'
+    for outcome in ['passed', 'passed', 'passed', 'failed']:
+        report.outcome = outcome
+        report.passed = outcome == 'passed'
+        report.failed = not report.passed
+        _run_phases(plugin, report, [0.001, 0.001, 0.001])
+    verdicts = [x[0][0]['verdict'] for x in plugin.send_event.call_args_list
+                if type(x[0][0]) == msg.TestCaseFinishedEvent]
+    assert verdicts == expected
+
+
+def test_pytest_configure_progress(config, mock_ws):
+    config.options['purkinje_progress_interval'] = 2.5
+    config.options['purkinje_result_stream'] = 'failures'
+    sut.pytest_configure(config)
+    plugin = config.pluginmanager.register.call_args[0][0]
+    assert plugin._progress_reporter._interval == 2.5
+    assert plugin._result_stream == 'failures'
+
+
+def test_history_db_recorded(mock_ws, report, tmpdir):
+    db_path = str(tmpdir.join('history.db'))
+    plugin = sut.TestMonitorPlugin(TEST_WEBSOCKET_URL,
+                                   history_db=sut.HistoryDatabase(db_path))
+    report.failed = False
+    report.fspath = 'dummy_path'
+    _run_phases(plugin, report, [0.001, 0.25, 0.001])
+    report.outcome = 'failed'
+    _run_phases(plugin, report, [0.001, 0.001, 0.001])
+    plugin.pytest_sessionfinish()
+
+    db = sut.HistoryDatabase(db_path)
+    suite = db.suite(plugin.suite_hash())
+    assert suite.failed(report.nodeid)
+    assert suite.statistics(report.nodeid).p50 == 250000
+    db.close()
+
+
+def test_pytest_configure_history_db(config, mock_ws, tmpdir):
+    config.options['purkinje_history_db'] = str(tmpdir.join('history.db'))
+    sut.pytest_configure(config)
+    plugin = config.pluginmanager.register.call_args[0][0]
+    assert plugin._estimates is plugin._suite_history
+    plugin._history_db.close()
+
+
+def test_regression_reported(mock_ws, report, monkeypatch, tmpdir):
+    history_db = sut.HistoryDatabase(str(tmpdir.join('history.db')))
+    plugin = sut.TestMonitorPlugin(
+        TEST_WEBSOCKET_URL, history_db=history_db,
+        regression_detector=sut.RegressionDetector())
+    monkeypatch.setattr(plugin, 'send_event', Mock())
+    report.failed = False
+    report.fspath = 'dummy_path'
+    for duration in [0.1, 0.11, 0.09, 0.1, 0.1, 0.5]:
+        _run_phases(plugin, report, [0.001, duration, 0.001])
+    events = [x[0][0] for x in plugin.send_event.call_args_list
+              if type(x[0][0]) == sut.TestCaseRegressionEvent]
+    assert len(events) == 1
+    assert events[0]['duration_us'] == 500000
+    assert events[0]['baseline_us'] == 100000
+    events[0].serialize()
+    history_db.close()
+
+
+def test_pytest_configure_regressions(config, mock_ws, tmpdir):
+    config.options['purkinje_fail_on_regression'] = True
+    sut.pytest_configure(config)
+    plugins = [x[0][0] for x in config.pluginmanager.register.call_args_list]
+    assert [type(x) for x in plugins] == [sut.TestMonitorPlugin]
+
+    config.options['purkinje_history_db'] = str(tmpdir.join('history.db'))
+    config.pluginmanager.register.reset_mock()
+    sut.pytest_configure(config)
+    plugins = [x[0][0] for x in config.pluginmanager.register.call_args_list]
+    assert [type(x) for x in plugins] == [sut.RegressionPlugin,
+                                          sut.TestMonitorPlugin]
+    assert plugins[1]._regression_detector is not None
+    plugins[1]._history_db.close()
+
+
+def test_quarantine(mock_ws, report, tmpdir):
+    quarantine_path = str(tmpdir.join('quarantine.json'))
+    sut.quarantine.save_quarantine(quarantine_path,
+                                   {'a_test.py::test_1': 'flaky'})
+    plugin = sut.TestMonitorPlugin(
+        TEST_WEBSOCKET_URL,
+        history_db=sut.HistoryDatabase(str(tmpdir.join('history.db'))),
+        quarantine_path=quarantine_path,
+        quarantine_policy=sut.quarantine.QuarantinePolicy(min_flips=1),
+        quarantine_mode='exclude')
+    items = [Mock(nodeid='a_test.py::test_1'),
+             Mock(nodeid='b_test.py::test_1')]
+    config = Mock()
+    plugin.pytest_collection_modifyitems(None, config, items)
+    assert [x.nodeid for x in items] == ['b_test.py::test_1']
+    deselected = config.hook.pytest_deselected.call_args[1]['items']
+    assert [x.nodeid for x in deselected] == ['a_test.py::test_1']
+
+    report.nodeid = 'b_test.py::test_1'
+    report.fspath = 'b_test.py'
+    for outcome in ['passed', 'failed']:
+        report.outcome = outcome
+        _run_phases(plugin, report, [0.001, 0.001, 0.001])
+    plugin.pytest_sessionfinish()
+    assert sut.quarantine.load_quarantine(quarantine_path) == {
+        'b_test.py::test_1': 'flaky'}
+
+
+def test_quarantine_lane_suite(mock_ws, tmpdir):
+    history_db = sut.HistoryDatabase(str(tmpdir.join('history.db')))
+    main = sut.TestMonitorPlugin(TEST_WEBSOCKET_URL, history_db=history_db,
+                                 quarantine_mode='exclude')
+    lane = sut.TestMonitorPlugin(TEST_WEBSOCKET_URL, history_db=history_db,
+                                 quarantine_mode='only')
+    assert lane.suite_name() == main.suite_name() + ' [quarantine]'
+    assert lane.suite_hash() != main.suite_hash()
+    # results are recorded in the same history
+    assert lane._history_suite_hash() == main.suite_hash()
+    history_db.close()
+
+
+def test_tc_count_after_deselection(plugin, monkeypatch):
+    monkeypatch.setattr(plugin, 'send_event', Mock())
+    plugin.tc_count = 3  # collected
+    plugin.pytest_collection_finish(Mock(items=[Mock()] * 2))
+    plugin._send_start_event()
+    assert plugin.send_event.call_args[0][0]['tc_count'] == 2
+
+
+def test_pytest_configure_quarantine(config, mock_ws, tmpdir):
+    config.options['purkinje_quarantine'] = str(tmpdir.join('q.json'))
+    config.options['purkinje_quarantine_mode'] = 'last'
+    sut.pytest_configure(config)
+    plugin = config.pluginmanager.register.call_args[0][0]
+    assert plugin._quarantine_policy is None  # no history database
+    assert plugin._quarantine_mode == 'last'
+
+
+def _shard_plugin(index, shard_dir):
+    plugin = sut.TestMonitorPlugin(TEST_WEBSOCKET_URL, shard=(index, 2),
+                                   shard_dir=shard_dir)
+    plugin.send_event = Mock()
+    return plugin
+
+
+def _event_types(plugin):
+    return [type(x[0][0]) for x in plugin.send_event.call_args_list]
+
+
+def test_shards(mock_ws, tmpdir):
+    shard_dir = str(tmpdir.join('shards'))
+    nodeids = ['a_test.py::test_1', 'b_test.py::test_1',
+               'c_test.py::test_1', 'd_test.py::test_1']
+    selected = []
+    plugins = [_shard_plugin(x, shard_dir) for x in range(2)]
+    for plugin in plugins:
+        items = [Mock(nodeid=x) for x in nodeids]
+        config = Mock()
+        plugin.pytest_collection_modifyitems(None, config, items)
+        selected.append([x.nodeid for x in items])
+        assert len(config.hook.pytest_deselected.call_args[1]['items']) == 2
+    assert sorted(selected[0] + selected[1]) == nodeids
+
+    # a single session is announced and terminated
+    assert _event_types(plugins[0]) == [msg.SessionStartedEvent]
+    assert _event_types(plugins[1]) == []
+    for plugin in plugins:
+        plugin.pytest_sessionfinish()
+    assert _event_types(plugins[0])[1:] == [msg.ConnectionTerminationEvent]
+    assert _event_types(plugins[1]) == [msg.SessionTerminatedEvent,
+                                        msg.ConnectionTerminationEvent]
+
+
+def test_shard_ordering(mock_ws, tmpdir, monkeypatch):
+    shard_dir = str(tmpdir.join('shards'))
+    calls = Mock()
+    plugins = [_shard_plugin(x, shard_dir) for x in range(2)]
+    for i, plugin in enumerate(plugins):
+        monkeypatch.setattr(plugin, 'send_event',
+                            getattr(calls, 'send_event_{0}'.format(i)))
+        monkeypatch.setattr(plugin, 'flush_events',
+                            getattr(calls, 'flush_events_{0}'.format(i)))
+    for plugin in plugins:
+        plugin.pytest_collection_modifyitems(
+            None, Mock(), [Mock(nodeid='a_test.py::test_1'),
+                           Mock(nodeid='b_test.py::test_1')])
+    plugins[1].pytest_sessionfinish()
+    plugins[0].pytest_sessionfinish()
+    names = [x[0] for x in calls.mock_calls]
+    # the session is delivered before other shards run tests, and the
+    # results of all shards before the session is terminated
+    assert names[:2] == ['send_event_0', 'flush_events_0']
+    assert names[2:] == ['flush_events_1', 'send_event_1',
+                         'flush_events_0', 'send_event_0', 'send_event_0']
+    assert isinstance(calls.send_event_0.call_args_list[1][0][0],
+                      msg.SessionTerminatedEvent)
+
+
+def test_shard_without_dir(mock_ws):
+    plugin = _shard_plugin(1, None)
+    items = [Mock(nodeid='a_test.py::test_1'),
+             Mock(nodeid='b_test.py::test_1')]
+    plugin.pytest_collection_modifyitems(None, Mock(), items)
+    assert len(items) == 1
+    assert not plugin._start_message_sent
+
+
+def test_pytest_configure_shard(config, mock_ws, tmpdir):
+    parser = Mock()
+    add_options(parser)
+    option = [x for x in parser.addoption.call_args_list
+              if x[0][0] == '--purkinje_shard'][0]
+    config.options['purkinje_shard'] = option[1]['type']('2/3')
+    config.options['purkinje_shard_dir'] = str(tmpdir)
+    sut.pytest_configure(config)
+    plugin = config.pluginmanager.register.call_args[0][0]
+    assert plugin._shard == (1, 3)
+    assert plugin._shard_coordinator is not None
+
+
+@pytest.mark.parametrize('shard, mode, expected', [
+    (None, 'include', 'events.spool'),
+    ((1, 3), 'include', 'events-2.spool'),
+    (None, 'only', 'events-quarantine.spool'),
+])
+def test_spool_per_process(shard, mode, expected, config):
+    config.options['purkinje_shard'] = shard
+    config.options['purkinje_quarantine_mode'] = mode
+    assert sut._spool_file(config) == expected
+
+
+def test_pytest_configure_collection_cache(config, mock_ws, tmpdir):
+    config.options['purkinje_collection_cache'] = str(
+        tmpdir.join('collection.json'))
+    sut.pytest_configure(config)
+    plugins = [x[0][0] for x in config.pluginmanager.register.call_args_list]
+    assert [type(x) for x in plugins] == [
+        sut.TestMonitorPlugin, sut.CollectionCachePlugin]
+    assert plugins[1]._announce == plugins[0].announce_tests
+
+
+@pytest.mark.parametrize('kwargs, announced', [
+    ({}, True),
+    ({'quarantine_mode': 'last'}, True),
+    ({'quarantine_mode': 'exclude'}, False),
+    ({'shard': (0, 2)}, False),
+])
+def test_announce_tests(mock_ws, monkeypatch, kwargs, announced):
+    plugin = sut.TestMonitorPlugin(TEST_WEBSOCKET_URL, **kwargs)
+    monkeypatch.setattr(plugin, 'send_event', Mock())
+    plugin.announce_tests(7)
+    plugin.announce_tests(7)
+    events = [x[0][0] for x in plugin.send_event.call_args_list]
+    if announced:
+        assert [x['tc_count'] for x in events] == [7]
+        assert plugin._start_message_sent
+    else:
+        assert not events
+
+
+def test_connect_timeouts(mock_ws):
+    sut.TestMonitorPlugin(TEST_WEBSOCKET_URL, connect_timeout=1.5,
+                          send_timeout=0)
+    sut.websocket.create_connection.assert_called_once_with(
+        TEST_WEBSOCKET_URL, timeout=1.5)
+    mock_ws.settimeout.assert_called_once_with(None)
+
+
+def test_background_connect(mock_ws, monkeypatch):
+    release = threading.Event()
+
+    def connect(url, timeout):
+        release.wait(5)
+        return mock_ws
+
+    monkeypatch.setattr(sut.websocket, 'create_connection',
+                        Mock(side_effect=connect))
+    # does not wait for the server
+    plugin = sut.TestMonitorPlugin(TEST_WEBSOCKET_URL,
+                                   background_connect=True)
+    assert not plugin.is_websocket_connected()
+    plugin.send_event(Mock(data={}))
+    release.set()
+    plugin.flush_events()
+    assert plugin.is_websocket_connected()
+    assert mock_ws.send.call_args_list[0][0][0] == u'{}'
+    plugin.pytest_sessionfinish()
+
+
+def test_background_connect_invalid_url(mock_ws):
+    plugin = sut.TestMonitorPlugin('xyz', background_connect=True)
+    assert plugin._sender is None
+    assert not sut.websocket.create_connection.called
+
+
+@pytest.mark.parametrize('sync_connect', [False, True])
+def test_pytest_configure_connect(config, mock_ws, sync_connect):
+    config.options['purkinje_sync_connect'] = sync_connect
+    config.options['purkinje_connect_timeout'] = 0.5
+    sut.pytest_configure(config)
+    plugin = config.pluginmanager.register.call_args[0][0]
+    assert plugin._sender._eager_connect != sync_connect
+    plugin.pytest_sessionfinish()  # the sender thread has connected
+    sut.websocket.create_connection.assert_called_once_with(
+        'ws://localhost:5000/event', timeout=0.5)
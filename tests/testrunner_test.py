@@ -26,16 +26,6 @@ def test_creation(testrunner):
     assert sut.Observer.called
 
 
-def test_get_file_count(testrunner):
-    # The directory itself counts as 1
-    assert testrunner.get_file_count(testrunner._dir) == 1
-    with open(op.join(testrunner._dir, 'a_file'), 'w'):
-        pass
-
-    # The newly created file counts as one, too
-    assert testrunner.get_file_count(testrunner._dir) == 2
-
-
 def test_get_max_user_watches(testrunner):
     lim = testrunner.get_max_user_watches()
     assert type(lim) == int and lim > 0
@@ -63,6 +53,183 @@ def test_start_keyboard_interrupted(testrunner, monkeypatch):
 def test_main(monkeypatch):
     runner = Mock()
     monkeypatch.setattr(sut, 'TestRunner', Mock(return_value=runner))
-    sut.main()
+    sut.main([])
     assert sut.TestRunner.called
     assert runner.start.called
+
+
+def test_start_updates_selector(tmpdir, monkeypatch, obs_mock):
+    monkeypatch.setattr(sut, 'Observer', Mock(return_value=obs_mock))
+    selector = Mock()
+    runner = sut.TestRunner(str(tmpdir), selector)
+    runner.start(single_run=True)
+    assert selector.update.called
+
+
+@pytest.mark.parametrize('argv,uses_graph', [
+    ([], True),
+    (['--selection', 'none'], False),
+])
+def test_main_selection(argv, uses_graph, monkeypatch):
+    monkeypatch.setattr(sut, 'TestRunner', Mock())
+    monkeypatch.setattr(sut.depgraph, 'ImportGraph', Mock())
+    sut.main(argv)
+    selector = sut.TestRunner.call_args[0][1]
+    assert (selector is sut.depgraph.ImportGraph.return_value) == uses_graph
+
+
+def test_create_selector_coverage(tmpdir):
+    selector, pytest_args = sut.create_selector(str(tmpdir), 'coverage')
+    assert isinstance(selector, sut.impactindex.CoverageIndex)
+    assert pytest_args == ['--purkinje_coverage_index',
+                           op.join(str(tmpdir), '.purkinje', 'coverage.db')]
+
+
+def test_check_watch_limit(testrunner, monkeypatch):
+    monkeypatch.setattr(sut.TestRunner, 'get_max_user_watches',
+                        staticmethod(lambda: 10))
+    testrunner.check_watch_limit(10)
+    with pytest.raises(Exception):
+        testrunner.check_watch_limit(11)
+
+
+def test_start_watches_relevant_dirs(tmpdir, testrunner):
+    tmpdir.join('pkg').ensure('mod.py')
+    tmpdir.join('docs').ensure('index.rst')
+    tmpdir.join('.tox', 'py27').ensure('site.py')
+    testrunner.start(single_run=True)
+    watched = sorted(x[0][1] for x in
+                     testrunner.observer.schedule.call_args_list)
+    assert watched == [str(tmpdir), str(tmpdir.join('pkg'))]
+
+
+def test_watch_tree(tmpdir, testrunner, monkeypatch):
+    monkeypatch.setattr(testrunner.event_handler, 'add_paths', Mock())
+    testrunner.start(single_run=True)
+    new_file = tmpdir.join('new', 'sub').ensure('mod.py')
+    testrunner.watch_tree(str(tmpdir.join('new')))
+    assert str(tmpdir.join('new', 'sub')) in testrunner._watches
+    testrunner.event_handler.add_paths.assert_called_once_with(
+        [str(new_file)])
+
+    testrunner.unwatch_tree(str(tmpdir.join('new')))
+    assert str(tmpdir.join('new', 'sub')) not in testrunner._watches
+    assert testrunner.observer.unschedule.call_count == 2
+
+
+def test_watch_tree_excluded(tmpdir, testrunner):
+    tmpdir.join('.tox').ensure('site.py')
+    testrunner.watch_tree(str(tmpdir.join('.tox')))
+    assert not testrunner._watches
+
+
+def test_directory_handler():
+    runner = Mock()
+    handler = sut.DirectoryHandler(runner)
+    handler.on_created(Mock(is_directory=True, src_path='/a/b'))
+    runner.watch_tree.assert_called_once_with('/a/b')
+    handler.on_created(Mock(is_directory=False, src_path='/a/b.py'))
+    assert runner.watch_tree.call_count == 1
+    handler.on_moved(Mock(is_directory=True, src_path='/a/b',
+                          dest_path='/a/c'))
+    runner.unwatch_tree.assert_called_once_with('/a/b')
+    runner.watch_tree.assert_called_with('/a/c')
+
+
+@pytest.mark.parametrize('argv,reorder', [
+    ([], True),
+    (['--no-reorder'], False),
+])
+def test_main_history(argv, reorder, monkeypatch):
+    monkeypatch.setattr(sut, 'TestRunner', Mock())
+    monkeypatch.setattr(sut.depgraph, 'ImportGraph', Mock())
+    sut.main(argv)
+    pytest_args = sut.TestRunner.call_args[0][2]
+    assert '--purkinje' in pytest_args
+    assert '--purkinje_history_db' in pytest_args
+    assert '--purkinje_history' not in pytest_args
+    assert ('--purkinje_failed_first' in pytest_args) == reorder
+
+
+@pytest.mark.parametrize('argv, mode, lane', [
+    ([], 'last', False),
+    (['--quarantine', 'include'], None, False),
+    (['--quarantine', 'lane'], None, True),
+])
+def test_main_quarantine(argv, mode, lane, monkeypatch):
+    monkeypatch.setattr(sut, 'TestRunner', Mock())
+    monkeypatch.setattr(sut.depgraph, 'ImportGraph', Mock())
+    sut.main(argv)
+    pytest_args = sut.TestRunner.call_args[0][2]
+    assert '--purkinje_history_db' in pytest_args
+    assert '--purkinje_quarantine' in pytest_args
+    assert (mode in pytest_args if mode else
+            '--purkinje_quarantine_mode' not in pytest_args)
+    assert (sut.TestRunner.call_args[0][7] is not None) == lane
+
+
+def test_main_shards(monkeypatch):
+    monkeypatch.setattr(sut, 'TestRunner', Mock())
+    monkeypatch.setattr(sut.depgraph, 'ImportGraph', Mock())
+    sut.main(['--shards', '8'])
+    assert sut.TestRunner.call_args[0][8] == 8
+    with pytest.raises(SystemExit):
+        sut.parse_args(['--shards', '8', '--warm-workers', '2'])
+
+
+def test_batch_handler():
+    runner = Mock()
+    handler = sut.BatchHandler(runner)
+    handler.files_changed(['/a/b.py'])
+    runner.event_handler.add_relevant_paths.assert_called_once_with(
+        ['/a/b.py'])
+    handler.directory_created('/a/c')
+    runner.watch_tree.assert_called_once_with('/a/c')
+    handler.directory_deleted('/a/c')
+    runner.unwatch_tree.assert_called_once_with('/a/c')
+    handler.events_lost()
+    assert runner.event_handler.add_all.called
+
+
+def test_inotify_observer(tmpdir, monkeypatch):
+    monkeypatch.setattr(sut.inotify, 'InotifyObserver', Mock())
+    tmpdir.join('a_test.py').write('')
+    runner = sut.TestRunner(str(tmpdir), observer=sut.INOTIFY)
+    assert isinstance(sut.inotify.InotifyObserver.call_args[0][0],
+                      sut.BatchHandler)
+    runner.start(single_run=True)
+    runner.observer.schedule.assert_called_once_with(str(tmpdir))
+    runner.unwatch_tree(str(tmpdir))
+    runner.observer.unschedule.assert_called_once_with(
+        runner.observer.schedule.return_value)
+
+
+@pytest.mark.parametrize('argv, available, observer', [
+    ([], True, 'inotify'),
+    ([], False, 'watchdog'),
+    (['--observer', 'watchdog'], True, 'watchdog'),
+])
+def test_parse_args_observer(argv, available, observer, monkeypatch):
+    monkeypatch.setattr(sut.inotify, 'is_available',
+                        Mock(return_value=available))
+    assert sut.parse_args(argv).observer == observer
+
+
+def test_content_index(tmpdir, monkeypatch, obs_mock):
+    monkeypatch.setattr(sut, 'Observer', Mock(return_value=obs_mock))
+    tmpdir.join('a_test.py').write('')
+    index = Mock()
+    runner = sut.TestRunner(str(tmpdir), content_index=index)
+    runner.start(single_run=True)
+    index.scan.assert_called_once_with([str(tmpdir.join('a_test.py'))])
+
+
+@pytest.mark.parametrize('argv, enabled', [
+    ([], True),
+    (['--no-content-check'], False),
+])
+def test_main_content_check(argv, enabled, monkeypatch):
+    monkeypatch.setattr(sut, 'TestRunner', Mock())
+    monkeypatch.setattr(sut.depgraph, 'ImportGraph', Mock())
+    sut.main(argv)
+    assert (sut.TestRunner.call_args[0][10] is not None) == enabled
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Tests for selection of watched files and directories
+"""
+from __future__ import absolute_import
+from builtins import str
+
+import os
+import os.path as op
+import pytest
+from pytest_purkinje import watchfilter as sut
+
+
+def _create(root, *rel_paths):
+    for rel_path in rel_paths:
+        path = op.join(root, rel_path)
+        if not op.isdir(op.dirname(path)):
+            os.makedirs(op.dirname(path))
+        with open(path, 'w'):
+            pass
+
+
+@pytest.fixture
+def project(tmpdir):
+    root = str(tmpdir)
+    _create(root,
+            'setup.py',
+            'README.rst',
+            'pkg/__init__.py',
+            'pkg/data/table.csv',
+            'build/lib/pkg/__init__.py',
+            '.tox/py27/lib/site.py',
+            'tests/a_test.py')
+    return root
+
+
+@pytest.mark.parametrize('pattern,rel_path,is_dir,expected', [
+    ('*.pyc', 'a/b.pyc', False, True),
+    ('*.pyc', 'a/b.py', False, False),
+    ('build/', 'build', True, True),
+    ('build/', 'build', False, False),
+    ('/build', 'build', True, True),
+    ('a/build', 'b/a/build', True, False),
+    ('docs/*.py', 'docs/conf.py', False, True),
+])
+def test_pattern(pattern, rel_path, is_dir, expected):
+    assert sut.Pattern(pattern).matches(rel_path, is_dir) == expected
+
+
+def test_parse_ignore_file(tmpdir):
+    path = tmpdir.join('.gitignore')
+    path.write('# comment\n\n*.pyc\nbuild/  \n')
+    assert sut.parse_ignore_file(str(path)) == ['*.pyc', 'build/']
+    assert sut.parse_ignore_file(str(tmpdir.join('missing'))) == []
+
+
+def test_is_relevant_file(project):
+    f = sut.WatchFilter(project, exclude=['build/'])
+    assert f.is_relevant_file(op.join(project, 'pkg', '__init__.py'))
+    assert not f.is_relevant_file(op.join(project, 'README.rst'))
+    assert not f.is_relevant_file(
+        op.join(project, 'build', 'lib', 'pkg', '__init__.py'))
+    assert not f.is_relevant_file(
+        op.join(project, '.tox', 'py27', 'lib', 'site.py'))
+
+
+def test_negated_pattern(project):
+    f = sut.WatchFilter(project, exclude=['*.py', '!setup.py'])
+    assert f.is_relevant_file(op.join(project, 'setup.py'))
+    assert not f.is_relevant_file(op.join(project, 'pkg', '__init__.py'))
+
+
+def test_include(project):
+    f = sut.WatchFilter(project, include=['*.py', '*.csv'])
+    assert f.is_relevant_file(op.join(project, 'pkg', 'data', 'table.csv'))
+
+
+def test_gitignore(project):
+    _create(project, '.gitignore')
+    with open(op.join(project, '.gitignore'), 'w') as f:
+        f.write('build/\n')
+    build_file = op.join(project, 'build', 'lib', 'pkg', '__init__.py')
+    assert not sut.WatchFilter(project).is_relevant_file(build_file)
+    assert sut.WatchFilter(project, use_gitignore=False).is_relevant_file(
+        build_file)
+
+
+def test_is_excluded_dir(project):
+    f = sut.WatchFilter(project)
+    assert not f.is_excluded_dir(project)
+    assert f.is_excluded_dir(op.join(project, '.tox', 'py27'))
+    assert f.is_excluded_dir(op.dirname(project))
+
+
+def test_walk(project):
+    f = sut.WatchFilter(project, exclude=['build/'])
+    result = dict((op.relpath(root, project), files)
+                  for root, files in f.walk())
+    assert sorted(result) == ['.', 'pkg', 'pkg/data', 'tests']
+    assert result['.'] == ['setup.py']
+    assert result['pkg/data'] == []
+
+
+def test_watch_dirs(project):
+    f = sut.WatchFilter(project, exclude=['build/'])
+    assert f.watch_dirs() == [project,
+                              op.join(project, 'pkg'),
+                              op.join(project, 'tests')]
+
+
+def test_watch_dirs_includes_parents(project):
+    _create(project, 'src/deep/down/mod.py')
+    f = sut.WatchFilter(project, exclude=['build/'])
+    watched = f.watch_dirs()
+    for rel_path in ('src', 'src/deep', 'src/deep/down'):
+        assert op.join(project, rel_path) in watched
+    assert f.watch_dirs(op.join(project, 'src', 'deep')) == [
+        op.join(project, 'src', 'deep'),
+        op.join(project, 'src', 'deep', 'down')]
+
+
+@pytest.mark.parametrize('include, expected', [
+    (None, ('.py',)),
+    (['*.py', '*.cfg'], ('.py', '.cfg')),
+    (['*.py', 'conftest*'], None),
+    (['*.py[co]'], None),
+])
+def test_name_suffixes(project, include, expected):
+    f = sut.WatchFilter(project, include) if include else \
+        sut.WatchFilter(project)
+    assert f.name_suffixes() == expected
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for event frame encodings"""
+
+import json
+import pytest
+from mock import Mock
+import purkinje_messages.message as msg
+import pytest_purkinje.wireformat as sut
+
+
+SUITE_HASH = 'd41d8cd98f00b204e9800998ecf8427e'
+
+
+def tc_finished(name, file_='a_test.py', verdict='pass'):
+    event = msg.TestCaseFinishedEvent(name=name, file=file_,
+                                      verdict=verdict, duration=12,
+                                      suite_hash=SUITE_HASH)
+    return event.data
+
+
+@pytest.fixture
+def decoder():
+    return sut.CompactDecoder()
+
+
+def test_make_frame_single():
+    assert sut.make_frame([u'{"a": 1}']) == u'{"a": 1}'
+
+
+def test_make_frame_batch():
+    assert sut.make_frame([u'{"a": 1}', u'{"b": 2}']) == \
+        u'[{"a": 1},{"b": 2}]'
+
+
+def test_json_encoder():
+    events = [{'a': 1}, {'b': 2}]
+    assert json.loads(sut.JsonEncoder().encode(events)) == events
+
+
+def test_compact_roundtrip(decoder):
+    events = [tc_finished('test_1'),
+              tc_finished(u'test_ü', verdict='fail'),
+              msg.SessionStartedEvent(suite_name='x', suite_hash='y',
+                                      tc_count=2).data]
+    frame = sut.CompactEncoder().encode(events)
+    assert decoder.decode(frame) == events
+
+
+def test_compact_strings_interned(decoder):
+    encoder = sut.CompactEncoder()
+    event = tc_finished('test_2')
+    first = encoder.encode([tc_finished('test_1')])
+    second = encoder.encode([event])
+    assert len(second) < len(first)
+    assert b'a_test.py' in first and b'a_test.py' not in second
+    decoder.decode(first)
+    assert decoder.decode(second) == [event]
+
+
+def test_compact_smaller_than_json():
+    events = [tc_finished('test_{0}'.format(i)) for i in range(100)]
+    assert (len(sut.CompactEncoder().encode(events)) <
+            len(sut.JsonEncoder().encode(events).encode('utf-8')) / 3)
+
+
+def test_compact_compression(decoder):
+    events = [tc_finished('test_{0}'.format(i)) for i in range(100)]
+    plain = sut.CompactEncoder().encode(events)
+    compressed = sut.CompactEncoder(compress=True).encode(events)
+    assert len(compressed) < len(plain)
+    assert decoder.decode(compressed) == events
+
+
+def test_compact_reset(decoder):
+    encoder = sut.CompactEncoder()
+    decoder.decode(encoder.encode([tc_finished('test_1')]))
+    encoder.reset()
+    # a new receiver only gets frames after the reset
+    event = tc_finished('test_2')
+    assert sut.CompactDecoder().decode(encoder.encode([event])) == [event]
+
+
+def test_compact_fallback_to_json(decoder):
+    event = tc_finished('test_1')
+    event['timestamp'] = 'yesterday'
+    assert decoder.decode(sut.CompactEncoder().encode([event])) == [event]
+
+
+def test_compact_encoding_error_resets():
+    encoder = sut.CompactEncoder()
+    with pytest.raises(TypeError):
+        encoder.encode([tc_finished('test_1'), {'x': object()}])
+    event = tc_finished('test_2')
+    frame = encoder.encode([event])
+    assert sut.CompactDecoder().decode(frame) == [event]
+
+
+def test_decode_invalid(decoder):
+    with pytest.raises(sut.FormatError):
+        decoder.decode(b'XY')
+    with pytest.raises(sut.FormatError):
+        decoder.decode(b'XYZ\x01\x00')
+    with pytest.raises(sut.FormatError):
+        decoder.decode(b'PKC\x01\x00\x09')
+
+
+@pytest.mark.parametrize('answer,compress,expected', [
+    ({'type': 'encoding_selected', 'encoding': sut.COMPACT_ID,
+      'compression': 'zlib'}, True, (sut.COMPACT, True)),
+    ({'type': 'encoding_selected', 'encoding': sut.COMPACT_ID,
+      'compression': None}, True, (sut.COMPACT, False)),
+    ({'type': 'encoding_selected', 'encoding': 'json'}, False,
+     (sut.JSON, False)),
+    ({'type': 'error'}, False, (sut.JSON, False)),
+])
+def test_negotiate(answer, compress, expected):
+    websocket = Mock()
+    websocket.gettimeout.return_value = None
+    websocket.recv.return_value = json.dumps(answer)
+    assert sut.negotiate(websocket, compress) == expected
+    offer = json.loads(websocket.send.call_args[0][0])
+    assert offer['type'] == 'encoding_offer'
+    websocket.settimeout.assert_called_with(None)
+
+
+def test_negotiate_timeout():
+    websocket = Mock()
+    websocket.recv.side_effect = Exception('timed out')
+    assert sut.negotiate(websocket) == (sut.JSON, False)
+
+
+@pytest.mark.parametrize('encoding,expected', [
+    (sut.JSON, sut.JsonEncoder),
+    (sut.COMPACT, sut.CompactEncoder),
+])
+def test_create_encoder(encoding, expected):
+    websocket = Mock()
+    assert isinstance(sut.create_encoder(websocket, encoding), expected)
+    assert not websocket.send.called
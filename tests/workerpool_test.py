@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for pool of warm py.test worker processes"""
+
+import os
+import os.path as op
+import sys
+import pytest
+from mock import Mock
+import pytest_purkinje.workerpool as sut
+
+THIS_DIR = op.dirname(op.abspath(__file__))
+
+
+@pytest.fixture
+def proj(tmpdir):
+    tmpdir.join('pool_sample_test.py').write('def test_1():\n    pass\n')
+    return str(tmpdir)
+
+
+def test_project_files():
+    files = sut.project_files(THIS_DIR)
+    assert op.abspath(__file__).replace('.pyc', '.py') in files
+    assert not any(x.startswith(op.dirname(os.__file__)) for x in files)
+
+
+def test_external_modules():
+    modules = sut.external_modules(THIS_DIR)
+    assert 'os' in modules
+    assert 'pytest' in modules
+    assert 'tests' not in modules
+    assert '__main__' not in modules
+
+
+def test_is_stale(tmpdir):
+    path = tmpdir.join('mod.py')
+    path.write('')
+    worker = sut.WarmWorker.__new__(sut.WarmWorker)
+    worker.loaded_files = {str(path): op.getmtime(str(path))}
+    assert not worker.is_stale()
+    os.utime(str(path), (0, 0))
+    assert worker.is_stale()
+    path.remove()
+    assert worker.is_stale()
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='POSIX only')
+def test_pool(proj):
+    pool = sut.WorkerPool(proj, size=1)
+    try:
+        args = ['-q', '-p', 'no:cacheprovider', proj]
+        assert pool.run(args) == 0
+        worker = pool._workers[0]
+        test_file = op.join(proj, 'pool_sample_test.py')
+        assert test_file in worker.loaded_files
+
+        # unchanged project: worker is reused
+        assert pool.run(args) == 0
+        assert pool._workers[0] is worker
+
+        # modified test module: worker is replaced
+        with open(test_file, 'w') as f:
+            f.write('def test_1():\n    assert False\n')
+        os.utime(test_file, (0, 0))
+        assert pool.run(args) == 1
+        assert pool._workers[0] is not worker
+    finally:
+        pool.close()
+
+
+def test_pool_worker_died(monkeypatch):
+    worker = Mock()
+    worker.run.side_effect = sut.WorkerDied('Dummy')
+    worker.is_stale.return_value = False
+    monkeypatch.setattr(sut, 'WarmWorker', Mock(return_value=worker))
+    pool = sut.WorkerPool('.', size=1)
+    assert pool.run([]) == 1
+    assert sut.WarmWorker.call_count == 2
+
+
+def test_pool_cancel(monkeypatch):
+    monkeypatch.setattr(sut, 'WarmWorker', Mock())
+    pool = sut.WorkerPool('.', size=1)
+    pool.cancel()  # nothing to cancel
+    pool._busy = Mock()
+    pool.cancel()
+    assert pool._busy.kill.called